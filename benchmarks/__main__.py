@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Run benchmarks of jarpc hot paths:
+```
+python -m benchmarks                          # run all
+python -m benchmarks manager client           # run benchmarks with names containing any of given words
+python -m benchmarks --save results.json      # save results
+python -m benchmarks --compare results.json   # compare ops/sec with saved results
+```
+Results depend on machine and load, compare runs made on the same machine.
+Multithreaded and multiprocess benchmarks are separate scripts, e.g. `python -m benchmarks.durable_outbox`,
+`python -m benchmarks.shm_stream`, `python -m benchmarks.prefork`.
+"""
+import argparse
+import logging
+
+from . import bench_client, bench_format, bench_manager  # noqa: F401, registering benchmarks
+from .harness import format_result, get_benchmarks, load_results, run_benchmark, save_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run jarpc benchmarks.')
+    parser.add_argument('patterns', nargs='*', help='run benchmarks with names containing any of these')
+    parser.add_argument('--duration', type=float, default=1.0, help='time (seconds) of throughput phase')
+    parser.add_argument('--samples', type=int, default=10000, help='number of calls timed for percentiles')
+    parser.add_argument('--save', metavar='PATH', help='save results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='compare with results saved before')
+    parser.add_argument('--list', action='store_true', help='list benchmarks and exit')
+    args = parser.parse_args()
+    # error path benchmarks would log a warning on each call
+    logging.getLogger('jarpc').setLevel(logging.ERROR)
+
+    benchmarks = get_benchmarks(args.patterns)
+    if args.list:
+        print('\n'.join(benchmarks))
+        return
+    baseline = load_results(args.compare) if args.compare else {}
+    results = {}
+    for name, setup in benchmarks.items():
+        results[name] = run_benchmark(setup, duration=args.duration, samples=args.samples)
+        print(format_result(name, results[name], baseline.get(name)), flush=True)
+    if args.save:
+        save_results(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
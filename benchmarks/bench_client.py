@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of client round trips over in-memory transports. """
+from jarpc import (AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport, JarpcClient, JarpcManager,
+                   LoopbackTransport)
+
+from .bench_manager import make_dispatcher
+from .harness import benchmark
+from .payloads import LARGE_PARAMS, SMALL_PARAMS
+
+
+class MemoryTransport:
+    """Transport passing serialized request to manager in the same process. """
+
+    def __init__(self, manager: JarpcManager):
+        self.manager = manager
+
+    def __call__(self, request_string, request):
+        return self.manager.handle(request_string)
+
+
+class AsyncMemoryTransport(MemoryTransport):
+    async def __call__(self, request_string, request):
+        return await self.manager.handle(request_string)
+
+
+def _sync_round_trip(transport_class, params: dict, rsvp: bool = True):
+    def setup():
+        client = JarpcClient(transport_class(JarpcManager(make_dispatcher())))
+        return lambda: client(method='echo', params=params, rsvp=rsvp)
+    return setup
+
+
+def _async_round_trip(transport_class, params: dict, rsvp: bool = True):
+    def setup():
+        client = AsyncJarpcClient(transport_class(AsyncJarpcManager(make_dispatcher())))
+
+        async def call():
+            return await client(method='async_echo', params=params, rsvp=rsvp)
+        return call
+    return setup
+
+
+for _transport_name, _sync_transport, _async_transport in [
+    ('memory', MemoryTransport, AsyncMemoryTransport),
+    ('loopback', LoopbackTransport, AsyncLoopbackTransport),
+]:
+    for _name, _params, _rsvp in [('small', SMALL_PARAMS, True), ('large', LARGE_PARAMS, True),
+                                  ('notification', SMALL_PARAMS, False)]:
+        benchmark(f'client.{_transport_name}.{_name}')(_sync_round_trip(_sync_transport, _params, _rsvp))
+        benchmark(f'async_client.{_transport_name}.{_name}')(_async_round_trip(_async_transport, _params, _rsvp))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of request and response serialization. """
+from jarpc import JarpcRequest, JarpcResponse, pack_request, unpack_request
+
+from .harness import benchmark
+from .payloads import LARGE_PARAMS, SMALL_PARAMS
+
+
+def _request_string(params: dict) -> str:
+    return JarpcRequest(method='cook_salad', params=params, ttl=60.0).serialize()
+
+
+@benchmark('format.request.from_json.small')
+def request_from_json_small():
+    request_string = _request_string(SMALL_PARAMS)
+    return lambda: JarpcRequest.from_json(request_string)
+
+
+@benchmark('format.request.from_json.large')
+def request_from_json_large():
+    request_string = _request_string(LARGE_PARAMS)
+    return lambda: JarpcRequest.from_json(request_string)
+
+
+@benchmark('format.request.serialize.small')
+def request_serialize_small():
+    request = JarpcRequest(method='cook_salad', params=SMALL_PARAMS, ttl=60.0)
+    return request.serialize
+
+
+@benchmark('format.request.serialize.large')
+def request_serialize_large():
+    request = JarpcRequest(method='cook_salad', params=LARGE_PARAMS, ttl=60.0)
+    return request.serialize
+
+
+@benchmark('format.request.frame_round_trip')
+def request_frame_round_trip():
+    request = JarpcRequest(method='upload', params=SMALL_PARAMS, attachments=[b'x' * 65536])
+    return lambda: unpack_request(pack_request(request))
+
+
+@benchmark('format.response.round_trip.small')
+def response_round_trip_small():
+    response = JarpcResponse(request_id='1', result=SMALL_PARAMS)
+    return lambda: JarpcResponse.from_json(response.serialize())
+
+
+@benchmark('format.response.round_trip.large')
+def response_round_trip_large():
+    response = JarpcResponse(request_id='1', result=LARGE_PARAMS)
+    return lambda: JarpcResponse.from_json(response.serialize())
+
+
+@benchmark('format.response.round_trip.error')
+def response_round_trip_error():
+    response = JarpcResponse(request_id='1', error={'code': -32602, 'message': 'Invalid params', 'data': 'x'})
+    return lambda: JarpcResponse.from_json(response.serialize())
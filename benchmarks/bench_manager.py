@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of dispatcher lookup and manager request handling. """
+from jarpc import AsyncJarpcManager, JarpcDispatcher, JarpcManager, JarpcMethodNotFound, JarpcRequest
+from jarpc.manager import check_function_call
+
+from .harness import benchmark
+from .payloads import LARGE_PARAMS, SMALL_PARAMS
+
+
+def make_dispatcher(methods: int = 100) -> JarpcDispatcher:
+    dispatcher = JarpcDispatcher()
+
+    @dispatcher.rpc_method
+    def echo(**params):
+        return params
+
+    @dispatcher.rpc_method
+    async def async_echo(**params):
+        return params
+
+    @dispatcher.rpc_method
+    def cook_salad(name, size=1, extras=(), jarpc_request=None):
+        return name
+
+    for i in range(methods):
+        dispatcher.add_rpc_method(echo, f'method_{i}')
+    return dispatcher
+
+
+def _request_string(method: str, params: dict, ttl=None) -> str:
+    return JarpcRequest(method=method, params=params, ttl=ttl).serialize()
+
+
+@benchmark('dispatcher.lookup')
+def dispatcher_lookup():
+    dispatcher = make_dispatcher()
+    return lambda: dispatcher['method_50']
+
+
+@benchmark('dispatcher.lookup.missing')
+def dispatcher_lookup_missing():
+    dispatcher = make_dispatcher()
+
+    def lookup():
+        try:
+            dispatcher['missing']
+        except JarpcMethodNotFound:
+            pass
+    return lookup
+
+
+@benchmark('manager.check_function_call')
+def manager_check_function_call():
+    dispatcher = make_dispatcher()
+    return lambda: check_function_call(dispatcher['cook_salad'], {'name': 'Caesar', 'oops': 1}, {})
+
+
+def _sync_handle(method: str, params: dict):
+    def setup():
+        manager = JarpcManager(make_dispatcher())
+        request_string = _request_string(method, params)
+        return lambda: manager.handle(request_string)
+    return setup
+
+
+def _async_handle(method: str, params: dict):
+    def setup():
+        manager = AsyncJarpcManager(make_dispatcher())
+        request_string = _request_string(method, params)
+
+        async def handle():
+            return await manager.handle(request_string)
+        return handle
+    return setup
+
+
+for _name, _method, _params in [
+    ('small', 'echo', SMALL_PARAMS),
+    ('large', 'echo', LARGE_PARAMS),
+    ('signature', 'cook_salad', SMALL_PARAMS),
+    ('invalid_params', 'cook_salad', {'name': 'Caesar', 'oops': 1}),
+    ('method_not_found', 'missing', SMALL_PARAMS),
+]:
+    benchmark(f'manager.handle.{_name}')(_sync_handle(_method, _params))
+    benchmark(f'async_manager.handle.{_name}')(_async_handle('async_' + _method if _method == 'echo' else _method,
+                                                             _params))
+
+
+@benchmark('manager.handle.parse_error')
+def manager_handle_parse_error():
+    manager = JarpcManager(make_dispatcher())
+    return lambda: manager.handle('{"method": ')
+
+
+@benchmark('manager.handle.expired')
+def manager_handle_expired():
+    manager = JarpcManager(make_dispatcher())
+    request_string = JarpcRequest(method='echo', params=SMALL_PARAMS, ts=0.0, ttl=1.0).serialize()
+    return lambda: manager.handle(request_string)
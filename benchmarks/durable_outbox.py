@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Sustained throughput of durable notifications through `DurableOutboxTransport`.
+
+Calls are made from `--threads` threads for `--duration` seconds, transport does nothing,
+so the result shows the cost of logging and group commit:
+```
+python -m benchmarks.durable_outbox --threads 32 --commit-delay 0.001
+```
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from jarpc import DurableOutboxTransport, JarpcClient
+
+
+def noop_transport(request_string, request):
+    pass
+
+
+def run(threads: int, duration: float, commit_delay: float, fsync: bool, payload_size: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        transport = DurableOutboxTransport(noop_transport, os.path.join(directory, 'outbox.log'),
+                                           commit_delay=commit_delay, fsync=fsync)
+        client = JarpcClient(transport=transport)
+        params = {'payload': 'x' * payload_size}
+        counts = [0] * threads
+        deadline = time.monotonic() + duration
+
+        def call(index):
+            while time.monotonic() < deadline:
+                client(method='notify', params=params, rsvp=False, durable=True)
+                counts[index] += 1
+
+        workers = [threading.Thread(target=call, args=(i,)) for i in range(threads)]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        transport.flush()
+        commits = transport.log.commits
+        transport.close()
+    calls = sum(counts)
+    return {'calls': calls, 'calls_per_second': calls / elapsed, 'calls_per_commit': calls / max(commits, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--commit-delay', type=float, default=0.0)
+    parser.add_argument('--no-fsync', action='store_true')
+    parser.add_argument('--payload-size', type=int, default=100)
+    args = parser.parse_args()
+    result = run(args.threads, args.duration, args.commit_delay, not args.no_fsync, args.payload_size)
+    print(f"{result['calls']} calls, {result['calls_per_second']:.0f} calls/s, "
+          f"{result['calls_per_commit']:.1f} calls per commit")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal benchmark harness: registry of benchmarks, measurement, saving and comparing results.
+
+Benchmark is a setup function registered with `@benchmark(name)`, returning the function to measure
+(sync or async, without arguments). Each benchmark is measured in three phases:
+- throughput: calls are made in a loop for `duration` seconds, ops/sec = calls / elapsed,
+- latency: each of up to `samples` calls (made within `duration` seconds) is timed separately,
+  percentiles are taken from them,
+- allocations: memory allocated by each of `alloc_samples` calls is traced, the mean of peaks is taken.
+GC is collected before each phase, so garbage of previous benchmarks doesn't affect the next one.
+"""
+import asyncio
+import gc
+import inspect
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from jarpc.bench import PERCENTILES, percentile
+
+_benchmarks: Dict[str, Callable[[], Callable]] = OrderedDict()
+
+
+def benchmark(name: str):
+    """Decorator: registers setup function returning function to benchmark. """
+    def register(setup):
+        if name in _benchmarks:
+            raise ValueError(f'Benchmark {name} is already registered')
+        _benchmarks[name] = setup
+        return setup
+    return register
+
+
+def get_benchmarks(patterns: Optional[List[str]] = None) -> Dict[str, Callable[[], Callable]]:
+    """Get registered benchmarks with names containing any of `patterns`, all if `patterns` is empty. """
+    return OrderedDict((name, setup) for name, setup in _benchmarks.items()
+                       if not patterns or any(pattern in name for pattern in patterns))
+
+
+def _measure_sync(func: Callable, duration: float, samples: int, alloc_samples: int, warmup: int) -> dict:
+    deadline = time.perf_counter() + duration / 5
+    for _ in range(warmup):
+        func()
+        if time.perf_counter() >= deadline:
+            break
+
+    gc.collect()
+    calls = 0
+    batch = 1  # grows while batch takes less than a millisecond, so timer calls don't dominate fast benchmarks
+    started = now = time.perf_counter()
+    deadline = started + duration
+    while now < deadline:
+        for _ in range(batch):
+            func()
+        calls += batch
+        batch_started, now = now, time.perf_counter()
+        if now - batch_started < 0.001:
+            batch *= 2
+    elapsed = now - started
+
+    gc.collect()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    for _ in range(samples):
+        call_started = time.perf_counter()
+        func()
+        call_finished = time.perf_counter()
+        latencies.append(call_finished - call_started)
+        if call_finished >= deadline:
+            break
+
+    gc.collect()
+    allocated = 0
+    for _ in range(alloc_samples):
+        tracemalloc.start()
+        func()
+        allocated += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return _make_result(calls, elapsed, latencies, allocated / alloc_samples)
+
+
+async def _measure_async(func: Callable, duration: float, samples: int, alloc_samples: int, warmup: int) -> dict:
+    deadline = time.perf_counter() + duration / 5
+    for _ in range(warmup):
+        await func()
+        if time.perf_counter() >= deadline:
+            break
+
+    gc.collect()
+    calls = 0
+    batch = 1  # grows while batch takes less than a millisecond, so timer calls don't dominate fast benchmarks
+    started = now = time.perf_counter()
+    deadline = started + duration
+    while now < deadline:
+        for _ in range(batch):
+            await func()
+        calls += batch
+        batch_started, now = now, time.perf_counter()
+        if now - batch_started < 0.001:
+            batch *= 2
+    elapsed = now - started
+
+    gc.collect()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    for _ in range(samples):
+        call_started = time.perf_counter()
+        await func()
+        call_finished = time.perf_counter()
+        latencies.append(call_finished - call_started)
+        if call_finished >= deadline:
+            break
+
+    gc.collect()
+    allocated = 0
+    for _ in range(alloc_samples):
+        tracemalloc.start()
+        await func()
+        allocated += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return _make_result(calls, elapsed, latencies, allocated / alloc_samples)
+
+
+def _make_result(calls: int, elapsed: float, latencies: List[float], allocated: float) -> dict:
+    latencies.sort()
+    return {
+        'ops_per_second': calls / elapsed,
+        'calls': calls,
+        'latency_samples': len(latencies),
+        'latency_us': {f'p{q:g}': percentile(latencies, q) * 1e6 for q in PERCENTILES},
+        'alloc_bytes_per_call': allocated,
+    }
+
+
+def run_benchmark(setup: Callable[[], Callable], duration: float = 1.0, samples: int = 10000,
+                  alloc_samples: int = 20, warmup: int = 1000) -> dict:
+    """
+    Measure benchmark.
+    :param setup: registered setup function
+    :param duration: max time (seconds) of throughput and latency phases each, warmup takes up to a fifth of it
+    :param samples: max number of calls timed separately for latency percentiles
+    :param alloc_samples: number of calls traced for allocations
+    :param warmup: max number of calls made before measurement
+    """
+    func = setup()
+    if not inspect.iscoroutinefunction(func):
+        return _measure_sync(func, duration, samples, alloc_samples, warmup)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_measure_async(func, duration, samples, alloc_samples, warmup))
+    finally:
+        loop.close()
+
+
+def get_environment() -> dict:
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def save_results(path: str, results: Dict[str, dict]):
+    with open(path, 'w') as f:
+        json.dump({'environment': get_environment(), 'results': results}, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def format_result(name: str, result: dict, baseline: Optional[dict] = None) -> str:
+    latency = result['latency_us']
+    line = (f'{name:<40} {result["ops_per_second"]:>12,.0f} ops/s  p50 {latency["p50"]:>9.2f}us  '
+            f'p99 {latency["p99"]:>9.2f}us  p99.9 {latency["p99.9"]:>9.2f}us  '
+            f'{result["alloc_bytes_per_call"]:>9,.0f} B/call')
+    if baseline is not None:
+        change = result['ops_per_second'] / baseline['ops_per_second'] - 1
+        line += f'  {change:+.1%} ops/s vs baseline'
+    return line
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Params used by benchmarks: small ones are typical calls, large ones are ~100 KB of repetitive JSON. """
+import random
+
+_random = random.Random(42)
+
+SMALL_PARAMS = {'name': 'Caesar', 'size': 2, 'extras': ['croutons', 'parmesan']}
+
+LARGE_PARAMS = {
+    'items': [
+        {'id': i, 'name': f'item-{i}', 'price': _random.randint(1, 10000) / 100, 'tags': ['fresh', 'organic']}
+        for i in range(1000)
+    ],
+}
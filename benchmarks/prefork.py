@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Startup time and memory of N workers: `PreforkRunner` forking them after import against N cold processes.
+
+Both start the application of `benchmarks.prefork_app` (modules and in-memory catalog imported on start),
+listening on the same port with SO_REUSEPORT. Reported:
+- time from launch to the first response and to responses of all N workers (new connection per call),
+- USS (private memory) and PSS (private plus proportional share of shared memory) per worker,
+  and PSS of all processes (with master of `PreforkRunner`), after each worker handled some calls,
+  and again after full garbage collection in each worker.
+Linux only (`/proc/<pid>/smaps_rollup`):
+```
+python -m benchmarks.prefork --workers 4 --catalog 200000
+```
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from jarpc import JarpcClient, JarpcServerError, JarpcStreamServer, PreforkRunner, StreamTransport
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(mode: str, port: int, workers: int):
+    from . import prefork_app
+
+    if mode == 'prefork':
+        PreforkRunner(prefork_app.make_manager, port=port, workers=workers).run()
+        return
+
+    async def run():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('127.0.0.1', port))
+        sock.listen(1024)
+        server = JarpcStreamServer(prefork_app.make_manager())
+        await server.start(sock=sock)
+        stop = asyncio.Event()
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await stop.wait()
+        await server.close()
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def call(port: int, method: str, **params):
+    """Call over new connection, so the kernel picks a worker for it. """
+    transport = StreamTransport(host='127.0.0.1', port=port, connect_timeout=1.0)
+    try:
+        return JarpcClient(transport=transport)(method=method, params=params, ttl=5.0)
+    finally:
+        transport.close()
+
+
+def wait_for_workers(port: int, workers: int, started: float, timeout: float = 120.0) -> dict:
+    first = None
+    pids = set()
+    while len(pids) < workers:
+        if time.monotonic() - started > timeout:
+            raise TimeoutError(f'Only {len(pids)} of {workers} workers answered')
+        try:
+            pids.add(call(port, 'pid'))
+        except (OSError, JarpcServerError):
+            time.sleep(0.005)
+            continue
+        if first is None:
+            first = time.monotonic() - started
+    return {'first_response': first, 'all_workers': time.monotonic() - started, 'pids': pids}
+
+
+def collect_garbage(port: int, pids: set, timeout: float = 30.0):
+    collected = set()
+    deadline = time.monotonic() + timeout
+    while collected != pids and time.monotonic() < deadline:
+        collected.add(call(port, 'collect_garbage'))
+
+
+def read_memory(pid: int) -> dict:
+    """USS and PSS of process in KB. """
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in ('Pss', 'Private_Clean', 'Private_Dirty'):
+                values[name] = int(rest.split()[0])
+    return {'uss': values['Private_Clean'] + values['Private_Dirty'], 'pss': values['Pss']}
+
+
+def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run(mode: str, workers: int, catalog: int, calls: int) -> dict:
+    port = get_free_port()
+    command = [sys.executable, '-m', 'benchmarks.prefork', '--serve', mode, '--port', str(port),
+               '--workers', str(workers)]
+    env = dict(os.environ, JARPC_BENCH_CATALOG=str(catalog))
+    started = time.monotonic()
+    processes = [subprocess.Popen(command, cwd=ROOT, env=env) for _ in range(1 if mode == 'prefork' else workers)]
+    try:
+        result = wait_for_workers(port, workers, started)
+        for i in range(calls):
+            call(port, 'lookup', item_id=i % catalog)
+        pids = list(result['pids']) + ([processes[0].pid] if mode == 'prefork' else [])
+        memory = {pid: read_memory(pid) for pid in pids}
+        collect_garbage(port, result['pids'])
+        memory_after_gc = {pid: read_memory(pid) for pid in pids}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return {
+        'first_response': result['first_response'],
+        'all_workers': result['all_workers'],
+        'memory': summarize_memory(memory, result['pids']),
+        'memory_after_gc': summarize_memory(memory_after_gc, result['pids']),
+    }
+
+
+def summarize_memory(memory: dict, worker_pids: set) -> dict:
+    return {
+        'uss': statistics.mean(memory[pid]['uss'] for pid in worker_pids),
+        'pss': statistics.mean(memory[pid]['pss'] for pid in worker_pids),
+        'total_pss': sum(stats['pss'] for stats in memory.values()),
+    }
+
+
+def format_memory(memory: dict) -> str:
+    return (f"per worker USS {memory['uss'] / 1024:6.1f} MB, PSS {memory['pss'] / 1024:6.1f} MB, "
+            f"total PSS {memory['total_pss'] / 1024:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--catalog', type=int, default=200000, help='number of catalog items built on import')
+    parser.add_argument('--calls', type=int, default=1000, help='calls made before memory is measured')
+    parser.add_argument('--serve', choices=['prefork', 'cold'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    print(f'{args.workers} workers, catalog of {args.catalog} items, {os.cpu_count()} CPUs')
+    for mode in ('cold', 'prefork'):
+        result = run(mode, args.workers, args.catalog, args.calls)
+        print(f"{mode:8} first response {result['first_response']:6.2f}s, all workers {result['all_workers']:6.2f}s")
+        print(f"{'':8} {format_memory(result['memory'])}")
+        print(f"{'':8} after full GC: {format_memory(result['memory_after_gc'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Application served by `benchmarks.prefork`: imports a set of modules and builds in-memory catalog on import,
+as a real application loads its code and reference data. Catalog size is set by `JARPC_BENCH_CATALOG` env variable.
+"""
+import decimal  # noqa: F401, imported as application dependencies
+import email.parser  # noqa: F401
+import gc
+import http.client  # noqa: F401
+import logging.handlers  # noqa: F401
+import os
+import sqlite3  # noqa: F401
+import unittest  # noqa: F401
+import xml.etree.ElementTree  # noqa: F401
+
+from jarpc import AsyncJarpcManager, JarpcDispatcher
+
+CATALOG = {
+    i: {'id': i, 'name': f'item-{i}', 'price': i / 100, 'tags': ['fresh', f'batch-{i % 100}']}
+    for i in range(int(os.environ.get('JARPC_BENCH_CATALOG', 200000)))
+}
+
+dispatcher = JarpcDispatcher()
+
+
+@dispatcher.rpc_method
+def pid():
+    return os.getpid()
+
+
+@dispatcher.rpc_method
+def lookup(item_id: int):
+    return CATALOG.get(item_id)
+
+
+@dispatcher.rpc_method
+def collect_garbage():
+    """Full collection, as long running worker makes sooner or later. """
+    gc.collect()
+    return os.getpid()
+
+
+def make_manager() -> AsyncJarpcManager:
+    return AsyncJarpcManager(dispatcher)
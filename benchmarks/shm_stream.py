@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Round trips of large payloads over Unix socket: `StreamTransport` against `ShmStreamTransport`.
+
+Server runs in a child process. Calls are made one by one for `--duration` seconds per case:
+- "json": string param of given size is echoed back, so payload crosses in both directions,
+- "attachment": attachment of given size is checksummed by the method, the response is small.
+```
+python -m benchmarks.shm_stream --sizes 65536 1048576 8388608
+```
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import zlib
+
+from jarpc import AsyncJarpcManager, JarpcClient, JarpcDispatcher, JarpcStreamServer, StreamTransport
+from jarpc.shm import ShmStreamServer, ShmStreamTransport
+
+
+def make_dispatcher() -> JarpcDispatcher:
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda value: value, 'echo')
+
+    @dispatcher.rpc_method
+    def checksum(jarpc_request):
+        return zlib.crc32(jarpc_request.attachments[0])
+
+    return dispatcher
+
+
+def serve(path: str, shm: bool, ready, stop):
+    async def run():
+        manager = AsyncJarpcManager(make_dispatcher())
+        server = ShmStreamServer(manager) if shm else JarpcStreamServer(manager)
+        await server.start_unix(path)
+        ready.set()
+        await asyncio.get_event_loop().run_in_executor(None, stop.wait)
+        # shared memory segments are unlinked by the server
+        await server.close()
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def measure(client: JarpcClient, case: str, size: int, duration: float) -> dict:
+    if case == 'json':
+        value = 'x' * size
+
+        def call():
+            return client(method='echo', params={'value': value}, ttl=None)
+    else:
+        attachment = os.urandom(size)
+
+        def call():
+            return client(method='checksum', params={}, attachments=[attachment], ttl=None)
+    call()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    return {'calls_per_second': len(latencies) / sum(latencies), 'median': statistics.median(latencies)}
+
+
+def run(sizes, duration: float) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for shm in (False, True):
+            path = os.path.join(directory, f'{shm}.sock')
+            ready, stop = multiprocessing.Event(), multiprocessing.Event()
+            server = multiprocessing.Process(target=serve, args=(path, shm, ready, stop), daemon=True)
+            server.start()
+            ready.wait()
+            transport = ShmStreamTransport(path=path) if shm else StreamTransport(path=path)
+            client = JarpcClient(transport=transport)
+            try:
+                for case in ('json', 'attachment'):
+                    for size in sizes:
+                        results[('shm' if shm else 'socket', case, size)] = measure(client, case, size, duration)
+            finally:
+                transport.close()
+                stop.set()
+                server.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64 * 1024, 1024 * 1024, 8 * 1024 * 1024])
+    parser.add_argument('--duration', type=float, default=2.0)
+    args = parser.parse_args()
+    results = run(args.sizes, args.duration)
+    for case in ('json', 'attachment'):
+        for size in args.sizes:
+            socket_result, shm_result = results[('socket', case, size)], results[('shm', case, size)]
+            print(f"{case:10} {size:>9} B: socket {socket_result['calls_per_second']:8.0f} calls/s "
+                  f"(median {socket_result['median'] * 1000:.2f} ms), "
+                  f"shm {shm_result['calls_per_second']:8.0f} calls/s "
+                  f"(median {shm_result['median'] * 1000:.2f} ms), "
+                  f"x{shm_result['calls_per_second'] / socket_result['calls_per_second']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
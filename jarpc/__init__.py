@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-from .client import AsyncJarpcClient, JarpcClient
+import importlib
+
+from .client import AsyncJarpcClient, JarpcClient, TransportWrapper
+from .compression import AdaptiveCompressor, Codec, compress_payload, decompress_payload, is_compressed, register_codec
 from .dispatcher import JarpcDispatcher
 from .errors import (
     JarpcError,
@@ -10,25 +13,92 @@ from .errors import (
     JarpcInvalidRequest,
     JarpcMethodNotFound,
     JarpcParseError,
+    JarpcRejected,
     JarpcServerError,
     JarpcTimeout,
+    JarpcTooManyRequests,
     JarpcUnknownError,
     JarpcUnauthorized,
     JarpcValidationError,
     raise_exception
 )
-from .format import JarpcRequest, JarpcResponse
+from .format import CANCEL_METHOD, JarpcAttachedResult, JarpcRequest, JarpcResponse
+from .framing import frame_parts, is_frame, pack_frame, pack_request, pack_response, unpack_frame, unpack_request, \
+    unpack_response
 from .manager import (
     AsyncJarpcManager,
     JarpcManager
 )
+from .priority import PriorityScheduler
+from .ratelimit import RateLimiter
+from .tracing import InMemoryExporter, JsonLinesExporter, Span, TraceContext, Tracer, get_trace_context
+
+# transports, servers and tools are imported on first access, so `import jarpc` doesn't pay for all of them
+_LAZY_MODULES = {
+    'affinity': ('AffinityTransport', 'AsyncAffinityTransport', 'HashRing'),
+    'balance': ('AsyncBalancingTransport', 'BalancingTransport'),
+    'cache': ('AsyncCacheTransport', 'CacheTransport'),
+    'consumer': ('Broker', 'BrokerMessage', 'InMemoryBroker', 'QueueConsumer'),
+    'durable': ('AsyncDurableOutboxTransport', 'DurableLog', 'DurableOutboxTransport'),
+    'httppool': ('HttpConnectionPool', 'HttpTransport'),
+    'limit': ('AdaptiveLimiter', 'AsyncAdaptiveLimiter', 'AsyncLimitTransport', 'CircuitBreaker', 'LimitTransport'),
+    'loopback': ('AsyncLoopbackTransport', 'LoopbackTransport'),
+    'outbox': ('AsyncOutboxTransport',),
+    'retry': ('AsyncRetryTransport', 'RetryBudget', 'RetryTransport'),
+    'runner': ('PreforkRunner',),
+    'shm': ('AsyncShmStreamTransport', 'SharedMemoryPayloads', 'ShmStreamServer', 'ShmStreamTransport'),
+    'stream': ('AsyncStreamTransport', 'JarpcStreamServer', 'StreamTransport'),
+    'web': ('JarpcAsgiApp', 'JarpcWsgiApp'),
+}
+_lazy_names = {name: module for module, names in _LAZY_MODULES.items() for name in names}
+
+
+def __getattr__(name):
+    module = _lazy_names.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *_lazy_names})
+
 
 __all__ = (
+    # affinity
+    'AffinityTransport',
+    'AsyncAffinityTransport',
+    'HashRing',
+    # balance
+    'AsyncBalancingTransport',
+    'BalancingTransport',
+    # cache
+    'AsyncCacheTransport',
+    'CacheTransport',
     # client
     'AsyncJarpcClient',
     'JarpcClient',
+    'TransportWrapper',
+    # compression
+    'AdaptiveCompressor',
+    'Codec',
+    'compress_payload',
+    'decompress_payload',
+    'is_compressed',
+    'register_codec',
+    # consumer
+    'Broker',
+    'BrokerMessage',
+    'InMemoryBroker',
+    'QueueConsumer',
     # dispatcher
     'JarpcDispatcher',
+    # durable
+    'AsyncDurableOutboxTransport',
+    'DurableLog',
+    'DurableOutboxTransport',
     # errors
     'JarpcError',
     'JarpcExternalServiceUnavailable',
@@ -38,18 +108,74 @@ __all__ = (
     'JarpcInvalidRequest',
     'JarpcMethodNotFound',
     'JarpcParseError',
+    'JarpcRejected',
     'JarpcServerError',
     'JarpcTimeout',
+    'JarpcTooManyRequests',
     'JarpcUnknownError',
     'JarpcUnauthorized',
     'JarpcValidationError',
     'raise_exception',
     # format
+    'CANCEL_METHOD',
+    'JarpcAttachedResult',
     'JarpcRequest',
     'JarpcResponse',
+    # framing
+    'frame_parts',
+    'is_frame',
+    'pack_frame',
+    'pack_request',
+    'pack_response',
+    'unpack_frame',
+    'unpack_request',
+    'unpack_response',
+    # httppool
+    'HttpConnectionPool',
+    'HttpTransport',
+    # limit
+    'AdaptiveLimiter',
+    'AsyncAdaptiveLimiter',
+    'AsyncLimitTransport',
+    'CircuitBreaker',
+    'LimitTransport',
+    # loopback
+    'AsyncLoopbackTransport',
+    'LoopbackTransport',
     # manager
     'AsyncJarpcManager',
     'JarpcManager',
+    # outbox
+    'AsyncOutboxTransport',
+    # priority
+    'PriorityScheduler',
+    # ratelimit
+    'RateLimiter',
+    # retry
+    'AsyncRetryTransport',
+    'RetryBudget',
+    'RetryTransport',
+    # runner
+    'PreforkRunner',
+    # shm
+    'AsyncShmStreamTransport',
+    'SharedMemoryPayloads',
+    'ShmStreamServer',
+    'ShmStreamTransport',
+    # stream
+    'AsyncStreamTransport',
+    'JarpcStreamServer',
+    'StreamTransport',
+    # tracing
+    'InMemoryExporter',
+    'JsonLinesExporter',
+    'Span',
+    'TraceContext',
+    'Tracer',
+    'get_trace_context',
+    # web
+    'JarpcAsgiApp',
+    'JarpcWsgiApp',
 )
 
 __version__ = '1.4'
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Key affinity routing: calls with the same shard key go to the same replica, so replicas' caches are hit more often.
+
+`AffinityTransport` and `AsyncAffinityTransport` get shard key of a call from method and params with `key_func`,
+and route it with consistent hashing with bounded loads: key is mapped to a point of the hash ring, and the call
+is sent to the first replica clockwise which has less than `load_factor` * average calls in flight.
+Adding or removing a replica only remaps keys of its own ring segments.
+Replicas are named, ring depends only on names, so all clients route keys the same way.
+
+Example of usage:
+```
+transports = {f'{host}:8765': AsyncStreamTransport(host=host, port=8765) for host in hosts}
+transport = AsyncAffinityTransport(transports, key_func=lambda method, params: params.get('user_id'))
+client = AsyncJarpcClient(transport=transport)
+profile = await client.get_profile(user_id=42)
+```
+"""
+import bisect
+import functools
+import hashlib
+import json
+import math
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from .client import accepts_timeout, make_call_kwargs
+from .format import JarpcRequest
+
+# ring points are not a security feature, so FIPS builds must not refuse md5
+_md5 = functools.partial(hashlib.md5, usedforsecurity=False) if sys.version_info >= (3, 9) else hashlib.md5
+
+
+def default_key(method: str, params: dict) -> str:
+    """Shard key of a call made of method and all its params. """
+    return method + json.dumps(params, sort_keys=True, default=str)
+
+
+def _hash(value: str) -> int:
+    # stable between processes, unlike builtin `hash`
+    return int.from_bytes(_md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring of named nodes with virtual nodes. """
+
+    def __init__(self, names=(), vnodes: int = 100):
+        """
+        :param names: node names
+        :param vnodes: number of ring points of each node
+        """
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._names: List[str] = []
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(set(self._names))
+
+    def add(self, name: str):
+        for i in range(self.vnodes):
+            point = _hash(f'{name}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._names.insert(index, name)
+
+    def remove(self, name: str):
+        kept = [(point, node) for point, node in zip(self._points, self._names) if node != name]
+        self._points = [point for point, _ in kept]
+        self._names = [node for _, node in kept]
+
+    def iter_nodes(self, key: str):
+        """Iterate distinct node names clockwise from key's point. """
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, _hash(key))
+        seen = set()
+        for i in range(len(self._points)):
+            name = self._names[(start + i) % len(self._points)]
+            if name not in seen:
+                seen.add(name)
+                yield name
+
+
+class _AffinityTransportBase:
+
+    # cancellation is routed by its own params, not by the call's ones
+    forwards_cancel = False
+
+    def __init__(self, transports: Mapping[str, Any], key_func: Callable[[str, dict], Optional[str]] = default_key,
+                 load_factor: float = 1.25, vnodes: int = 100):
+        """
+        :param transports: transports of replicas by their names
+        :param key_func: makes shard key from method and params, calls with None key go to the least loaded replica
+        :param load_factor: max calls in flight of a replica relative to average, > 1
+        :param vnodes: number of ring points of each replica
+        :raises ValueError: load_factor is not greater than 1
+        """
+        if load_factor <= 1:
+            raise ValueError(f'Load factor must be greater than 1, got {load_factor}')
+        self.key_func = key_func
+        self.load_factor = load_factor
+        self.transports: Dict[str, Any] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.ring = HashRing(vnodes=vnodes)
+        self._accepts_timeout: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        for name, transport in transports.items():
+            self.add_transport(name, transport)
+
+    @property
+    def needs_request_string(self) -> bool:
+        return any(getattr(transport, 'needs_request_string', True) for transport in self.transports.values())
+
+    @property
+    def accepts_timeout(self) -> bool:
+        return any(self._accepts_timeout.values())
+
+    def add_transport(self, name: str, transport):
+        with self._lock:
+            self.transports[name] = transport
+            self.in_flight.setdefault(name, 0)
+            self._accepts_timeout[name] = accepts_timeout(transport)
+            self.ring.add(name)
+
+    def remove_transport(self, name: str):
+        with self._lock:
+            del self.transports[name]
+            del self._accepts_timeout[name]
+            self.ring.remove(name)
+            if not self.in_flight[name]:
+                del self.in_flight[name]
+
+    def _pick(self, request: JarpcRequest) -> Tuple[str, Any, bool]:
+        """Choose replica for a call and count the call, returns its name, transport and if it accepts timeout. """
+        key = self.key_func(request.method, request.params)
+        with self._lock:
+            if not self.transports:
+                raise ValueError('No transports to route call')
+            total = sum(self.in_flight[name] for name in self.transports)
+            capacity = math.ceil(self.load_factor * (total + 1) / len(self.transports))
+            name = None
+            if key is not None:
+                name = next((name for name in self.ring.iter_nodes(str(key)) if self.in_flight[name] < capacity), None)
+            if name is None:
+                # with load factor > 1 some replica is always under capacity, this is a safety net
+                name = min(self.transports, key=self.in_flight.__getitem__)
+            self.in_flight[name] += 1
+            return name, self.transports[name], self._accepts_timeout[name]
+
+    def _finish(self, name: str):
+        with self._lock:
+            self.in_flight[name] -= 1
+            if name not in self.transports and not self.in_flight[name]:
+                del self.in_flight[name]
+
+
+class AffinityTransport(_AffinityTransportBase):
+    """Transport for `JarpcClient` routing calls by shard key with consistent hashing with bounded loads. """
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                 **kwargs):
+        name, transport, transport_accepts_timeout = self._pick(request)
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            kwargs = make_call_kwargs(kwargs, deadline, transport_accepts_timeout)
+            return transport(request_string, request, **kwargs)
+        finally:
+            self._finish(name)
+
+
+class AsyncAffinityTransport(_AffinityTransportBase):
+    """Transport for `AsyncJarpcClient` routing calls by shard key with consistent hashing with bounded loads. """
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                       **kwargs):
+        name, transport, transport_accepts_timeout = self._pick(request)
+        try:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            kwargs = make_call_kwargs(kwargs, deadline, transport_accepts_timeout)
+            return await transport(request_string, request, **kwargs)
+        finally:
+            self._finish(name)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side load balancing between transports of server replicas.
+
+`BalancingTransport` and `AsyncBalancingTransport` pick transport for each call with power of two choices:
+two random replicas are compared by cost, (calls in flight + 1) * EWMA of latency, and the cheaper one is used.
+Latency of replica is doubled on each failure, so replica failing fast doesn't attract calls.
+Replica failed `failure_threshold` calls in a row (transport errors, `JarpcTimeout`, `JarpcServerError`,
+`JarpcExternalServiceUnavailable`) is ejected for `ejection_duration` seconds; after that the next call is sent to it
+as a probe, and replica is re-admitted if probe succeeds, or ejected again otherwise.
+At most `max_ejection_ratio` of replicas are ejected at once.
+
+Example of usage:
+```
+transport = AsyncBalancingTransport([AsyncStreamTransport(host=host, port=8765) for host in hosts])
+kitchen = AsyncJarpcClient(transport=transport)
+salad = await kitchen.cook_salad(name='Caesar')
+```
+"""
+import random
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+from .client import CANCELLED_CALL, accepts_timeout, load_call_response, make_call_kwargs
+from .format import JarpcRequest, json_loads
+from .limit import is_failure
+
+
+class Endpoint:
+    """Transport of one replica with its balancing state. """
+
+    def __init__(self, transport, initial_latency: float):
+        self.transport = transport
+        self.accepts_timeout = accepts_timeout(transport)
+        self.in_flight = 0
+        self.latency = initial_latency
+        self.failures = 0  # in a row
+        self.ejected_until = None
+        self.probing = False
+        self.calls = 0
+        self.ejections = 0
+
+    @property
+    def cost(self) -> float:
+        return (self.in_flight + 1) * self.latency
+
+    def is_available(self, now: float) -> bool:
+        """Check if endpoint is not ejected or may be probed. """
+        return self.ejected_until is None or (self.ejected_until <= now and not self.probing)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'latency': self.latency,
+            'ejected': self.ejected_until is not None,
+            'calls': self.calls,
+            'ejections': self.ejections,
+        }
+
+
+class _BalancingTransportBase:
+
+    # cancellation would go to a replica chosen anew
+    forwards_cancel = False
+
+    def __init__(self, transports: Sequence, failure_threshold: int = 5, ejection_duration: float = 10.0,
+                 max_ejection_ratio: float = 0.5, ewma_alpha: float = 0.3, initial_latency: float = 0.01,
+                 loads: Callable[[str], Any] = json_loads):
+        """
+        :param transports: transports of replicas
+        :param failure_threshold: number of failed calls in a row to eject replica
+        :param ejection_duration: time (seconds) replica is ejected before probing
+        :param max_ejection_ratio: max share of replicas ejected at once
+        :param ewma_alpha: weight of new latency in EWMA
+        :param initial_latency: latency (seconds) assumed for replicas before their calls are finished
+        :param loads: json loads
+        """
+        if not transports:
+            raise ValueError('At least one transport is required')
+        self.endpoints: List[Endpoint] = [Endpoint(transport, initial_latency) for transport in transports]
+        self.needs_request_string = any(getattr(transport, 'needs_request_string', True) for transport in transports)
+        self.accepts_timeout = any(endpoint.accepts_timeout for endpoint in self.endpoints)
+        self.failure_threshold = failure_threshold
+        self.ejection_duration = ejection_duration
+        self.max_ejection_ratio = max_ejection_ratio
+        self.ewma_alpha = ewma_alpha
+        self.loads = loads
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [endpoint.stats for endpoint in self.endpoints]
+
+    def _pick(self) -> Endpoint:
+        """Choose endpoint for a call and count the call. """
+        now = time.monotonic()
+        with self._lock:
+            probes = [endpoint for endpoint in self.endpoints
+                      if endpoint.ejected_until is not None and endpoint.is_available(now)]
+            if probes:
+                endpoint = probes[0]
+                endpoint.probing = True
+            else:
+                candidates = [endpoint for endpoint in self.endpoints if endpoint.ejected_until is None]
+                # all replicas are ejected and being probed: use them anyway
+                candidates = candidates or self.endpoints
+                if len(candidates) == 1:
+                    endpoint = candidates[0]
+                else:
+                    first, second = random.sample(candidates, 2)
+                    endpoint = first if first.cost <= second.cost else second
+            endpoint.in_flight += 1
+            endpoint.calls += 1
+            return endpoint
+
+    def _finish(self, endpoint: Endpoint, started: float, outcome):
+        """Update endpoint's state by outcome of finished call. """
+        now = time.monotonic()
+        with self._lock:
+            endpoint.in_flight -= 1
+            probe, endpoint.probing = endpoint.probing, False
+            if outcome is CANCELLED_CALL:
+                return
+            if is_failure(outcome):
+                endpoint.failures += 1
+                # replica failing fast must not look cheap
+                endpoint.latency = max(endpoint.latency * 2, now - started)
+                if probe or (endpoint.ejected_until is None and endpoint.failures >= self.failure_threshold
+                             and self._can_eject()):
+                    endpoint.ejected_until = now + self.ejection_duration
+                    endpoint.ejections += 1
+                return
+            endpoint.failures = 0
+            endpoint.ejected_until = None
+            endpoint.latency += self.ewma_alpha * (now - started - endpoint.latency)
+
+    def _can_eject(self) -> bool:
+        ejected = sum(endpoint.ejected_until is not None for endpoint in self.endpoints)
+        return ejected + 1 <= self.max_ejection_ratio * len(self.endpoints)
+
+
+class BalancingTransport(_BalancingTransportBase):
+    """Transport for `JarpcClient` balancing calls between replicas with power of two choices. """
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                 **kwargs):
+        endpoint = self._pick()
+        started = time.monotonic()
+        outcome = CANCELLED_CALL
+        try:
+            kwargs = make_call_kwargs(kwargs, None if timeout is None else started + timeout, endpoint.accepts_timeout)
+            response = endpoint.transport(request_string, request, **kwargs)
+            outcome = response = load_call_response(request, response, loads=self.loads)
+            return response
+        except Exception as e:
+            outcome = e
+            raise
+        finally:
+            self._finish(endpoint, started, outcome)
+
+
+class AsyncBalancingTransport(_BalancingTransportBase):
+    """Transport for `AsyncJarpcClient` balancing calls between replicas with power of two choices. """
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                       **kwargs):
+        endpoint = self._pick()
+        started = time.monotonic()
+        outcome = CANCELLED_CALL
+        try:
+            kwargs = make_call_kwargs(kwargs, None if timeout is None else started + timeout, endpoint.accepts_timeout)
+            response = await endpoint.transport(request_string, request, **kwargs)
+            outcome = response = load_call_response(request, response, loads=self.loads)
+            return response
+        except Exception as e:
+            outcome = e
+            raise
+        finally:
+            self._finish(endpoint, started, outcome)
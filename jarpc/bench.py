@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Load generator driving `AsyncJarpcClient` against a manager, to size deployments and validate capacity changes.
+
+Modes:
+- open loop: requests are sent at fixed arrival rate, whether previous ones completed or not, as independent
+  clients do. Latency is measured from the time request was scheduled to be sent, and request ts is that time too,
+  so stalls of the server or of the generator itself show up in latency and expiration instead of being hidden
+  (no coordinated omission). Requests over `max_in_flight` are not sent and are counted as overflow,
+- closed loop: `concurrency` workers send next request as soon as previous one completes. It finds max throughput,
+  but understates latency under overload by design.
+
+Targets:
+- in-process: manager's `handle` gets serialized requests, so (de)serialization is measured too,
+- loopback: manager gets request objects (see `jarpc.loopback`),
+- remote `JarpcStreamServer` (see `jarpc.stream`).
+
+Requests dropped as expired, by client before sending or by manager, are counted apart from errors,
+which are counted by error code.
+
+Command line:
+```
+python -m jarpc.bench --rate 2000 --method echo:3 --method sleep:1 --payload 100 --payload 10000:0.1 --ttl 0.05:0.5
+python -m jarpc.bench --concurrency 64 --dispatcher myapp.rpc:dispatcher --method get_user --params '{"id": 1}'
+python -m jarpc.bench --connect 127.0.0.1:8765 --rate 5000 --duration 60 --json
+```
+Without `--dispatcher` demo methods are served: "echo", "sleep" (for `delay` seconds, 1ms by default) and "fail".
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from .client import AsyncJarpcClient
+from .dispatcher import JarpcDispatcher, import_method
+from .errors import JarpcError, JarpcServerError, JarpcTimeout
+from .loopback import AsyncLoopbackTransport
+from .manager import AsyncJarpcManager
+from .stream import AsyncStreamTransport
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Workload:
+    """Random calls with given method mix, payload sizes and ttl distribution. """
+
+    def __init__(self, methods: Mapping[str, float] = None, payload_sizes: Mapping[int, float] = None,
+                 ttl: Optional[Tuple[float, float]] = None, params: dict = None, payload_param: str = 'payload',
+                 seed: Optional[int] = None):
+        """
+        :param methods: method weights, {"echo": 1} by default
+        :param payload_sizes: weights of payload sizes (characters), payload is not sent by default
+        :param ttl: ttl is uniformly distributed between min and max of this pair, requests never expire if None
+        :param params: params sent with every call
+        :param payload_param: name of param carrying payload
+        :param seed: random seed, for reproducible workloads
+        """
+        methods = methods or {'echo': 1.0}
+        payload_sizes = payload_sizes or {0: 1.0}
+        self.methods = list(methods)
+        self.method_weights = list(methods.values())
+        self.payload_sizes = list(payload_sizes)
+        self.payload_weights = list(payload_sizes.values())
+        self.ttl = ttl
+        self.params = params or {}
+        self.payload_param = payload_param
+        self.random = random.Random(seed)
+        self._payloads = {size: 'x' * size for size in self.payload_sizes}
+
+    def next_call(self) -> Tuple[str, dict, Optional[float]]:
+        """Get method, params and ttl of next call. """
+        method = self.random.choices(self.methods, self.method_weights)[0]
+        size = self.random.choices(self.payload_sizes, self.payload_weights)[0]
+        params = dict(self.params)
+        if size:
+            params[self.payload_param] = self._payloads[size]
+        ttl = self.random.uniform(*self.ttl) if self.ttl is not None else None
+        return method, params, ttl
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Get `q`-th percentile (nearest rank) of sorted values. """
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadReport:
+    """Outcomes of calls made by load generator. """
+
+    def __init__(self):
+        self.sent = 0
+        self.completed = 0
+        self.expired = 0
+        self.overflow = 0
+        self.errors = Counter()
+        self.latencies: List[float] = []
+        self.elapsed = 0.0
+
+    def record_response(self, latency: float, error: Optional[JarpcError] = None):
+        self.completed += 1
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[f'{error.code} {error.message}'] += 1
+
+    def record_expired(self):
+        self.expired += 1
+
+    def record_failure(self, e: Exception):
+        """Count call failed with non-JARPC exception. """
+        self.errors[e.__class__.__name__] += 1
+
+    @property
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            'elapsed': self.elapsed,
+            'sent': self.sent,
+            'completed': self.completed,
+            'throughput': self.completed / self.elapsed if self.elapsed else 0.0,
+            'latency_ms': {f'p{q:g}': percentile(latencies, q) * 1000 for q in PERCENTILES} if latencies else {},
+            'max_latency_ms': latencies[-1] * 1000 if latencies else None,
+            'expired': self.expired,
+            'overflow': self.overflow,
+            'errors': dict(self.errors.most_common()),
+        }
+
+    def format(self) -> str:
+        summary = self.summary
+        lines = [f'{summary["elapsed"]:.2f}s: sent {summary["sent"]}, completed {summary["completed"]} '
+                 f'({summary["throughput"]:,.1f}/s), expired {summary["expired"]}, overflow {summary["overflow"]}']
+        if summary['latency_ms']:
+            percentiles = '  '.join(f'{name} {value:.3f}' for name, value in summary['latency_ms'].items())
+            lines.append(f'latency ms: {percentiles}  max {summary["max_latency_ms"]:.3f}')
+        for error, count in summary['errors'].items():
+            lines.append(f'error {error}: {count}')
+        return '\n'.join(lines)
+
+
+async def _timed_call(client: AsyncJarpcClient, workload: Workload, report: Optional[LoadReport],
+                      scheduled: float, ts: Optional[float] = None):
+    """Make call, recording its outcome with latency since `scheduled` (perf_counter time) unless `report` is None. """
+    method, params, ttl = workload.next_call()
+    try:
+        await client(method=method, params=params, ts=ts, ttl=ttl)
+        error = None
+    except JarpcTimeout:
+        if report is not None:
+            report.record_expired()
+        return
+    except JarpcError as e:
+        error = e
+    except Exception as e:
+        if report is not None:
+            report.record_failure(e)
+        return
+    if report is not None:
+        report.record_response(time.perf_counter() - scheduled, error)
+
+
+async def run_open_loop(client: AsyncJarpcClient, workload: Workload, rate: float, duration: float,
+                        warmup: float = 0.0, poisson: bool = False, max_in_flight: int = 10000) -> LoadReport:
+    """
+    Send requests at fixed arrival rate, measuring latency from the time each of them was scheduled to be sent.
+    :param rate: requests per second
+    :param duration: time (seconds) of sending measured requests
+    :param warmup: time (seconds) of sending requests before measurement, their outcomes are not recorded
+    :param poisson: make intervals between requests exponentially distributed instead of equal
+    :param max_in_flight: max number of requests awaiting response, requests over it are counted as overflow
+    """
+    report = LoadReport()
+    tasks = set()
+    started = time.perf_counter()
+    wall_started = time.time()
+    offset = 0.0  # time since start request is scheduled to be sent at
+    count = 0
+    while offset < warmup + duration:
+        scheduled = started + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        measured = offset >= warmup
+        if len(tasks) >= max_in_flight:
+            if measured:
+                report.overflow += 1
+        else:
+            if measured:
+                report.sent += 1
+            task = asyncio.ensure_future(_timed_call(client, workload, report if measured else None, scheduled,
+                                                     ts=wall_started + offset))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        count += 1
+        offset = offset + workload.random.expovariate(rate) if poisson else count / rate
+    if tasks:
+        await asyncio.wait(tasks)
+    report.elapsed = time.perf_counter() - started - warmup
+    return report
+
+
+async def run_closed_loop(client: AsyncJarpcClient, workload: Workload, concurrency: int, duration: float,
+                          warmup: float = 0.0) -> LoadReport:
+    """
+    Make calls by `concurrency` workers, each sending next request as soon as previous one completes.
+    :param duration: time (seconds) of sending measured requests
+    :param warmup: time (seconds) of sending requests before measurement, their outcomes are not recorded
+    """
+    report = LoadReport()
+    measured_from = time.perf_counter() + warmup
+    deadline = measured_from + duration
+
+    async def work():
+        while True:
+            scheduled = time.perf_counter()
+            if scheduled >= deadline:
+                return
+            measured = scheduled >= measured_from
+            if measured:
+                report.sent += 1
+            await _timed_call(client, workload, report if measured else None, scheduled)
+
+    await asyncio.gather(*(work() for _ in range(concurrency)))
+    report.elapsed = time.perf_counter() - measured_from
+    return report
+
+
+class _InProcessTransport:
+    """Transport passing serialized request to `AsyncJarpcManager.handle` in the same process. """
+
+    def __init__(self, manager: AsyncJarpcManager):
+        self.manager = manager
+
+    async def __call__(self, request_string, request):
+        response = await self.manager.handle(request_string)
+        if response is None and request.rsvp:
+            raise JarpcTimeout('Request was dropped as expired')
+        return response
+
+
+def make_demo_dispatcher() -> JarpcDispatcher:
+    dispatcher = JarpcDispatcher()
+
+    @dispatcher.rpc_method
+    def echo(payload: str = ''):
+        return payload
+
+    @dispatcher.rpc_method
+    async def sleep(delay: float = 0.001, payload: str = ''):
+        await asyncio.sleep(delay)
+        return payload
+
+    @dispatcher.rpc_method
+    def fail(payload: str = ''):
+        raise JarpcServerError('Demo failure')
+
+    return dispatcher
+
+
+def _parse_weighted(values: List[str], value_type) -> Dict:
+    weights = {}
+    for value in values:
+        name, _, weight = value.rpartition(':') if ':' in value else (value, '', '1')
+        weights[value_type(name)] = float(weight)
+    return weights
+
+
+def _parse_ttl(value: Optional[str]) -> Optional[Tuple[float, float]]:
+    if value is None:
+        return None
+    low, _, high = value.partition(':')
+    return float(low), float(high or low)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m jarpc.bench', description='Generate load on JARPC manager.')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--rate', type=float, help='open loop: requests per second')
+    mode.add_argument('--concurrency', type=int, help='closed loop: number of concurrent workers')
+    parser.add_argument('--poisson', action='store_true', help='open loop: exponentially distributed intervals')
+    parser.add_argument('--max-in-flight', type=int, default=10000, help='open loop: max requests awaiting response')
+    parser.add_argument('--duration', type=float, default=10.0, help='time (seconds) of measurement')
+    parser.add_argument('--warmup', type=float, default=1.0, help='time (seconds) of load before measurement')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--dispatcher', metavar='MODULE:NAME', help='serve this dispatcher instead of demo one')
+    target.add_argument('--connect', metavar='HOST:PORT', help='call remote JarpcStreamServer')
+    parser.add_argument('--loopback', action='store_true', help='pass request objects to manager without serializing')
+    parser.add_argument('--method', action='append', default=[], metavar='NAME[:WEIGHT]', help='method mix')
+    parser.add_argument('--payload', action='append', default=[], metavar='SIZE[:WEIGHT]', help='payload sizes')
+    parser.add_argument('--payload-param', default='payload', help='name of param carrying payload')
+    parser.add_argument('--params', type=json.loads, default={}, help='params of every call as JSON object')
+    parser.add_argument('--ttl', metavar='SECONDS[:MAX_SECONDS]', help='ttl, uniformly distributed if max is given')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--json', action='store_true', help='print report as JSON')
+    return parser
+
+
+async def run(args: argparse.Namespace) -> LoadReport:
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        transport = AsyncStreamTransport(host, int(port))
+    else:
+        dispatcher = import_method(args.dispatcher) if args.dispatcher else make_demo_dispatcher()
+        manager = AsyncJarpcManager(dispatcher)
+        transport = AsyncLoopbackTransport(manager) if args.loopback else _InProcessTransport(manager)
+    client = AsyncJarpcClient(transport)
+    workload = Workload(methods=_parse_weighted(args.method, str), payload_sizes=_parse_weighted(args.payload, int),
+                        ttl=_parse_ttl(args.ttl), params=args.params, payload_param=args.payload_param,
+                        seed=args.seed)
+    try:
+        if args.rate is not None:
+            return await run_open_loop(client, workload, args.rate, args.duration, warmup=args.warmup,
+                                       poisson=args.poisson, max_in_flight=args.max_in_flight)
+        return await run_closed_loop(client, workload, args.concurrency, args.duration, warmup=args.warmup)
+    finally:
+        if args.connect:
+            await transport.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    args = make_parser().parse_args(argv)
+    # manager would log a warning on each request dropped as expired
+    logging.getLogger('jarpc').setLevel(logging.ERROR)
+    loop = asyncio.new_event_loop()
+    try:
+        report = loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+    print(json.dumps(report.summary, indent=2) if args.json else report.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side cache of results of idempotent methods.
+
+`CacheTransport` and `AsyncCacheTransport` wrap client transport and cache successful responses of methods listed
+in `ttls`, by method and params (calls with attachments and notifications are not cached):
+- response is fresh for method's ttl, least recently used responses are evicted over `max_entries`,
+- concurrent calls missing the same key make one transport call and share its response,
+- `AsyncCacheTransport` returns response up to `stale_ttl` seconds older than ttl at once,
+  and refreshes it in background (stale-while-revalidate).
+Cached results are shared between callers, so they must not be mutated.
+
+Example of usage:
+```
+transport = AsyncCacheTransport(AsyncStreamTransport(path='/run/kitchen.sock'), ttls={'get_menu': 60.0},
+                                stale_ttl=300.0)
+kitchen = AsyncJarpcClient(transport=transport)
+menu = await kitchen.get_menu(lang='en')
+```
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Mapping, Optional, Tuple
+
+from .affinity import default_key
+from .client import TransportWrapper, load_response
+from .errors import JarpcTimeout
+from .format import JarpcRequest, JarpcResponse, json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ('response', 'fresh_until', 'stale_until')
+
+    def __init__(self, response: JarpcResponse, fresh_until: float, stale_until: float):
+        self.response = response
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResultCache:
+    """Thread-safe LRU cache of responses. """
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        :param max_entries: max number of cached responses
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Get entry, removing it if it is too old even to be stale. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.stale_until <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, response: JarpcResponse, ttl: float, stale_ttl: float = 0.0):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = CacheEntry(response, now + ttl, now + ttl + stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _CacheTransportBase(TransportWrapper):
+
+    def __init__(self, transport, ttls: Mapping[str, float], max_entries: int = 1024, stale_ttl: float = 0.0,
+                 key_func: Callable[[str, dict], str] = default_key, loads: Callable[[str], Any] = json_loads):
+        """
+        :param transport: transport to wrap
+        :param ttls: time (seconds) responses of cached methods are fresh, by method
+        :param max_entries: max number of cached responses
+        :param stale_ttl: time (seconds) after ttl while stale response may be returned and refreshed in background
+        :param key_func: makes cache key from method and params
+        :param loads: json loads
+        """
+        super().__init__(transport, loads=loads)
+        self.accepts_timeout = self._transport_accepts_timeout
+        self.ttls = dict(ttls)
+        self.stale_ttl = stale_ttl
+        self.key_func = key_func
+        self.cache = ResultCache(max_entries=max_entries)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._pending = {}  # key -> future of response being fetched (with its deadline in async transport)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.cache),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'pending': len(self._pending),
+        }
+
+    def invalidate(self, method: str, params: dict):
+        """Remove cached response of call. """
+        self.cache.invalidate(self.key_func(method, params))
+
+    def _get_key(self, request: JarpcRequest) -> Optional[str]:
+        """Get cache key, None if call is not cached. """
+        if not request.rsvp or request.attachments or request.method not in self.ttls:
+            return None
+        return self.key_func(request.method, request.params)
+
+    def _store(self, key: str, request: JarpcRequest, response) -> JarpcResponse:
+        response = load_response(response, loads=self.loads)
+        if response.success:
+            self.cache.put(key, response, self.ttls[request.method], self.stale_ttl)
+        return response
+
+
+class CacheTransport(_CacheTransportBase):
+    """
+    Transport for `JarpcClient` caching results of idempotent methods.
+
+    Stale responses are not returned, `stale_ttl` only keeps them cached a bit longer.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, **kwargs):
+        key = self._get_key(request)
+        if key is None:
+            return self.transport(request_string, request, **kwargs)
+
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh_until > time.monotonic():
+            self.hits += 1
+            return entry.response
+        self.misses += 1
+
+        with self._lock:
+            future = self._pending.get(key)
+            fetching = future is None
+            if fetching:
+                future = self._pending[key] = concurrent.futures.Future()
+        if not fetching:
+            try:
+                return future.result(kwargs.get('timeout'))
+            except concurrent.futures.TimeoutError:
+                raise JarpcTimeout('No response from concurrent call with the same key')
+
+        try:
+            response = self._store(key, request, self.transport(request_string, request, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+
+class AsyncCacheTransport(_CacheTransportBase):
+    """
+    Transport for `AsyncJarpcClient` caching results of idempotent methods with stale-while-revalidate.
+
+    Shared fetch is sent as a request of its own (copy of the first caller's request with new id), so cancellation of
+    one caller is not sent to the server. Each caller waits for it until its own request expires, and a caller outliving
+    expired fetch starts another one.
+    """
+
+    def __init__(self, *args, dumps: Callable[[Any], str] = json_dumps, **kwargs):
+        """
+        :param dumps: json dumps of shared fetch requests
+        See other params in `_CacheTransportBase`.
+        """
+        super().__init__(*args, **kwargs)
+        self.dumps = dumps
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, **kwargs):
+        key = self._get_key(request)
+        if key is None:
+            return await self.transport(request_string, request, **kwargs)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.fresh_until > time.monotonic():
+                self.hits += 1
+                return entry.response
+            self.stale_hits += 1
+            self._fetch(key, request, kwargs, request.remaining, refresh=True)
+            return entry.response
+
+        self.misses += 1
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = request.remaining
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            future, fetch_deadline = self._fetch(key, request, kwargs, timeout)
+            try:
+                # shield shared fetch from cancellation and timeout of one of callers
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise JarpcTimeout('No response from concurrent call with the same key')
+            except JarpcTimeout:
+                if deadline is None or fetch_deadline is None or fetch_deadline >= deadline:
+                    raise
+            timeout = deadline - time.monotonic()
+
+    def _fetch(self, key: str, request: JarpcRequest, kwargs: dict, timeout: Optional[float],
+               refresh: bool = False) -> Tuple[asyncio.Future, Optional[float]]:
+        """
+        Get shared fetch of key and its deadline (monotonic), starting it if there is none.
+        Failure of fetch started as background refresh is logged once, as no caller awaits it.
+        """
+        pending = self._pending.get(key)
+        if pending is not None and not pending[0].done():
+            return pending
+        fetch_request = JarpcRequest(method=request.method, params=request.params, ts=time.time(), ttl=timeout,
+                                     rsvp=True, compression=request.compression, trace=request.trace,
+                                     priority=request.priority)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = asyncio.ensure_future(self._load(key, fetch_request, self._make_call_kwargs(kwargs, deadline)))
+        self._pending[key] = future, deadline
+
+        def forget(_):
+            if self._pending.get(key, (None,))[0] is future:
+                del self._pending[key]
+
+        future.add_done_callback(forget)
+        if refresh:
+            future.add_done_callback(self._log_refresh_error)
+        return future, deadline
+
+    async def _load(self, key: str, request: JarpcRequest, kwargs: dict) -> JarpcResponse:
+        request_string = request.serialize(dumps=self.dumps) if self.needs_request_string else None
+        return self._store(key, request, await self.transport(request_string, request, **kwargs))
+
+    @staticmethod
+    def _log_refresh_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f'Cached response refresh failed: {future.exception()!r}')
@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+Traffic capture and replay: record sampled real requests handled by a manager, and feed them back into
+another manager to reproduce production load shapes before rolling out handler changes.
+
+`TrafficRecorder` given to `JarpcManager`/`AsyncJarpcManager` as `recorder` samples handled requests and appends
+them to a rotating capture file, together with receive time, handling latency, method, outcome and response.
+Request is recorded as it was received (request string or frame) and response as manager serialized it, so
+recording doesn't serialize anything again. Records are built and written, and the file is rotated, by background
+thread, so handling doesn't wait for disk; records not fitting in its queue (`max_queue_bytes` of requests and
+responses) are dropped. Requests failed to parse are not recorded.
+
+Capture file layout:
+```
+b'JRPCAP\\x01' | record | record | ...
+record: received (unix time): float64 | latency (seconds): float32 | outcome: uint8 | flags: uint8
+        | error code: int32 | method length: uint16 | request length: uint32 | response length: uint32
+        | method: utf-8 | request: JSON message or binary frame (see `jarpc.framing`) | response: JSON message
+```
+Outcome is one of "ok", "error", "dropped" (rsvp=True request got no response, e.g. expired) and "notification".
+Numbers are big-endian. When file grows over `max_bytes`, it is renamed to "<path>.1" (older files are shifted
+to "<path>.2" and so on, up to `backup_count`), and new file is started. Truncated last record is skipped on read.
+
+`replay` sends captured requests to a manager at original (or `speed` times faster) pace. Request ts is shifted
+by the time passed since capture, so request is as old on arrival as it was originally and expires the same way.
+Replay reports original and replayed latency and outcomes, and diffs of results: results of successful calls and
+error codes of failed calls are compared.
+
+Example of usage:
+```
+recorder = TrafficRecorder('/var/lib/kitchen/traffic.cap', sample_rate=0.01)
+manager = AsyncJarpcManager(dispatcher, recorder=recorder)
+...
+report = await replay(AsyncJarpcManager(new_dispatcher), read_capture('/var/lib/kitchen/traffic.cap'), speed=2.0)
+print(report.format())
+```
+
+Command line:
+```
+python -m jarpc.capture show traffic.cap
+python -m jarpc.capture replay traffic.cap --dispatcher kitchen.rpc:dispatcher --speed 2
+```
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Sequence, Union
+
+from .bench import PERCENTILES, percentile
+from .client import load_response
+from .dispatcher import import_method
+from .format import JarpcRequest, JarpcResponse
+from .framing import is_frame, pack_frame, unpack_frame
+from .manager import AsyncJarpcManager, JarpcManager
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b'JRPCAP\x01'
+
+# received | latency | outcome | flags | error code | method length | request length | response length
+_record_header = struct.Struct('>dfBBiHII')
+
+OUTCOMES = ('ok', 'error', 'dropped', 'notification')
+
+_TEXT_REQUEST = 1
+
+
+class CapturedCall:
+    """Request recorded by `TrafficRecorder`. """
+
+    __slots__ = ('received', 'latency', 'outcome', 'error_code', 'method', 'request', 'response')
+
+    def __init__(self, received: float, latency: float, outcome: str, error_code: Optional[int], method: str,
+                 request: Union[str, bytes], response: Optional[str]):
+        """
+        :param received: time (unix) request was received
+        :param latency: time (seconds) request was handled
+        :param outcome: one of `OUTCOMES`
+        :param error_code: code of error if outcome is "error"
+        :param method: method of request
+        :param request: request string or request frame
+        :param response: response string, None if there was no response or responses were not recorded
+        """
+        self.received = received
+        self.latency = latency
+        self.outcome = outcome
+        self.error_code = error_code
+        self.method = method
+        self.request = request
+        self.response = response
+
+    def __repr__(self):
+        return f'<CapturedCall method {self.method}, received {self.received}, latency {self.latency}, ' \
+               f'outcome {self.outcome}>'
+
+
+class TrafficRecorder:
+    """Sampling recorder of requests handled by manager into rotating capture file. """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_bytes: int = 64 * 1024 * 1024,
+                 backup_count: int = 3, record_responses: bool = True, max_queue_bytes: int = 16 * 1024 * 1024):
+        """
+        :param path: capture file path, new records are appended to existing file
+        :param sample_rate: share of requests to record, from 0 to 1
+        :param max_bytes: capture file is rotated when it grows over this size
+        :param backup_count: number of rotated files kept
+        :param record_responses: record responses too, to compare results on replay
+        :param max_queue_bytes: max size of requests and responses waiting to be written, the rest are dropped
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.record_responses = record_responses
+        self.max_queue_bytes = max_queue_bytes
+        self.recorded = 0
+        self.dropped = 0
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._file = self._open()
+        self._queue = queue.Queue()
+        self._queued_bytes = 0
+        self._queue_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='jarpc-capture', daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        f = open(self.path, 'ab')
+        if f.tell() == 0:
+            f.write(CAPTURE_MAGIC)
+        return f
+
+    def sample(self) -> bool:
+        """Decide whether to record next request. """
+        return self.sample_rate >= 1 or self._random.random() < self.sample_rate
+
+    def record(self, message: Union[str, bytes], request: JarpcRequest, response: Optional[JarpcResponse],
+               response_string: Optional[str], received: float, latency: float):
+        """
+        Queue request handled by manager to be appended to capture file.
+        :param message: request string or request frame, as received by manager
+        :param request: parsed request
+        :param response: response of manager
+        :param response_string: serialized response (JSON envelope if response is sent as frame)
+        :param received: time (unix) request was received
+        :param latency: time (seconds) request was handled
+        """
+        error_code = 0
+        if response is None:
+            outcome = 'dropped' if request.rsvp else 'notification'
+        else:
+            outcome = 'ok' if response.success else 'error'
+            if not response.success and isinstance(response.error, dict) and \
+                    isinstance(response.error.get('code'), int):
+                error_code = response.error['code']
+        if not self.record_responses:
+            response_string = None
+        if isinstance(message, memoryview):
+            # buffer of message may be reused once it is handled
+            message = bytes(message)
+
+        size = len(message) + (len(response_string) if response_string else 0)
+        with self._queue_lock:
+            if self._closed:
+                return
+            if self._queued_bytes + size > self.max_queue_bytes:
+                self.dropped += 1
+                return
+            self._queued_bytes += size
+        self._queue.put_nowait((size, received, latency, outcome, error_code, request.method, message, response_string))
+
+    @staticmethod
+    def _make_record(received: float, latency: float, outcome: str, error_code: int, method: str,
+                     message: Union[str, bytes], response_string: Optional[str]) -> List[bytes]:
+        flags = 0
+        if isinstance(message, str):
+            message = message.encode()
+            flags |= _TEXT_REQUEST
+        method = method.encode()[:0xffff]
+        response = response_string.encode() if response_string else b''
+        header = _record_header.pack(received, latency, OUTCOMES.index(outcome), flags, error_code, len(method),
+                                     len(message), len(response))
+        return [header, method, message, response]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                size, *fields = item
+                record = self._make_record(*fields)
+                with self._lock:
+                    self._file.writelines(record)
+                    self.recorded += 1
+                    if self._file.tell() >= self.max_bytes:
+                        self._rotate()
+            except Exception:
+                logger.exception(f'Failed to write capture file {self.path}')
+            finally:
+                if item is not None:
+                    with self._queue_lock:
+                        self._queued_bytes -= size
+                self._queue.task_done()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = self._open()
+
+    def flush(self):
+        """Wait until queued records are written, and flush capture file. """
+        self._queue.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """Write queued records and close capture file. """
+        with self._queue_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+
+def _read_file(path: str) -> Iterator[CapturedCall]:
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f'Not a capture file: {path}')
+        while True:
+            header = f.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return
+            received, latency, outcome, flags, error_code, method_length, request_length, response_length = \
+                _record_header.unpack(header)
+            body = f.read(method_length + request_length + response_length)
+            if len(body) < method_length + request_length + response_length:
+                logger.warning(f'Truncated record skipped in {path}')
+                return
+            request = body[method_length:method_length + request_length]
+            response = body[method_length + request_length:]
+            yield CapturedCall(
+                received=received,
+                latency=latency,
+                outcome=OUTCOMES[outcome],
+                error_code=error_code if OUTCOMES[outcome] == 'error' else None,
+                method=body[:method_length].decode(),
+                request=request.decode() if flags & _TEXT_REQUEST else request,
+                response=response.decode() if response else None,
+            )
+
+
+def read_capture(path: str, include_rotated: bool = True) -> Iterator[CapturedCall]:
+    """
+    Read captured calls, oldest first.
+    :param path: capture file path
+    :param include_rotated: read rotated files ("<path>.N") before the current one
+    """
+    paths = [path]
+    if include_rotated:
+        i = 1
+        while os.path.exists(f'{path}.{i}'):
+            paths.insert(0, f'{path}.{i}')
+            i += 1
+    for file_path in paths:
+        if os.path.exists(file_path):
+            yield from _read_file(file_path)
+
+
+class ReplayReport:
+    """Outcomes of replayed calls compared to captured ones. """
+
+    def __init__(self, max_diffs: int = 100):
+        self.max_diffs = max_diffs
+        self.replayed = 0
+        self.elapsed = 0.0
+        self.original_latencies: List[float] = []
+        self.latencies: List[float] = []
+        self.original_outcomes = Counter()
+        self.outcomes = Counter()
+        self.compared = 0
+        self.mismatched = 0
+        self.diffs: List[dict] = []
+
+    def record(self, call: CapturedCall, outcome: str, latency: float, diff: Optional[dict]):
+        self.replayed += 1
+        self.original_outcomes[call.outcome] += 1
+        self.outcomes[outcome] += 1
+        if call.outcome != 'notification':
+            self.original_latencies.append(call.latency)
+        if outcome != 'notification':
+            self.latencies.append(latency)
+        if diff is not None:
+            self.compared += 1
+            if diff:
+                self.mismatched += 1
+                if len(self.diffs) < self.max_diffs:
+                    self.diffs.append(diff)
+
+    @staticmethod
+    def _latency_summary(latencies: List[float]) -> dict:
+        latencies = sorted(latencies)
+        return {f'p{q:g}': percentile(latencies, q) * 1000 for q in PERCENTILES} if latencies else {}
+
+    @property
+    def summary(self) -> dict:
+        return {
+            'elapsed': self.elapsed,
+            'replayed': self.replayed,
+            'original_latency_ms': self._latency_summary(self.original_latencies),
+            'latency_ms': self._latency_summary(self.latencies),
+            'original_outcomes': dict(self.original_outcomes),
+            'outcomes': dict(self.outcomes),
+            'compared': self.compared,
+            'mismatched': self.mismatched,
+            'diffs': self.diffs,
+        }
+
+    def format(self) -> str:
+        summary = self.summary
+        lines = [f'{summary["elapsed"]:.2f}s: replayed {summary["replayed"]}, '
+                 f'results compared {summary["compared"]}, mismatched {summary["mismatched"]}']
+        for name in ('original_latency_ms', 'latency_ms'):
+            if summary[name]:
+                percentiles = '  '.join(f'{q} {value:.3f}' for q, value in summary[name].items())
+                lines.append(f'{name.replace("_", " ")}: {percentiles}')
+        for outcome in OUTCOMES:
+            if self.original_outcomes[outcome] or self.outcomes[outcome]:
+                lines.append(f'{outcome}: {self.original_outcomes[outcome]} -> {self.outcomes[outcome]}')
+        for diff in summary['diffs']:
+            lines.append(f'diff {diff["method"]} {diff["request_id"]}: {diff["expected"]!r} -> {diff["actual"]!r}')
+        return '\n'.join(lines)
+
+
+def _shift_ts(request: Union[str, bytes], shift: float, loads, dumps) -> Union[str, bytes]:
+    """Add `shift` to ts of request string or request frame. """
+    frame = is_frame(request)
+    envelope, attachments = unpack_frame(request) if frame else (request, ())
+    data = loads(envelope)
+    data['ts'] += shift
+    envelope = dumps(data)
+    return pack_frame(envelope.encode(), attachments) if frame else envelope
+
+
+def _get_outcome(response: Optional[Union[str, bytes]], rsvp: bool, loads) -> (str, Optional[JarpcResponse]):
+    if response is None:
+        return ('dropped' if rsvp else 'notification'), None
+    jarpc_response = load_response(response, loads=loads)
+    return ('ok' if jarpc_response.success else 'error'), jarpc_response
+
+
+def _compare(call: CapturedCall, request_id: str, outcome: str, response: Optional[JarpcResponse],
+             loads) -> Optional[dict]:
+    """Get diff of replayed call with captured one, empty if they match, None if they can't be compared. """
+    if call.outcome == 'notification' or (call.response is None and call.outcome != 'dropped'):
+        return None
+    expected = _response_value(loads(call.response)) if call.response else None
+    actual = _response_value(response.data) if response is not None else None
+    if call.outcome == outcome and expected == actual:
+        return {}
+    return {'method': call.method, 'request_id': request_id, 'expected': expected, 'actual': actual}
+
+
+def _response_value(data: dict) -> dict:
+    """Get compared part of response data: result, or error code. """
+    if 'error' not in data:
+        return {'result': data.get('result')}
+    error = data['error']
+    return {'error': error.get('code') if isinstance(error, dict) else error}
+
+
+async def replay(manager: Union[JarpcManager, AsyncJarpcManager], calls: Iterable[CapturedCall],
+                 speed: float = 1.0, compare: bool = True, max_diffs: int = 100) -> ReplayReport:
+    """
+    Send captured requests to manager at their original pace.
+    `JarpcManager` handles requests in default executor of event loop, `AsyncJarpcManager` in the loop itself.
+    :param manager: manager to replay requests to
+    :param calls: captured calls, ordered by receive time
+    :param speed: pace multiplier, 2 makes intervals between requests twice shorter
+    :param compare: compare results of replayed calls with captured responses
+    :param max_diffs: max number of diffs kept in report
+    """
+    report = ReplayReport(max_diffs=max_diffs)
+    loop = asyncio.get_event_loop()
+    is_async = inspect.iscoroutinefunction(manager.handle)
+    tasks = set()
+
+    async def replay_call(call: CapturedCall, request: Union[str, bytes], scheduled: float):
+        handle = manager.handle_frame if is_frame(request) else manager.handle
+        try:
+            if is_async:
+                response = await handle(request)
+            else:
+                response = await loop.run_in_executor(None, handle, request)
+        except Exception as e:
+            logger.exception(e)
+            return
+        latency = time.perf_counter() - scheduled
+        jarpc_request = _parse_request(request, manager.loads)
+        outcome, jarpc_response = _get_outcome(response, jarpc_request.rsvp, manager.loads)
+        diff = _compare(call, jarpc_request.id, outcome, jarpc_response, manager.loads) if compare else None
+        report.record(call, outcome, latency, diff)
+
+    started = time.perf_counter()
+    wall_started = time.time()
+    first_received = None
+    for call in calls:
+        if first_received is None:
+            first_received = call.received
+        offset = (call.received - first_received) / speed
+        scheduled = started + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            request = _shift_ts(call.request, wall_started + offset - call.received, manager.loads, manager.dumps)
+        except Exception as e:
+            logger.warning(f'Captured request of {call.method} skipped: {e!r}')
+            continue
+        task = asyncio.ensure_future(replay_call(call, request, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _parse_request(request: Union[str, bytes], loads) -> JarpcRequest:
+    if is_frame(request):
+        envelope, attachments = unpack_frame(request)
+        return JarpcRequest.from_json(envelope, loads=loads, attachments=attachments)
+    return JarpcRequest.from_json(request, loads=loads)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m jarpc.capture', description='Inspect and replay JARPC traffic.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    show = commands.add_parser('show', help='summarize capture')
+    show.add_argument('path', help='capture file path')
+    replay_parser = commands.add_parser('replay', help='replay capture to manager')
+    replay_parser.add_argument('path', help='capture file path')
+    replay_parser.add_argument('--dispatcher', metavar='MODULE:NAME', required=True, help='dispatcher to replay to')
+    replay_parser.add_argument('--sync', action='store_true', help='replay to JarpcManager instead of async one')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='pace multiplier')
+    replay_parser.add_argument('--no-compare', action='store_true', help="don't compare results")
+    replay_parser.add_argument('--json', action='store_true', help='print report as JSON')
+    return parser
+
+
+def show(calls: Iterable[CapturedCall]) -> str:
+    """Summarize captured calls by method. """
+    latencies = {}
+    outcomes = {}
+    first = last = None
+    for call in calls:
+        first = call.received if first is None else first
+        last = call.received
+        latencies.setdefault(call.method, []).append(call.latency)
+        outcomes.setdefault(call.method, Counter())[call.outcome] += 1
+    if first is None:
+        return 'no calls'
+    lines = [f'{sum(map(len, latencies.values()))} calls in {last - first:.2f}s']
+    for method, method_latencies in sorted(latencies.items()):
+        method_latencies.sort()
+        counts = ', '.join(f'{outcome} {count}' for outcome, count in outcomes[method].items())
+        lines.append(f'{method}: {counts}; latency ms p50 {percentile(method_latencies, 50) * 1000:.3f}  '
+                     f'p99 {percentile(method_latencies, 99) * 1000:.3f}')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    args = make_parser().parse_args(argv)
+    calls = read_capture(args.path)
+    if args.command == 'show':
+        print(show(calls))
+        return
+
+    # manager would log a warning on each request dropped as expired
+    logging.getLogger('jarpc').setLevel(logging.ERROR)
+    dispatcher = import_method(args.dispatcher)
+    manager = JarpcManager(dispatcher) if args.sync else AsyncJarpcManager(dispatcher)
+    loop = asyncio.new_event_loop()
+    try:
+        report = loop.run_until_complete(replay(manager, calls, speed=args.speed, compare=not args.no_compare))
+    finally:
+        loop.close()
+    if args.json:
+        print(json.dumps(report.summary, indent=2, default=str))
+    else:
+        print(report.format())
+
+
+if __name__ == '__main__':
+    main()
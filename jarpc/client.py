@@ -1,10 +1,95 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import inspect
+import logging
 import time
 import uuid
-from typing import Optional, Callable, Any, Union
+from asyncio import CancelledError
+from typing import Optional, Callable, Any, Union, Sequence
 
-from .format import json_loads, json_dumps, JarpcRequest, JarpcResponse
-from .errors import raise_exception, JarpcError, JarpcServerError
+from .compression import AdaptiveCompressor, decompress_payload, is_compressed
+from .format import CANCEL_METHOD, json_loads, json_dumps, JarpcRequest, JarpcResponse, JarpcAttachedResult
+from .errors import raise_exception, JarpcError, JarpcServerError, JarpcTimeout
+from .framing import is_frame, unpack_response
+from .tracing import Tracer, get_trace_context
+
+logger = logging.getLogger(__name__)
+
+
+def accepts_timeout(transport) -> bool:
+    """Check if transport can get `timeout` kwarg: by `accepts_timeout` attribute or by its signature. """
+    accepts = getattr(transport, 'accepts_timeout', None)
+    if accepts is not None:
+        return accepts
+    try:
+        return 'timeout' in inspect.signature(transport).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+# outcome of wrapped transport's call which was cancelled before finishing
+CANCELLED_CALL = object()
+
+
+def make_call_kwargs(kwargs: dict, deadline: Optional[float], transport_accepts_timeout: bool) -> dict:
+    """Pass time left until `deadline` (monotonic) to wrapped transport as `timeout`, fail if no time is left. """
+    if deadline is None or not transport_accepts_timeout:
+        return kwargs
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise JarpcTimeout('No time left for call')
+    return {**kwargs, 'timeout': timeout}
+
+
+def load_call_response(request: JarpcRequest, response,
+                       loads: Callable[[str], Any] = json_loads) -> Optional[JarpcResponse]:
+    """Load response of wrapped transport's call, None for notification: its result is ignored by client. """
+    return load_response(response, loads=loads) if request.rsvp else None
+
+
+def load_response(response: Union[str, bytes, JarpcResponse],
+                  loads: Callable[[str], Any] = json_loads) -> JarpcResponse:
+    """
+    Make response object from transport's result: response string, response frame or response object itself.
+    Compressed response is decompressed (see `jarpc.compression`).
+    """
+    if isinstance(response, JarpcResponse):
+        # in-process transports may skip serialization
+        return response
+    if is_compressed(response):
+        try:
+            response = decompress_payload(response)
+        except ValueError as e:
+            raise JarpcServerError(e) from e
+    if is_frame(response):
+        return unpack_response(response, loads=loads)
+    return JarpcResponse.from_json(response, loads=loads)
+
+
+class TransportWrapper:
+    """
+    Base of transports wrapping another transport, passing its capabilities on to client.
+
+    Wrapper sending call to another endpoint than the one which got a previous call with the same id (e.g. to another
+    replica) must set `forwards_cancel = False`, so client doesn't send cancellations to wrong servers.
+    """
+
+    def __init__(self, transport, loads: Callable[[str], Any] = json_loads):
+        """
+        :param transport: transport to wrap
+        :param loads: json loads
+        """
+        self.transport = transport
+        self.needs_request_string = getattr(transport, 'needs_request_string', True)
+        self.forwards_cancel = getattr(transport, 'forwards_cancel', True)
+        self.loads = loads
+        self._transport_accepts_timeout = accepts_timeout(transport)
+
+    def _make_call_kwargs(self, kwargs: dict, deadline: Optional[float]) -> dict:
+        return make_call_kwargs(kwargs, deadline, self._transport_accepts_timeout)
+
+    def _load_response(self, request: JarpcRequest, response) -> Optional[JarpcResponse]:
+        return load_call_response(request, response, loads=self.loads)
 
 
 class JarpcClient:
@@ -14,8 +99,18 @@ class JarpcClient:
     To make RPC it requires transport.
     Transport gets JARPC request as string, JarpcRequest-object and kwargs given with client call.
     If rsvp is True, transport must return JARPC response string, otherwise transport may not return any result.
+    Transport may also return JarpcResponse-object (see `jarpc.loopback`).
+    Transport with `needs_request_string = False` attribute gets None instead of request string.
     Transport's exceptions will be overwritten with `JarpcServerError` unless they are `JarpcError` subclasses.
 
+    Request's time left until expiration is passed to transport as `timeout` kwarg (capped by `timeout` given with
+    call), if transport has `timeout` parameter or `accepts_timeout = True` attribute.
+    Time left is counted from request's `ts`, so time spent before sending (e.g. in client-side queues) is included.
+    Already expired request fails with `JarpcTimeout` without sending.
+
+    Transport with `accepts_durable = True` attribute gets `durable=True` kwarg with durable calls
+    (see `jarpc.durable`).
+
     Example of usage with python "requests" library:
     ```
     def requests_transport(request_string, request, timeout=60.0):
@@ -49,6 +144,17 @@ class JarpcClient:
     ```
     salad = kitchen.cook_salad(name='Caesar')
     ```
+
+    Binary data can be sent out-of-band with `attachments` (see `jarpc.framing`).
+    Transport must send `request.attachments` next to the envelope, e.g. as `pack_frame(request_string.encode(),
+    request.attachments)`, and may return response frame instead of response string.
+
+    With `compressor`, client accepts compressed responses, and once server told it accepts compression too,
+    large requests without attachments are compressed (see `jarpc.compression`). Then transport gets request string
+    as bytes.
+
+    Trace context of the current span is passed in "trace" field of request, with `tracer` client records spans
+    of calls (see `jarpc.tracing`).
     """
 
     def __init__(self,
@@ -58,7 +164,9 @@ class JarpcClient:
                  default_rpc_ttl: Optional[float] = None,
                  default_notification_ttl: Optional[float] = None,
                  loads: Callable[[str], Any] = json_loads,
-                 dumps: Callable[[Any], str] = json_dumps):
+                 dumps: Callable[[Any], str] = json_dumps,
+                 compressor: Optional[AdaptiveCompressor] = None,
+                 tracer: Optional[Tracer] = None):
         """
         :param transport: callable to send request
         :param default_ttl: float time interval while calling still actual
@@ -66,12 +174,20 @@ class JarpcClient:
         :param default_notification_ttl: default_ttl for rsvp=False calls (if None default_ttl will be used)
         :param loads: json loads
         :param dumps: json dumps
+        :param compressor: compresses requests when server accepts compression
+        :param tracer: records spans of calls (see `jarpc.tracing`)
         """
         self._transport = transport
+        self._needs_request_string = getattr(transport, 'needs_request_string', True)
+        self._accepts_timeout = accepts_timeout(transport)
+        self._accepts_durable = getattr(transport, 'accepts_durable', False)
         self._default_rpc_ttl = default_rpc_ttl or default_ttl
         self._default_notification_ttl = default_notification_ttl or default_ttl
         self._loads = loads
         self._dumps = dumps
+        self._compressor = compressor
+        self._server_codecs = None  # codecs server accepts, learned from responses
+        self._tracer = tracer
 
     def __getattr__(self, method):
         def simple_call(**params):
@@ -79,10 +195,19 @@ class JarpcClient:
         return simple_call
 
     def __call__(self, method: str, params: dict, ts: Optional[float] = None, ttl: Optional[float] = None,
-                 id: Optional[str] = None, rsvp: bool = True, durable: bool = False, **transport_kwargs) -> str:
+                 id: Optional[str] = None, rsvp: bool = True, durable: bool = False,
+                 attachments: Optional[Sequence] = None, priority: Optional[str] = None,
+                 **transport_kwargs) -> str:
 
-        request = self._prepare_request(method, params, ts, ttl, id, rsvp, durable)
-        request_string = request.serialize(dumps=self._dumps)
+        request = self._prepare_request(method, params, ts, ttl, id, rsvp, durable, attachments, priority)
+        if self._tracer is not None:
+            with self._tracer.client_span(request):
+                return self._send(request, durable, transport_kwargs)
+        return self._send(request, durable, transport_kwargs)
+
+    def _send(self, request: JarpcRequest, durable: bool, transport_kwargs: dict):
+        request_string = self._serialize_request(request)
+        transport_kwargs = self._make_transport_kwargs(request, transport_kwargs, durable)
 
         try:
             response_string = self._transport(request_string, request, **transport_kwargs)
@@ -91,16 +216,18 @@ class JarpcClient:
         except Exception as e:
             raise JarpcServerError(e)
 
-        return self._parse_response(response_string, rsvp)
+        return self._parse_response(response_string, request.rsvp)
 
     def _prepare_request(self, method: str, params: dict, ts: Optional[float] = None, ttl: Optional[float] = None,
-                         id: Optional[str] = None, rsvp: bool = True, durable: bool = False) -> JarpcRequest:
+                         id: Optional[str] = None, rsvp: bool = True, durable: bool = False,
+                         attachments: Optional[Sequence] = None, priority: Optional[str] = None) -> JarpcRequest:
         """Make request."""
         if durable:
             ttl = None
         else:
             default_ttl = self._default_rpc_ttl if rsvp else self._default_notification_ttl
             ttl = default_ttl if ttl is None else ttl
+        trace_context = get_trace_context()
 
         return JarpcRequest(
             method=method,
@@ -108,14 +235,45 @@ class JarpcClient:
             ts=time.time() if ts is None else ts,
             ttl=ttl,
             id=str(uuid.uuid4()) if id is None else id,
-            rsvp=rsvp
+            rsvp=rsvp,
+            attachments=attachments,
+            compression=self._compressor.codecs if self._compressor is not None else None,
+            trace=trace_context.header if trace_context is not None else None,
+            priority=priority,
         )
 
-    def _parse_response(self, response_string: str, rsvp: bool):
+    def _serialize_request(self, request: JarpcRequest) -> Optional[Union[str, bytes]]:
+        if not self._needs_request_string:
+            return None
+        request_string = request.serialize(dumps=self._dumps)
+        if self._server_codecs and not request.attachments:
+            return self._compressor.compress(request_string, self._server_codecs) or request_string
+        return request_string
+
+    def _make_transport_kwargs(self, request: JarpcRequest, transport_kwargs: dict, durable: bool = False) -> dict:
+        """Pass time left until request expires to transport as timeout, fail if request is already expired."""
+        if durable and self._accepts_durable:
+            transport_kwargs = {**transport_kwargs, 'durable': True}
+        remaining = request.remaining
+        if remaining is None:
+            return transport_kwargs
+        if remaining <= 0:
+            raise JarpcTimeout(f'Request expired {-remaining:.3f}s before sending')
+        if self._accepts_timeout:
+            timeout = transport_kwargs.get('timeout')
+            timeout = remaining if timeout is None else min(timeout, remaining)
+            transport_kwargs = {**transport_kwargs, 'timeout': timeout}
+        return transport_kwargs
+
+    def _parse_response(self, response_string: Union[str, bytes, JarpcResponse], rsvp: bool):
         """Parse response and either return result or raise JARPC error."""
         if rsvp:
-            response = JarpcResponse.from_json(response_string, loads=self._loads)
+            response = load_response(response_string, loads=self._loads)
+            if response.compression is not None and self._compressor is not None:
+                self._server_codecs = response.compression
             if response.success:
+                if response.attachments:
+                    return JarpcAttachedResult(result=response.result, attachments=response.attachments)
                 return response.result
             else:
                 error = response.error
@@ -129,7 +287,15 @@ class AsyncJarpcClient(JarpcClient):
     To make RPC it requires async transport.
     Transport gets JARPC request as string, JarpcRequest-object and kwargs given with client call.
     If rsvp is True, transport must return JARPC response string, otherwise transport may not return any result.
+    Transport may also return JarpcResponse-object (see `jarpc.loopback`).
+    Transport with `needs_request_string = False` attribute gets None instead of request string.
     Transport's exceptions will be overwritten with `JarpcServerError` unless they are `JarpcError` subclasses.
+    Time left until request expires is passed to transport as `timeout` kwarg, as in `JarpcClient`.
+
+    With `cancel_remote=True`, when caller is cancelled or transport times out, notification of reserved method
+    `CANCEL_METHOD` is sent in background with the same transport, so `AsyncJarpcManager` cancels the abandoned call.
+    It is not sent through transports with `forwards_cancel = False` attribute, which can't send it to the server
+    which got the call (e.g. `AsyncBalancingTransport` and `AsyncAffinityTransport` choosing replica for each call).
 
     Example of usage with python "aiohttp" library:
     ```
@@ -171,17 +337,54 @@ class AsyncJarpcClient(JarpcClient):
     salad = await kitchen.cook_salad(name='Caesar')
     ```
     """
+
+    def __init__(self, *args, cancel_remote: bool = False, **kwargs):
+        """
+        :param cancel_remote: send `CANCEL_METHOD` notification when call is abandoned, if transport forwards it
+        Other params are the same as of `JarpcClient`.
+        """
+        super().__init__(*args, **kwargs)
+        self._cancel_remote = cancel_remote and getattr(self._transport, 'forwards_cancel', True)
+        self._cancel_tasks = set()
+
     async def __call__(self, method: str, params: dict, ts: Optional[float] = None, ttl: Optional[float] = None,
-                       id: Optional[str] = None, rsvp: bool = True, durable: bool = False, **transport_kwargs) -> str:
+                       id: Optional[str] = None, rsvp: bool = True, durable: bool = False,
+                       attachments: Optional[Sequence] = None, priority: Optional[str] = None,
+                       **transport_kwargs) -> str:
 
-        request = self._prepare_request(method, params, ts, ttl, id, rsvp, durable)
-        request_string = request.serialize(dumps=self._dumps)
+        request = self._prepare_request(method, params, ts, ttl, id, rsvp, durable, attachments, priority)
+        if self._tracer is not None:
+            with self._tracer.client_span(request):
+                return await self._send(request, durable, transport_kwargs)
+        return await self._send(request, durable, transport_kwargs)
+
+    async def _send(self, request: JarpcRequest, durable: bool, transport_kwargs: dict):
+        request_string = self._serialize_request(request)
+        transport_kwargs = self._make_transport_kwargs(request, transport_kwargs, durable)
 
         try:
             response_string = await self._transport(request_string, request, **transport_kwargs)
+        except (CancelledError, JarpcTimeout):
+            if request.rsvp and self._cancel_remote:
+                self._send_cancel(request)
+            raise
         except JarpcError:
             raise
         except Exception as e:
             raise JarpcServerError(e)
 
-        return self._parse_response(response_string, rsvp)
+        return self._parse_response(response_string, request.rsvp)
+
+    def _send_cancel(self, request: JarpcRequest):
+        """Send notification cancelling abandoned call in background. """
+        cancel_request = self._prepare_request(CANCEL_METHOD, {'request_id': request.id}, rsvp=False)
+        request_string = cancel_request.serialize(dumps=self._dumps) if self._needs_request_string else None
+        transport_kwargs = self._make_transport_kwargs(cancel_request, {})
+        task = asyncio.ensure_future(self._transport(request_string, cancel_request, **transport_kwargs))
+        self._cancel_tasks.add(task)
+        task.add_done_callback(self._cancel_sent)
+
+    def _cancel_sent(self, task: asyncio.Future):
+        self._cancel_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f'Cancellation was not sent: {task.exception()!r}')
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Negotiated compression of large payloads.
+
+Compressed payload layout:
+```
+b'JRPZ' | codec name length: uint8 | codec name: ascii | compressed payload (JSON message or binary frame)
+```
+It can never be confused with JSON message or binary frame (see `jarpc.framing`).
+
+Compression is negotiated, so peers without it keep working:
+- client with `compressor` lists its codecs in "compression" field of request,
+- manager with `compressor` compresses response with one of them, and lists codecs it can decompress
+  in "compression" field of response,
+- client compresses requests only after it learned codecs of the server from a response.
+Manager and client always decompress compressed payloads with registered codecs.
+
+`AdaptiveCompressor` skips payloads not worth compressing: smaller than threshold, or compressing poorly
+(checked on a sample of large payloads first). Threshold is doubled after each poorly compressed payload,
+so small incompressible payloads stop being tried, and halved back after each well compressed one.
+Every `probe_interval`-th payload skipped only by raised threshold is tried anyway, so threshold may go back down.
+
+Codecs "zlib" and "lzma" are registered, others can be added with `register_codec`:
+```
+register_codec(Codec('zstd', compress=zstd.compress, decompress=lambda data, max_size: zstd.decompress(data)))
+client = AsyncJarpcClient(transport, compressor=AdaptiveCompressor(codecs=('zstd', 'zlib')))
+```
+"""
+import lzma
+import struct
+import zlib
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+COMPRESSED_MAGIC = b'JRPZ'
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+_header = struct.Struct('>4sB')
+
+
+class Codec:
+    """Named pair of compress and decompress functions. """
+
+    def __init__(self, name: str, compress: Callable[[bytes], bytes], decompress: Callable[[bytes, int], bytes]):
+        """
+        :param name: codec name, up to 255 ascii characters
+        :param compress: compresses bytes
+        :param decompress: decompresses bytes, raises `ValueError` if data is malformed or result is larger than
+                           size given as 2nd arg
+        """
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return f'<Codec {self.name}>'
+
+
+def _zlib_decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ValueError(e) from e
+    if decompressor.unconsumed_tail:
+        raise ValueError(f'Decompressed payload is larger than {max_size} bytes')
+    if not decompressor.eof:
+        raise ValueError('Compressed payload is truncated')
+    return result
+
+
+def _lzma_decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = lzma.LZMADecompressor()
+    try:
+        result = decompressor.decompress(data, max_size)
+    except lzma.LZMAError as e:
+        raise ValueError(e) from e
+    if not decompressor.eof:
+        if decompressor.needs_input:
+            raise ValueError('Compressed payload is truncated')
+        raise ValueError(f'Decompressed payload is larger than {max_size} bytes')
+    return result
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    """Make codec available for compression and decompression, replacing codec with the same name. """
+    if not 0 < len(codec.name.encode('ascii')) <= 255:
+        raise ValueError(f'Bad codec name: {codec.name!r}')
+    _codecs[codec.name] = codec
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError(f'Unknown codec: {name!r}') from None
+
+
+register_codec(Codec('zlib', compress=lambda data: zlib.compress(data, 1), decompress=_zlib_decompress))
+register_codec(Codec('lzma', compress=lambda data: lzma.compress(data, preset=1), decompress=_lzma_decompress))
+
+
+def registered_codecs() -> Tuple[str, ...]:
+    return tuple(_codecs)
+
+
+def is_compressed(data) -> bool:
+    """Check whether `data` is a compressed payload. """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(COMPRESSED_MAGIC)]) == COMPRESSED_MAGIC
+
+
+def compress_payload(data: bytes, codec: str) -> bytes:
+    name = codec.encode('ascii')
+    return _header.pack(COMPRESSED_MAGIC, len(name)) + name + get_codec(codec).compress(data)
+
+
+def decompress_payload(data, max_size: int = DEFAULT_MAX_DECOMPRESSED_SIZE) -> bytes:
+    """
+    Decompress compressed payload.
+    :raises ValueError: payload is malformed, its codec is unknown or it is larger than `max_size` decompressed
+    """
+    data = memoryview(data)
+    if data.nbytes < _header.size:
+        raise ValueError('Compressed payload is truncated')
+    magic, name_length = _header.unpack_from(data)
+    if magic != COMPRESSED_MAGIC:
+        raise ValueError('Not a compressed payload')
+    name_end = _header.size + name_length
+    codec = get_codec(bytes(data[_header.size:name_end]).decode('ascii', errors='replace'))
+    return codec.decompress(bytes(data[name_end:]), max_size)
+
+
+class AdaptiveCompressor:
+    """Compressor of payloads worth compressing with adaptive threshold. """
+
+    def __init__(self, codecs: Sequence[str] = ('zlib',), threshold: int = 16 * 1024, max_threshold: int = 1 << 20,
+                 max_ratio: float = 0.8, sample_size: int = 4096, probe_interval: int = 100):
+        """
+        :param codecs: codecs to compress with, in order of preference
+        :param threshold: min size (bytes) of payload to compress
+        :param max_threshold: max size (bytes) threshold is raised to
+        :param max_ratio: max compressed to original size ratio of payload worth compressing
+        :param sample_size: size (bytes) of sample compressed first for payloads larger than twice of it
+        :param probe_interval: number of payloads skipped by raised threshold before one of them is tried
+        """
+        for codec in codecs:
+            get_codec(codec)
+        self.codecs = tuple(codecs)
+        self.min_threshold = threshold
+        self.threshold = threshold
+        self.max_threshold = max_threshold
+        self.max_ratio = max_ratio
+        self.sample_size = sample_size
+        self.probe_interval = probe_interval
+        self.compressed = 0
+        self.skipped = 0
+        self.incompressible = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._skipped_by_threshold = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'threshold': self.threshold,
+            'compressed': self.compressed,
+            'skipped': self.skipped,
+            'incompressible': self.incompressible,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+    def choose_codec(self, accepted: Optional[Sequence[str]] = None) -> Optional[str]:
+        """Get preferred codec accepted by peer, None if there is no such codec. """
+        if accepted is None:
+            return self.codecs[0] if self.codecs else None
+        return next((codec for codec in self.codecs if codec in accepted), None)
+
+    def compress(self, data: Union[str, bytes], accepted: Optional[Sequence[str]] = None) -> Optional[bytes]:
+        """
+        Compress payload with preferred codec accepted by peer.
+        :return: compressed payload, None if payload is not worth compressing
+        """
+        codec = self.choose_codec(accepted)
+        if codec is None or len(data) < self.min_threshold or (len(data) < self.threshold and not self._probe()):
+            self.skipped += 1
+            return None
+        if isinstance(data, str):
+            data = data.encode()
+        compress = get_codec(codec).compress
+        if len(data) > 2 * self.sample_size and \
+                len(compress(data[:self.sample_size])) > self.max_ratio * self.sample_size:
+            self._adapt(False)
+            return None
+        compressed = compress_payload(data, codec)
+        if len(compressed) > self.max_ratio * len(data):
+            self._adapt(False)
+            return None
+        self._adapt(True)
+        self.compressed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def _probe(self) -> bool:
+        self._skipped_by_threshold += 1
+        if self._skipped_by_threshold < self.probe_interval:
+            return False
+        self._skipped_by_threshold = 0
+        return True
+
+    def _adapt(self, compressible: bool):
+        if compressible:
+            self.threshold = max(self.threshold // 2, self.min_threshold)
+        else:
+            self.incompressible += 1
+            self.threshold = min(self.threshold * 2, self.max_threshold)
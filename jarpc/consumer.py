@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline-ordered consumer of requests fed to `AsyncJarpcManager` from a message broker.
+
+`QueueConsumer` prefetches up to `prefetch` messages and handles them by `concurrency` workers in order
+of request deadline (ts + ttl) rather than arrival, so after a backlog fresh requests are handled while they
+are still actual. Requests expired while waiting are purged (acked without being handled); requests without ttl
+are handled after all requests with ttl waiting at the moment. Malformed messages are handled first, producing
+error responses.
+
+Message is acked after its response is published to its `reply_to` queue (notifications and requests without
+`reply_to` are acked after handling). If publishing fails, message is rejected to be redelivered.
+
+Broker is accessed through `Broker` interface, `InMemoryBroker` implements it in memory, e.g. for tests.
+
+Example of usage:
+```
+consumer = QueueConsumer(AsyncJarpcManager(dispatcher), broker, prefetch=200, concurrency=20)
+consumer.start()
+...
+await consumer.stop()
+```
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+
+from .compression import decompress_payload, is_compressed
+from .format import JarpcRequest
+from .framing import is_frame, unpack_request
+from .manager import AsyncJarpcManager
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerMessage:
+    """Message received from broker. """
+
+    __slots__ = ('body', 'reply_to', 'tag', 'settled')
+
+    def __init__(self, body: Union[str, bytes], reply_to: Optional[str] = None, tag=None):
+        """
+        :param body: request string or request frame
+        :param reply_to: name of queue to publish response to, None if response is not needed
+        :param tag: broker's identifier of message, to ack it
+        """
+        self.body = body
+        self.reply_to = reply_to
+        self.tag = tag
+        self.settled = False  # set by consumer once ack or reject is sent
+
+    def __repr__(self):
+        return f'<BrokerMessage tag {self.tag}, reply_to {self.reply_to}>'
+
+
+class Broker:
+    """Interface of message broker for `QueueConsumer`. """
+
+    async def receive(self, max_messages: int) -> List[BrokerMessage]:
+        """Wait for messages, returns from 1 to `max_messages` of them. """
+        raise NotImplementedError
+
+    async def publish(self, reply_to: str, body: Union[str, bytes]):
+        """Publish response to `reply_to` queue. """
+        raise NotImplementedError
+
+    async def ack(self, message: BrokerMessage):
+        """Remove handled message from queue. """
+        raise NotImplementedError
+
+    async def reject(self, message: BrokerMessage, requeue: bool = True):
+        """Return message to queue to be delivered again, or drop it if `requeue` is False. """
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """In-memory broker with single request queue, keeping published responses by `reply_to`. """
+
+    def __init__(self):
+        self.queue = deque()
+        self.unacked: Dict[int, BrokerMessage] = {}
+        self.replies: Dict[str, List[Union[str, bytes]]] = {}
+        self.acked = 0
+        self._tags = itertools.count()
+        self._available = None
+
+    def send(self, body: Union[str, bytes], reply_to: Optional[str] = None):
+        """Put request into queue. """
+        self.queue.append(BrokerMessage(body, reply_to, next(self._tags)))
+        if self._available is not None:
+            self._available.set()
+
+    async def receive(self, max_messages: int) -> List[BrokerMessage]:
+        if self._available is None:
+            self._available = asyncio.Event()
+        while not self.queue:
+            self._available.clear()
+            await self._available.wait()
+        messages = [self.queue.popleft() for _ in range(min(max_messages, len(self.queue)))]
+        for message in messages:
+            self.unacked[message.tag] = message
+        return messages
+
+    async def publish(self, reply_to: str, body: Union[str, bytes]):
+        self.replies.setdefault(reply_to, []).append(body)
+
+    async def ack(self, message: BrokerMessage):
+        del self.unacked[message.tag]
+        self.acked += 1
+
+    async def reject(self, message: BrokerMessage, requeue: bool = True):
+        del self.unacked[message.tag]
+        if requeue:
+            self.queue.appendleft(message)
+            if self._available is not None:
+                self._available.set()
+
+
+class QueueConsumer:
+    def __init__(self, manager: AsyncJarpcManager, broker: Broker, prefetch: int = 100, concurrency: int = 10):
+        """
+        :param manager: manager to handle requests
+        :param broker: broker to receive requests from and publish responses to
+        :param prefetch: max number of messages received but not acked yet
+        :param concurrency: max number of requests handled at the same time
+        """
+        self.manager = manager
+        self.broker = broker
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.received = 0
+        self.handled = 0
+        self.purged = 0
+        self.published = 0
+        self.failed = 0
+        self._pending = []  # heap of (deadline, seq, message, (request, body) or None if malformed)
+        self._seq = itertools.count()
+        self._outstanding = 0  # received messages not acked or rejected yet
+        self._fetcher = None
+        self._workers = []
+        self._has_pending = None
+        self._slot_freed = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'outstanding': self._outstanding,
+            'received': self.received,
+            'handled': self.handled,
+            'purged': self.purged,
+            'published': self.published,
+            'failed': self.failed,
+        }
+
+    def start(self):
+        """Start receiving and handling requests in background. """
+        self._has_pending = asyncio.Event()
+        self._slot_freed = asyncio.Event()
+        self._fetcher = asyncio.ensure_future(self._fetch())
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Stop receiving requests, wait up to `timeout` seconds for received ones to be handled,
+        then reject requests still pending.
+        """
+        self._fetcher.cancel()
+        await asyncio.wait([self._fetcher])
+        self._has_pending.set()  # wake idle workers to exit
+        _, unfinished = await asyncio.wait(self._workers, timeout=timeout)
+        for worker in unfinished:
+            worker.cancel()
+        if unfinished:
+            await asyncio.wait(unfinished)
+        while self._pending:
+            _, _, message, _ = heapq.heappop(self._pending)
+            await self._settle(message, self.broker.reject(message, requeue=True))
+
+    async def _fetch(self):
+        while True:
+            free = self.prefetch - self._outstanding
+            if free <= 0:
+                self._slot_freed.clear()
+                await self._slot_freed.wait()
+                continue
+            try:
+                messages = await self.broker.receive(free)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f'Failed to receive messages: {e!r}')
+                await asyncio.sleep(1.0)
+                continue
+            for message in messages:
+                self.received += 1
+                self._outstanding += 1
+                parsed = self._parse(message.body)
+                if parsed is None:
+                    deadline = -math.inf
+                elif parsed[0].ttl is None:
+                    deadline = math.inf
+                else:
+                    deadline = parsed[0].ts + parsed[0].ttl
+                heapq.heappush(self._pending, (deadline, next(self._seq), message, parsed))
+            self._has_pending.set()
+
+    def _parse(self, body) -> Optional[Tuple[JarpcRequest, Union[str, bytes]]]:
+        """
+        Parse request to learn its deadline, None if it is malformed.
+        Returns request together with decompressed body it was parsed from, to be handled without parsing again.
+        """
+        try:
+            if is_compressed(body):
+                body = decompress_payload(body)
+            if is_frame(body):
+                return unpack_request(body, loads=self.manager.loads), body
+            return JarpcRequest.from_json(body, loads=self.manager.loads), body
+        except Exception:
+            return None
+
+    async def _work(self):
+        while True:
+            if not self._pending:
+                if self._fetcher.done():
+                    return
+                self._has_pending.clear()
+                await self._has_pending.wait()
+                continue
+            _, _, message, parsed = heapq.heappop(self._pending)
+            try:
+                await self._handle(message, parsed)
+            except asyncio.CancelledError:
+                # stopped while handling, message is redelivered unless it is being acked already
+                if not message.settled:
+                    await self._settle(message, self.broker.reject(message, requeue=True))
+                raise
+
+    async def _handle(self, message: BrokerMessage, parsed: Optional[Tuple[JarpcRequest, Union[str, bytes]]]):
+        if parsed is not None and parsed[0].expired:
+            self.purged += 1
+            logger.debug(f'Expired request purged: {parsed[0]}')
+            await self._settle(message, self.broker.ack(message))
+            return
+
+        try:
+            if parsed is None:
+                # manager makes error response for malformed message
+                response = await self.manager.handle(message.body)
+            else:
+                # request is not parsed again, recorder and rate limiter see it as if passed to `handle`
+                response = await self.manager.handle_request(*parsed)
+        except Exception as e:
+            # manager turns method errors into error responses, this is a bug of manager or its hooks
+            logger.exception(e)
+            self.failed += 1
+            await self._settle(message, self.broker.reject(message, requeue=False))
+            return
+        self.handled += 1
+
+        if response is not None and message.reply_to is not None:
+            try:
+                await self.broker.publish(message.reply_to, response)
+            except Exception as e:
+                logger.warning(f'Failed to publish response to {message.reply_to}: {e!r}')
+                self.failed += 1
+                await self._settle(message, self.broker.reject(message, requeue=True))
+                return
+            self.published += 1
+        await self._settle(message, self.broker.ack(message))
+
+    async def _settle(self, message: BrokerMessage, settlement):
+        """Await ack or reject of message, freeing prefetch slot. """
+        message.settled = True
+        try:
+            await settlement
+        except Exception as e:
+            logger.warning(f'Failed to settle message {message.tag}: {e!r}')
+        finally:
+            self._outstanding -= 1
+            self._slot_freed.set()
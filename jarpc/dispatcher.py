@@ -1,5 +1,28 @@
 # -*- coding: utf-8 -*-
-from .errors import JarpcMethodNotFound
+import asyncio
+import importlib
+import logging
+import threading
+from functools import reduce
+from typing import List, Tuple
+
+from .errors import JarpcInternalError, JarpcMethodNotFound
+
+logger = logging.getLogger(__name__)
+
+
+def parse_import_path(path: str) -> Tuple[str, List[str]]:
+    """Split import path "package.module:Class.method" into module name and names of attributes. """
+    module_name, _, attribute = path.partition(':')
+    if not module_name or not attribute:
+        raise ValueError(f'Bad import path: {path}')
+    return module_name, attribute.split('.')
+
+
+def import_method(path: str):
+    """Import object by path "package.module:function" (or "package.module:Class.method"). """
+    module_name, attributes = parse_import_path(path)
+    return reduce(getattr, attributes, importlib.import_module(module_name))
 
 
 class JarpcDispatcher:
@@ -9,27 +32,104 @@ class JarpcDispatcher:
         if not isinstance(method_map, (dict, type(None))):
             raise TypeError
         self.method_map = method_map or dict()
+        self.lazy_methods = dict()  # method name -> import path, until method is imported
+        self.priorities = dict()  # method name -> lane name (see `jarpc.priority`)
+        self._import_locks = dict()  # method name -> lock held while method is imported
 
     def __getitem__(self, item):
         try:
             return self.method_map[item]
         except KeyError as e:
-            raise JarpcMethodNotFound(e) from e
+            if item not in self.lazy_methods:
+                raise JarpcMethodNotFound(e) from e
+        return self._import_method(item)
+
+    async def get_async(self, item):
+        """Get method as `dispatcher[item]` does, importing method added by import path in executor. """
+        try:
+            return self.method_map[item]
+        except KeyError as e:
+            if item not in self.lazy_methods:
+                raise JarpcMethodNotFound(e) from e
+        # import executes module code, which must not block event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._import_method, item)
 
     def rpc_method(self, f):
         """Decorator: adds `f` as RPC method.
         `f` can retrieve JarpcRequest object through optional `jarpc_request` argument.
         """
+        self.lazy_methods.pop(f.__name__, None)
         self.method_map[f.__name__] = f
         return f
 
-    def add_rpc_method(self, f, name=None):
+    def add_rpc_method(self, f, name=None, priority=None):
         """Adds `f` as RPC method.
+        `f` can be import path "package.module:function", then it is imported on first call or by `warm_up`
+        (`AsyncJarpcManager` imports it in executor, see `get_async`).
         If `name` is not None, it is used as method name.
+        If `priority` is not None, it is used as lane of method's requests without priority (see `jarpc.priority`).
         `f` can retrieve JarpcRequest object through optional `jarpc_request` argument.
         """
-        self.method_map[name or f.__name__] = f
+        if isinstance(f, str):
+            _, attributes = parse_import_path(f)
+            name = name or attributes[-1]
+            self.method_map.pop(name, None)
+            self.lazy_methods[name] = f
+        else:
+            name = name or f.__name__
+            self.lazy_methods.pop(name, None)
+            self.method_map[name] = f
+        if priority is not None:
+            self.priorities[name] = priority
+
+    def get_priority(self, method):
+        """Get lane of method's requests, None if it is not set. """
+        return self.priorities.get(method)
 
     def update(self, dispatcher):
         """Add methods from `dispatcher`, overriding on any collisions. """
+        for name in dispatcher.method_map:
+            self.lazy_methods.pop(name, None)
+        for name in dispatcher.lazy_methods:
+            self.method_map.pop(name, None)
         self.method_map.update(dispatcher.method_map)
+        self.lazy_methods.update(dispatcher.lazy_methods)
+        self.priorities.update(dispatcher.priorities)
+
+    def warm_up(self, background: bool = False):
+        """
+        Import methods added by import path, so first calls don't wait for imports.
+        Methods failing to import are logged, and their calls get `JarpcInternalError`.
+
+        :param background: import in daemon thread, returned to be joined if needed
+        """
+        if background:
+            thread = threading.Thread(target=self.warm_up, name='jarpc-warm-up', daemon=True)
+            thread.start()
+            return thread
+        for name in list(self.lazy_methods):
+            try:
+                self._import_method(name)
+            except JarpcInternalError:
+                pass
+
+    def _import_method(self, name):
+        """Import method added by import path, once for all threads: imports of other methods are not blocked. """
+        with self._import_locks.setdefault(name, threading.Lock()):
+            # could be imported while waiting for lock
+            method = self.method_map.get(name)
+            if method is not None:
+                return method
+            path = self.lazy_methods.get(name)
+            if path is None:
+                raise JarpcMethodNotFound(KeyError(name))
+            try:
+                method = import_method(path)
+            except Exception as e:
+                # not cached: failed module is not kept in `sys.modules`, next call tries again
+                logger.exception(f'Failed to import method "{name}" from {path}')
+                raise JarpcInternalError(f'Failed to import method "{name}": {e!r}') from e
+            self.method_map[name] = method
+            del self.lazy_methods[name]
+            self._import_locks.pop(name, None)
+            return method
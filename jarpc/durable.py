@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+Durable outbox: notifications made with durable=True survive transport outages and process restarts.
+
+`DurableOutboxTransport` and `AsyncDurableOutboxTransport` wrap client transport. Durable notifications
+(rsvp=False, durable=True) are appended to local log file, and the call returns as soon as the log is synced
+to disk; background sender sends them one by one in order, retrying failed sends with backoff until the transport
+recovers. Other calls are sent as usual.
+- concurrent appends are group-committed: one write and fsync for all records appended while previous
+  commit was in progress (and `commit_delay` seconds before it),
+- notifications left unsent by previous process are replayed in order on start,
+- notifications are deduplicated by request id: notification with id pending in the log, or one of the last
+  `max_acked` acked ids, is not appended again,
+- sent notifications are acked in the log, acks are written with the next commit or within `ack_delay` seconds,
+- log grown over `compact_size` bytes, at least half of which are sent notifications and acks, is compacted:
+  pending notifications and remembered acks are written to new file, which atomically replaces the log.
+Notification acked shortly before crash may be sent again: delivery is at least once, and handlers should be
+idempotent by request id.
+
+Example of usage:
+```
+transport = AsyncDurableOutboxTransport(AsyncStreamTransport(path='/run/billing.sock'),
+                                        path='/var/lib/kitchen/billing.log')
+billing = AsyncJarpcClient(transport=transport)
+await billing(method='charge', params={'order_id': 1, 'amount': 100}, rsvp=False, durable=True)
+...
+await transport.close()
+```
+"""
+import asyncio
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from .client import accepts_timeout
+from .compression import decompress_payload, is_compressed
+from .errors import JarpcServerError
+from .framing import pack_frame, unpack_frame
+from .format import JarpcRequest, json_loads
+
+logger = logging.getLogger(__name__)
+
+# record: payload length: uint32 | crc32 of payload: uint32 | payload
+_record_header = struct.Struct('>II')
+_id_length = struct.Struct('>H')
+_PUT = b'P'
+_ACK = b'A'
+
+
+class _Batch:
+    __slots__ = ('records', 'done', 'error')
+
+    def __init__(self):
+        self.records = []
+        self.done = False
+        self.error = None
+
+
+class DurableLog:
+    """
+    Thread-safe append-only log of pending entries with group commit.
+
+    Put record is payload of entry with its id, ack record marks entry with id as done.
+    Acks are group-committed by timer, unless a put commits them first.
+    Commit compacts log which is mostly garbage, so its size is bounded by pending entries even if it never
+    runs empty. Torn or corrupted tail (e.g. after crash while writing) is truncated on open.
+    """
+
+    def __init__(self, path: str, commit_delay: float = 0.0, fsync: bool = True, compact_size: int = 1 << 20,
+                 ack_delay: float = 1.0, max_acked: int = 10000):
+        """
+        :param path: log file path, created if missing
+        :param commit_delay: time (seconds) to wait for more records before commit
+        :param fsync: sync log to disk on commit, without it records survive process crash but not OS crash
+        :param compact_size: min size (bytes) of log to compact it
+        :param ack_delay: max time (seconds) acks are buffered before commit
+        :param max_acked: number of last acked ids remembered to reject their entries if they are put again
+        """
+        self.path = path
+        self.commit_delay = commit_delay
+        self.fsync = fsync
+        self.compact_size = compact_size
+        self.ack_delay = ack_delay
+        self.max_acked = max_acked
+        self.commits = 0
+        self._cond = threading.Condition()
+        self._batch = _Batch()
+        self._writing = False
+        self._pending = OrderedDict()  # id -> payload
+        self._loaded = set()  # ids of entries found on open
+        self._live_size = 0  # size of put records of pending entries and ack records of remembered acks
+        self._acked = OrderedDict()  # last acked ids, oldest first
+        self._ack_timer = None
+        self._file = open(path, 'ab+')
+        self._size = self._load()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def replay(self) -> List[Tuple[str, bytes]]:
+        """Get pending entries found on open in order, as (id, payload). """
+        with self._cond:
+            return [(entry_id, payload) for entry_id, payload in self._pending.items() if entry_id in self._loaded]
+
+    def put(self, entry_id: str, payload: bytes) -> bool:
+        """
+        Append entry and wait until it is committed.
+        :return: False if entry with the same id is already pending or was recently acked
+        """
+        with self._cond:
+            if entry_id in self._pending or entry_id in self._acked:
+                return False
+            record = self._make_put_record(entry_id, payload)
+            self._pending[entry_id] = payload
+            self._live_size += len(record)
+            try:
+                self._commit(self._add_record(record))
+            except BaseException:
+                if self._pending.pop(entry_id, None) is not None:
+                    self._live_size -= len(record)
+                raise
+            return True
+
+    def ack(self, entry_id: str):
+        """Mark entry as done, ack is written with the next commit, at most in `ack_delay` seconds. """
+        with self._cond:
+            payload = self._pending.pop(entry_id, None)
+            if payload is None:
+                return
+            self._live_size -= len(self._make_put_record(entry_id, payload))
+            self._remember_acked(entry_id)
+            self._add_record(self._make_record(_ACK + entry_id.encode()))
+            if self._ack_timer is None:
+                self._ack_timer = threading.Timer(self.ack_delay, self._commit_acks)
+                self._ack_timer.daemon = True
+                self._ack_timer.start()
+
+    def commit(self):
+        """Write and sync buffered records. """
+        with self._cond:
+            if self._batch.records:
+                self._commit(self._batch)
+
+    def close(self):
+        with self._cond:
+            if self._ack_timer is not None:
+                self._ack_timer.cancel()
+                self._ack_timer = None
+        self.commit()
+        with self._cond:
+            self._file.close()
+
+    def _commit_acks(self):
+        with self._cond:
+            self._ack_timer = None
+            if self._file.closed:
+                return
+        try:
+            self.commit()
+        except Exception:
+            logger.exception(f'Failed to commit acks to durable log {self.path}')
+
+    def _remember_acked(self, entry_id: str):
+        if entry_id in self._acked:
+            self._acked.move_to_end(entry_id)
+            return
+        self._acked[entry_id] = None
+        self._live_size += _record_header.size + 1 + len(entry_id.encode())
+        if len(self._acked) > self.max_acked:
+            forgotten, _ = self._acked.popitem(last=False)
+            self._live_size -= _record_header.size + 1 + len(forgotten.encode())
+
+    @staticmethod
+    def _make_record(payload: bytes) -> bytes:
+        return _record_header.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _make_put_record(self, entry_id: str, payload: bytes) -> bytes:
+        return self._make_record(_PUT + _id_length.pack(len(entry_id.encode())) + entry_id.encode() + payload)
+
+    def _add_record(self, record: bytes) -> _Batch:
+        self._batch.records.append(record)
+        return self._batch
+
+    def _make_compacted(self, size: int) -> Optional[bytes]:
+        """Records of remembered acks and pending entries, if log of `size` bytes is worth compacting. """
+        if size < self.compact_size or self._live_size * 2 > size:
+            return None
+        acks = [self._make_record(_ACK + entry_id.encode()) for entry_id in self._acked]
+        puts = [self._make_put_record(entry_id, payload) for entry_id, payload in self._pending.items()]
+        return b''.join(acks + puts)
+
+    def _commit(self, batch: _Batch):
+        """Wait until batch is committed, writing it if no other thread is writing (lock must be held). """
+        while not batch.done:
+            if self._writing:
+                self._cond.wait()
+                continue
+            self._writing = True
+            try:
+                if self.commit_delay:
+                    self._cond.release()
+                    try:
+                        time.sleep(self.commit_delay)
+                    finally:
+                        self._cond.acquire()
+                # records added while previous batch was being written are committed together
+                written, self._batch = self._batch, _Batch()
+                data = b''.join(written.records)
+                # log is replaced by its live records, including ones of this batch
+                compacted = self._make_compacted(self._size + len(data))
+                self._cond.release()
+                try:
+                    if compacted is not None:
+                        compacted = self._rewrite(compacted)
+                    if compacted is None:
+                        self._write(data)
+                except BaseException as e:
+                    written.error = e
+                finally:
+                    self._cond.acquire()
+                if written.error is None:
+                    self._size = len(compacted) if compacted is not None else self._size + len(data)
+                    self.commits += 1
+                written.done = True
+            finally:
+                self._writing = False
+                self._cond.notify_all()
+        if batch.error is not None:
+            raise batch.error
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _rewrite(self, data: bytes) -> Optional[bytes]:
+        """Atomically replace log with `data`, returns None if it failed and log is left as is. """
+        temp_path = self.path + '.compact'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError:
+            logger.exception(f'Failed to compact durable log {self.path}')
+            return None
+        self._file.close()
+        self._file = open(self.path, 'ab+')
+        if self.fsync:
+            # rename is durable once directory is synced
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        return data
+
+    def _load(self) -> int:
+        self._file.seek(0)
+        data = self._file.read()
+        offset = 0
+        while offset + _record_header.size <= len(data):
+            length, crc = _record_header.unpack_from(data, offset)
+            start = offset + _record_header.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            if payload[:1] == _PUT:
+                (id_length,) = _id_length.unpack_from(payload, 1)
+                entry_id = payload[3:3 + id_length].decode()
+                if entry_id not in self._pending:
+                    self._pending[entry_id] = payload[3 + id_length:]
+                    self._loaded.add(entry_id)
+                    self._live_size += _record_header.size + length
+            elif payload[:1] == _ACK:
+                entry_id = payload[1:].decode()
+                if entry_id in self._pending:
+                    self._live_size -= len(self._make_put_record(entry_id, self._pending.pop(entry_id)))
+                self._remember_acked(entry_id)
+            offset = start + length
+        if offset < len(data):
+            logger.warning(f'Truncating corrupted tail of durable log {self.path}: {len(data) - offset} bytes')
+            self._file.truncate(offset)
+        return offset
+
+
+class _DurableOutboxTransportBase:
+    accepts_durable = True
+    needs_request_string = True
+
+    def __init__(self, transport, path: str, commit_delay: float = 0.0, fsync: bool = True,
+                 compact_size: int = 1 << 20, ack_delay: float = 1.0, max_acked: int = 10000,
+                 retry_delay: float = 0.1, max_retry_delay: float = 5.0, loads: Callable[[str], Any] = json_loads):
+        """
+        :param transport: transport to wrap
+        :param path: log file path, created if missing
+        :param commit_delay: time (seconds) to wait for more notifications before commit
+        :param fsync: sync log to disk on commit
+        :param compact_size: min size (bytes) of log to compact it
+        :param ack_delay: max time (seconds) acks of sent notifications are buffered before commit
+        :param max_acked: number of ids of last sent notifications remembered to drop their duplicates
+        :param retry_delay: time (seconds) to wait before resending failed notification, doubled on each failure
+        :param max_retry_delay: max time (seconds) to wait before resending failed notification
+        :param loads: json loads
+        """
+        self.transport = transport
+        self.accepts_timeout = accepts_timeout(transport)
+        self.log = DurableLog(path, commit_delay=commit_delay, fsync=fsync, compact_size=compact_size,
+                              ack_delay=ack_delay, max_acked=max_acked)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.loads = loads
+        self.sent = 0
+        self.failed = 0
+        self.duplicates = 0
+        self._closed = False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'pending': len(self.log),
+            'sent': self.sent,
+            'failed': self.failed,
+            'duplicates': self.duplicates,
+            'commits': self.log.commits,
+        }
+
+    @staticmethod
+    def _is_durable(request: JarpcRequest, durable: bool) -> bool:
+        # response of replayed call has nobody to return to
+        return durable and not request.rsvp
+
+    @staticmethod
+    def _make_payload(request_string: Union[str, bytes], request: JarpcRequest) -> bytes:
+        if isinstance(request_string, str):
+            request_string = request_string.encode()
+        return pack_frame(request_string, request.attachments or ())
+
+    def _load_entry(self, payload: bytes) -> Tuple[Union[str, bytes], JarpcRequest]:
+        envelope, attachments = unpack_frame(payload)
+        envelope = bytes(envelope)
+        # compressed request string is sent as is
+        request_string = envelope if is_compressed(envelope) else envelope.decode()
+        request = JarpcRequest.from_json(decompress_payload(envelope) if is_compressed(envelope) else envelope,
+                                         loads=self.loads,
+                                         attachments=[bytes(attachment) for attachment in attachments])
+        return request_string, request
+
+    def _next_retry_delay(self, delay: Optional[float]) -> float:
+        return self.retry_delay if delay is None else min(delay * 2, self.max_retry_delay)
+
+
+class DurableOutboxTransport(_DurableOutboxTransportBase):
+    """Transport for `JarpcClient` logging durable notifications to disk and sending them from background thread. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        for entry_id, payload in self.log.replay():
+            self._queue.put((*self._load_entry(payload), {}))
+        self._thread = threading.Thread(target=self._run, name='jarpc-durable-outbox', daemon=True)
+        self._thread.start()
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, durable: bool = False, **kwargs):
+        if not self._is_durable(request, durable):
+            return self.transport(request_string, request, **kwargs)
+        if self._closed:
+            raise JarpcServerError('Durable outbox is closed')
+        if self.log.put(request.id, self._make_payload(request_string, request)):
+            self._queue.put((request_string, request, kwargs))
+        else:
+            self.duplicates += 1
+        return None
+
+    def flush(self):
+        """Wait until all queued notifications are sent. """
+        self._queue.join()
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop sending, notifications left unsent are replayed by the next outbox with the same log. """
+        self._closed = True
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self.log.close()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is None or not self._send(*entry):
+                    return
+            finally:
+                self._queue.task_done()
+
+    def _send(self, request_string: str, request: JarpcRequest, kwargs: dict) -> bool:
+        """Send notification until it is sent, returns False if outbox was closed before. """
+        delay = None
+        while not self._stopped.is_set():
+            try:
+                self.transport(request_string, request, **kwargs)
+            except Exception as e:
+                self.failed += 1
+                delay = self._next_retry_delay(delay)
+                logger.warning(f'Durable notification {request.method} was not sent, retrying in {delay}s: {e!r}')
+                self._stopped.wait(delay)
+            else:
+                self.sent += 1
+                self.log.ack(request.id)
+                return True
+        return False
+
+
+class AsyncDurableOutboxTransport(_DurableOutboxTransportBase):
+    """
+    Transport for `AsyncJarpcClient` logging durable notifications to disk and sending them from background task.
+    Log is written in default executor, so concurrent calls are group-committed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queue = None
+        self._stopped = None
+        self._task = None
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, durable: bool = False, **kwargs):
+        if not self._is_durable(request, durable):
+            return await self.transport(request_string, request, **kwargs)
+        if self._closed:
+            raise JarpcServerError('Durable outbox is closed')
+        self.start()
+        loop = asyncio.get_event_loop()
+        if await loop.run_in_executor(None, self.log.put, request.id, self._make_payload(request_string, request)):
+            self._queue.put_nowait((request_string, request, kwargs))
+        else:
+            self.duplicates += 1
+        return None
+
+    def start(self):
+        """Start sending notifications left unsent by previous outbox, otherwise it is started by the first call. """
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._stopped = asyncio.Event()
+            for entry_id, payload in self.log.replay():
+                self._queue.put_nowait((*self._load_entry(payload), {}))
+            self._task = asyncio.ensure_future(self._run())
+
+    async def flush(self):
+        """Wait until all queued notifications are sent. """
+        if self._task is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Stop sending, notifications left unsent are replayed by the next outbox with the same log. """
+        self._closed = True
+        if self._task is not None:
+            self._stopped.set()
+            self._queue.put_nowait(None)
+            await self._task
+        await asyncio.get_event_loop().run_in_executor(None, self.log.close)
+
+    async def _run(self):
+        while True:
+            entry = await self._queue.get()
+            try:
+                if entry is None or not await self._send(*entry):
+                    return
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, request_string: str, request: JarpcRequest, kwargs: dict) -> bool:
+        """Send notification until it is sent, returns False if outbox was closed before. """
+        delay = None
+        while not self._stopped.is_set():
+            try:
+                await self.transport(request_string, request, **kwargs)
+            except Exception as e:
+                self.failed += 1
+                delay = self._next_retry_delay(delay)
+                logger.warning(f'Durable notification {request.method} was not sent, retrying in {delay}s: {e!r}')
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                self.sent += 1
+                await asyncio.get_event_loop().run_in_executor(None, self.log.ack, request.id)
+                return True
+        return False
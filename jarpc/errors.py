@@ -74,6 +74,12 @@ class JarpcServerError(JarpcError):
     message = 'Server error'
 
 
+class JarpcRejected(JarpcError):
+    """ Rejected: call was rejected by client-side overload protection without being sent, it is not retried. """
+    code = -32001
+    message = 'Rejected'
+
+
 class JarpcUnknownError(JarpcError):
     """ Unknown error: unknown exception code """
 
@@ -103,6 +109,21 @@ class JarpcForbidden(JarpcError):
     message = 'Forbidden'
 
 
+class JarpcTooManyRequests(JarpcError):
+    """ Too many requests: the caller exceeded its rate limit.
+    `data` is {"retry_after": seconds} with a hint of when the call will be allowed. """
+
+    code = 1002
+    message = 'Too many requests'
+
+    @property
+    def retry_after(self):
+        """Seconds to wait before calling again, None if there is no hint. """
+        if isinstance(self.data, dict):
+            return self.data.get('retry_after')
+        return None
+
+
 # 2xxx - неправильные входные данные
 
 class JarpcValidationError(JarpcError):
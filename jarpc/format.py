@@ -2,10 +2,13 @@
 import json
 import time
 import uuid
-from typing import Optional, Any
+from typing import Optional, Any, Sequence
 
 from .errors import JarpcInvalidRequest, JarpcParseError, JarpcServerError
 
+# reserved method cancelling in-flight call with id given in "request_id" param (see `AsyncJarpcManager`)
+CANCEL_METHOD = 'jarpc.cancel'
+
 
 def json_dumps(data):
     """Default JSON serialiser."""
@@ -21,13 +24,22 @@ class JarpcRequest:
     VERSION = '1.0'
 
     def __init__(self, method: str, params: dict, ts: Optional[float]=None, ttl: Optional[float]=None,
-                 id: Optional[str]=None, rsvp: bool=True):
+                 id: Optional[str]=None, rsvp: bool=True, attachments: Optional[Sequence]=None,
+                 compression: Optional[Sequence[str]]=None, trace: Optional[str]=None,
+                 priority: Optional[str]=None):
         self.method = method
         self.params = params
         self.ts = time.time() if ts is None else float(ts)
         self.ttl = float(ttl) if ttl is not None else None
         self.id = str(uuid.uuid4()) if id is None else id
         self.rsvp = bool(rsvp)
+        self.attachments = tuple(attachments) if attachments else ()
+        # codecs client can decompress response with (see `jarpc.compression`)
+        self.compression = tuple(compression) if compression is not None else None
+        # trace context of caller's span (see `jarpc.tracing`)
+        self.trace = trace
+        # lane of request in manager's scheduler (see `jarpc.priority`)
+        self.priority = priority
 
     def __repr__(self):
         return f'<JarpcRequest version {self.version}, method {self.method}, params {self.params}, ts {self.ts}, ' \
@@ -43,9 +55,16 @@ class JarpcRequest:
             return False
         return time.time() > self.ts + self.ttl
 
+    @property
+    def remaining(self) -> Optional[float]:
+        """Time left until request expires (negative if already expired), None if request never expires. """
+        if self.ttl is None:
+            return None
+        return self.ts + self.ttl - time.time()
+
     @property
     def data(self):
-        return {
+        data = {
             'version': self.VERSION,
             'method': self.method,
             'params': self.params,
@@ -54,18 +73,28 @@ class JarpcRequest:
             'id': self.id,
             'rsvp': self.rsvp,
         }
+        if self.attachments:
+            # binary parts travel next to the envelope (see `jarpc.framing`), only their count is serialized
+            data['attachments'] = len(self.attachments)
+        if self.compression is not None:
+            data['compression'] = list(self.compression)
+        if self.trace is not None:
+            data['trace'] = self.trace
+        if self.priority is not None:
+            data['priority'] = self.priority
+        return data
 
     def serialize(self, dumps=json_dumps):
         return dumps(self.data)
 
     @classmethod
-    def from_json(cls, body, loads=json_loads):
+    def from_json(cls, body, loads=json_loads, attachments: Sequence = ()):
         try:
             data = loads(body)
-        except (TypeError, json.JSONDecodeError) as e:
+        except (TypeError, UnicodeDecodeError, json.JSONDecodeError) as e:
             raise JarpcParseError(e) from e
 
-        return cls.from_data(data)
+        return cls.from_data(data, attachments=attachments)
 
     field_types = (
         ('method', str),
@@ -77,7 +106,7 @@ class JarpcRequest:
     )
 
     @classmethod
-    def from_data(cls, data):
+    def from_data(cls, data, attachments: Sequence = ()):
         if not isinstance(data, dict):
             raise JarpcInvalidRequest('Request body must be an object')
 
@@ -92,6 +121,22 @@ class JarpcRequest:
             if not isinstance(data[field], field_type):
                 raise JarpcInvalidRequest(f'Bad "{field}" value')
 
+        if data.get('attachments', 0) != len(attachments):
+            raise JarpcInvalidRequest('Bad "attachments" value')
+
+        compression = data.get('compression')
+        if compression is not None and not (isinstance(compression, list)
+                                            and all(isinstance(codec, str) for codec in compression)):
+            raise JarpcInvalidRequest('Bad "compression" value')
+
+        trace = data.get('trace')
+        if trace is not None and not isinstance(trace, str):
+            raise JarpcInvalidRequest('Bad "trace" value')
+
+        priority = data.get('priority')
+        if priority is not None and not isinstance(priority, str):
+            raise JarpcInvalidRequest('Bad "priority" value')
+
         return cls(
             method=data['method'],
             params=data['params'],
@@ -99,15 +144,23 @@ class JarpcRequest:
             ttl=data['ttl'],
             id=data['id'],
             rsvp=data['rsvp'],
+            attachments=attachments,
+            compression=compression,
+            trace=trace,
+            priority=priority,
         )
 
 
 class JarpcResponse:
-    def __init__(self, request_id: str, result: Any=None, error: Any=None, id: Optional[str]=None):
+    def __init__(self, request_id: str, result: Any=None, error: Any=None, id: Optional[str]=None,
+                 attachments: Optional[Sequence]=None, compression: Optional[Sequence[str]]=None):
         self.result = result
         self.error = error
         self.request_id = request_id
         self.id = str(uuid.uuid4()) if id is None else id
+        self.attachments = tuple(attachments) if attachments else ()
+        # codecs server can decompress requests with, also used for the response (see `jarpc.compression`)
+        self.compression = tuple(compression) if compression is not None else None
 
     def __repr__(self):
         return f'<JarpcResponse id {self.id} result {self.result}, error {self.error}, request_id {self.request_id}>'
@@ -130,22 +183,26 @@ class JarpcResponse:
                 'request_id': self.request_id,
                 'id': self.id
             }
+        if self.attachments:
+            data['attachments'] = len(self.attachments)
+        if self.compression is not None:
+            data['compression'] = list(self.compression)
         return data
 
     def serialize(self, dumps=json_dumps):
         return dumps(self.data)
 
     @classmethod
-    def from_json(cls, body, loads=json_loads):
+    def from_json(cls, body, loads=json_loads, attachments: Sequence = ()):
         try:
             data = loads(body)
-        except (TypeError, json.JSONDecodeError) as e:
+        except (TypeError, UnicodeDecodeError, json.JSONDecodeError) as e:
             raise JarpcServerError(e) from e
 
-        return cls.from_data(data)
+        return cls.from_data(data, attachments=attachments)
 
     @classmethod
-    def from_data(cls, data):
+    def from_data(cls, data, attachments: Sequence = ()):
         if not isinstance(data, dict):
             raise JarpcServerError('Invalid response')
         if 'result' in data != 'error' in data:
@@ -154,4 +211,26 @@ class JarpcResponse:
             raise JarpcServerError('Invalid response')
         if 'request_id' not in data or not isinstance(data['request_id'], str):
             raise JarpcServerError('Invalid response')
-        return cls(id=data['id'], request_id=data['request_id'], result=data.get('result'), error=data.get('error'))
+        if data.get('attachments', 0) != len(attachments):
+            raise JarpcServerError('Invalid response')
+        compression = data.get('compression')
+        if compression is not None and not isinstance(compression, list):
+            raise JarpcServerError('Invalid response')
+        return cls(id=data['id'], request_id=data['request_id'], result=data.get('result'), error=data.get('error'),
+                   attachments=attachments, compression=compression)
+
+
+class JarpcAttachedResult:
+    """
+    RPC method result together with binary attachments.
+
+    Return it from RPC method to send `attachments` out-of-band next to JSON `result`.
+    Client returns it instead of bare result when response has attachments.
+    """
+
+    def __init__(self, result: Any, attachments: Sequence):
+        self.result = result
+        self.attachments = tuple(attachments)
+
+    def __repr__(self):
+        return f'<JarpcAttachedResult result {self.result}, attachments {len(self.attachments)}>'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Binary framing for JARPC messages with out-of-band attachments.
+
+Frame layout (all integers are big-endian):
+```
+b'JRPF' | envelope length: uint32 | attachments count: uint32 | attachment lengths: uint64 * count
+        | envelope: JSON bytes | attachments: raw bytes, one after another
+```
+Attachments are not base64-encoded into JSON, they are carried as is next to the envelope.
+Unpacking does not copy attachments: they are returned as `memoryview`s over the frame buffer.
+Frame can never be confused with bare JSON message because JSON can not start with b'J'.
+"""
+import struct
+from typing import List, Sequence, Tuple
+
+from .errors import JarpcParseError, JarpcServerError
+from .format import JarpcRequest, JarpcResponse, json_dumps, json_loads
+
+FRAME_MAGIC = b'JRPF'
+
+_header = struct.Struct('>4sII')
+_part_length = struct.Struct('>Q')
+
+
+def is_frame(data) -> bool:
+    """Check whether `data` is a binary frame rather than JSON message. """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(FRAME_MAGIC)]) == FRAME_MAGIC
+
+
+def frame_parts(envelope: bytes, attachments: Sequence = ()) -> list:
+    """
+    Make frame as a list of buffers.
+    Suitable for vectored writes (e.g. `StreamWriter.writelines`), so attachments are not copied.
+    """
+    header = _header.pack(FRAME_MAGIC, len(envelope), len(attachments))
+    lengths = b''.join(_part_length.pack(memoryview(part).nbytes) for part in attachments)
+    return [header, lengths, envelope, *attachments]
+
+
+def pack_frame(envelope: bytes, attachments: Sequence = ()) -> bytes:
+    """Make frame as a single bytes object. """
+    return b''.join(frame_parts(envelope, attachments))
+
+
+def unpack_frame(frame) -> Tuple[bytes, List[memoryview]]:
+    """
+    Split frame into envelope and attachments.
+    Attachments are `memoryview`s over `frame` (no copying), so `frame` must stay unchanged while they are used.
+
+    :raises ValueError: malformed frame
+    """
+    view = memoryview(frame)
+    if view.nbytes < _header.size:
+        raise ValueError('Frame is too short')
+    magic, envelope_length, count = _header.unpack_from(view)
+    if magic != FRAME_MAGIC:
+        raise ValueError('Bad frame magic')
+
+    offset = _header.size
+    lengths_end = offset + count * _part_length.size
+    if view.nbytes < lengths_end:
+        raise ValueError('Frame is too short')
+    lengths = [_part_length.unpack_from(view, offset + i * _part_length.size)[0] for i in range(count)]
+
+    if view.nbytes != lengths_end + envelope_length + sum(lengths):
+        raise ValueError('Frame length mismatch')
+
+    offset = lengths_end + envelope_length
+    envelope = bytes(view[lengths_end:offset])
+    attachments = []
+    for length in lengths:
+        attachments.append(view[offset:offset + length])
+        offset += length
+    return envelope, attachments
+
+
+def pack_request(request: JarpcRequest, dumps=json_dumps) -> bytes:
+    return pack_frame(request.serialize(dumps=dumps).encode(), request.attachments)
+
+
+def unpack_request(frame, loads=json_loads) -> JarpcRequest:
+    try:
+        envelope, attachments = unpack_frame(frame)
+    except ValueError as e:
+        raise JarpcParseError(e) from e
+    return JarpcRequest.from_json(envelope, loads=loads, attachments=attachments)
+
+
+def pack_response(response: JarpcResponse, dumps=json_dumps) -> bytes:
+    return pack_frame(response.serialize(dumps=dumps).encode(), response.attachments)
+
+
+def unpack_response(frame, loads=json_loads) -> JarpcResponse:
+    try:
+        envelope, attachments = unpack_frame(frame)
+    except ValueError as e:
+        raise JarpcServerError(e) from e
+    return JarpcResponse.from_json(envelope, loads=loads, attachments=attachments)
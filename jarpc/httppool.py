@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled keep-alive HTTP transport for `JarpcClient`, based on standard `http.client`.
+
+Example of usage:
+```
+transport = HttpTransport(url='https://kitchen.org/jsonrpc', pool_size=20)
+kitchen = JarpcClient(transport=transport)
+salad = kitchen.cook_salad(name='Caesar')
+```
+"""
+import http.client
+import select
+import socket
+import threading
+import time
+from typing import Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from .compression import is_compressed
+from .errors import JarpcServerError, JarpcTimeout
+from .format import JarpcRequest
+from .framing import pack_frame
+
+# errors of keep-alive connection closed by server while it was idle in pool
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError,
+                           ConnectionAbortedError, BrokenPipeError)
+
+
+def is_connection_dropped(connection: http.client.HTTPConnection) -> bool:
+    """Tell if idle connection was closed by server: its socket is readable while no response is expected. """
+    if connection.sock is None:
+        # connects again on next request
+        return False
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except ValueError:
+        # descriptor can't be polled by `select`, let the request find out
+        return False
+    except OSError:
+        return True
+    return bool(readable)
+
+
+class HttpConnectionPool:
+    """Thread-safe pool of keep-alive connections to one host. """
+
+    def __init__(self, host: str, port: Optional[int] = None, https: bool = False, max_size: int = 10,
+                 block: bool = True, **connection_kwargs):
+        """
+        :param host: host to connect
+        :param port: port to connect
+        :param https: use HTTPS
+        :param max_size: max number of connections
+        :param block: wait for free connection if all `max_size` connections are in use, otherwise fail fast
+        :param connection_kwargs: passed to `HTTPConnection`/`HTTPSConnection`, e.g. `context`
+        """
+        self.host = host
+        self.port = port
+        self.connection_class = http.client.HTTPSConnection if https else http.client.HTTPConnection
+        self.max_size = max_size
+        self.block = block
+        self.connection_kwargs = connection_kwargs
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Get connection, returns (connection, is connection reused).
+
+        :raises JarpcServerError: pool is full and `block` is False
+        :raises JarpcTimeout: no connection became free in `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                while self._idle:
+                    connection = self._idle.pop()
+                    if not is_connection_dropped(connection):
+                        return connection, True
+                    connection.close()
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not self.block:
+                    raise JarpcServerError('Connection pool is full')
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise JarpcTimeout('No free connection in pool')
+                self._condition.wait(remaining)
+        return self.connection_class(self.host, self.port, **self.connection_kwargs), False
+
+    def release(self, connection: http.client.HTTPConnection):
+        """Return connection to pool for reuse. """
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def discard(self, connection: http.client.HTTPConnection):
+        """Close connection, freeing its place in pool. """
+        connection.close()
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def close(self):
+        """Close idle connections. """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+
+class HttpTransport:
+    """
+    Pooled keep-alive HTTP transport for `JarpcClient`.
+
+    Connections are reused between calls and threads, idle connections closed by server are dropped before reuse.
+    If reused connection still turns out to be closed, request is retried once over new connection: only if it failed
+    while being sent, or if its method is in `idempotent_methods`, as server could have got it otherwise.
+    Call timeout is taken from `timeout` kwarg, or request's remaining ttl, or `default_timeout`;
+    it includes waiting for free connection.
+    """
+
+    def __init__(self, url: str, headers: Optional[dict] = None, pool_size: int = 10, block: bool = True,
+                 default_timeout: Optional[float] = 60.0, idempotent_methods: Iterable[str] = (),
+                 **connection_kwargs):
+        """
+        :param url: JARPC endpoint URL
+        :param headers: extra HTTP headers
+        :param pool_size: max number of connections
+        :param block: wait for free connection if all connections are in use, otherwise fail fast
+        :param default_timeout: timeout for requests without ttl
+        :param idempotent_methods: methods which are safe to send again if connection was lost after sending
+        :param connection_kwargs: passed to `HTTPConnection`/`HTTPSConnection`, e.g. `context`
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme: {parts.scheme}')
+        self.url = url
+        self.path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        self.headers = headers or {}
+        self.default_timeout = default_timeout
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.pool = HttpConnectionPool(host=parts.hostname, port=parts.port, https=parts.scheme == 'https',
+                                       max_size=pool_size, block=block, **connection_kwargs)
+
+    def __call__(self, request_string: Union[str, bytes], request: JarpcRequest, timeout: Optional[float] = None):
+        if timeout is None:
+            timeout = request.remaining
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is not None and timeout <= 0:
+            raise JarpcTimeout('Request is expired')
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        body = request_string.encode() if isinstance(request_string, str) else request_string
+        if request.attachments:
+            body = pack_frame(body, request.attachments)
+            content_type = 'application/octet-stream'
+        elif is_compressed(body):
+            content_type = 'application/octet-stream'
+        else:
+            content_type = 'application/json; charset=utf-8'
+        headers = {**self.headers, 'Content-Type': content_type}
+
+        retried = False
+        while True:
+            connection, reused = self.pool.acquire(None if deadline is None else deadline - time.monotonic())
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.pool.release(connection)
+                raise JarpcTimeout('No free connection in pool')
+            sent = False
+            try:
+                self._send(connection, body, headers, remaining)
+                sent = True
+                status, data, will_close = self._receive(connection)
+            except socket.timeout:
+                self.pool.discard(connection)
+                raise JarpcTimeout(f'No response in {timeout:.3f}s')
+            except STALE_CONNECTION_ERRORS as e:
+                self.pool.discard(connection)
+                if reused and not retried and (not sent or request.method in self.idempotent_methods):
+                    retried = True
+                    continue
+                raise JarpcServerError(e)
+            except BaseException:
+                self.pool.discard(connection)
+                raise
+            break
+
+        if will_close:
+            self.pool.discard(connection)
+        else:
+            self.pool.release(connection)
+
+        if status == 204:
+            return None
+        if status != 200:
+            raise JarpcServerError(f'HTTP {status}: {data[:200]!r}')
+        return data
+
+    def close(self):
+        """Close idle connections. """
+        self.pool.close()
+
+    def _send(self, connection: http.client.HTTPConnection, body: bytes, headers: dict, timeout: Optional[float]):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request('POST', self.path, body=body, headers=headers)
+
+    @staticmethod
+    def _receive(connection: http.client.HTTPConnection) -> (int, bytes, bool):
+        response = connection.getresponse()
+        data = response.read()
+        return response.status, data, response.will_close
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side overload protection: adaptive concurrency limit and per-method circuit breakers.
+
+`LimitTransport` and `AsyncLimitTransport` wrap client transport:
+- number of calls in flight is limited with AIMD: limit grows by one while calls succeed and use it,
+  and is multiplied by `backoff_ratio` on timeouts, server errors and slow responses: slower than
+  `latency_tolerance` times baseline latency (the lowest one of the last `baseline_window` seconds),
+  or than fixed `latency_threshold` if given. Limit is decreased once per overload: calls started before
+  the last decrease don't decrease it again, as they were sent under the old limit.
+  Calls over the limit wait for a free slot until their deadline (or fail fast if `block` is False),
+- calls of a method fail fast locally while its circuit breaker is open: breaker opens when share of failures
+  among last calls exceeds threshold, and lets a few probe calls through after `open_duration`.
+Failures are transport errors, `JarpcTimeout`, `JarpcServerError` and `JarpcExternalServiceUnavailable`.
+Calls rejected locally fail with `JarpcRejected`, which is not a failure and is not retried by `RetryTransport`,
+so shedding load doesn't multiply it.
+
+Example of usage:
+```
+transport = AsyncLimitTransport(AsyncStreamTransport(path='/run/kitchen.sock'),
+                                limiter=AsyncAdaptiveLimiter(max_limit=200))
+kitchen = AsyncJarpcClient(transport=transport, default_rpc_ttl=2.0)
+salad = await kitchen.cook_salad(name='Caesar')
+print(transport.stats)
+```
+"""
+import asyncio
+import threading
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from .client import CANCELLED_CALL, TransportWrapper
+from .errors import JarpcError, JarpcRejected, JarpcTimeout
+from .format import JarpcRequest, JarpcResponse, json_loads
+from .retry import RETRYABLE_ERRORS, RETRYABLE_ERROR_CODES
+
+FAILURE_ERRORS = RETRYABLE_ERRORS + (JarpcTimeout,)
+FAILURE_ERROR_CODES = RETRYABLE_ERROR_CODES | {JarpcTimeout.code}
+
+
+def is_failure(outcome) -> bool:
+    """Check if call's outcome (response, exception or None for notification) shows server failure or overload. """
+    if outcome is None:
+        return False
+    if isinstance(outcome, JarpcResponse):
+        return not outcome.success and outcome.error.get('code') in FAILURE_ERROR_CODES
+    return isinstance(outcome, FAILURE_ERRORS) or not isinstance(outcome, JarpcError)
+
+
+class _AdaptiveLimiterBase:
+
+    def __init__(self, initial_limit: int = 20, min_limit: int = 1, max_limit: int = 1000,
+                 backoff_ratio: float = 0.9, latency_threshold: Optional[float] = None,
+                 latency_tolerance: Optional[float] = 2.0, baseline_window: float = 10.0, block: bool = True):
+        """
+        :param initial_limit: initial number of calls allowed in flight
+        :param min_limit: min limit
+        :param max_limit: max limit
+        :param backoff_ratio: limit is multiplied by it on failure
+        :param latency_threshold: successful calls slower than this (seconds) are treated as failures,
+                                  instead of comparing with baseline latency
+        :param latency_tolerance: successful calls slower than baseline latency times this are treated as failures,
+                                  None to ignore latency
+        :param baseline_window: baseline latency is the lowest latency of calls finished in this time (seconds)
+        :param block: wait for free slot if limit is reached, otherwise fail fast
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_threshold = latency_threshold
+        self.latency_tolerance = latency_tolerance
+        self.baseline_window = baseline_window
+        self.block = block
+        self._limit = float(initial_limit)
+        self._last_decrease = -math.inf
+        self._latencies = deque()  # (finished, latency) of calls in baseline window, latencies ascending
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.drops = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'drops': self.drops,
+        }
+
+    @property
+    def baseline_latency(self) -> Optional[float]:
+        """Lowest latency of successful calls finished within `baseline_window`, None if there were none. """
+        cutoff = time.monotonic() - self.baseline_window
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        return self._latencies[0][1] if self._latencies else None
+
+    def _update_limit(self, latency: Optional[float], failed: bool):
+        """Update limit by sample of finished call, latency is None for cancelled call. """
+        if latency is None:
+            return
+        now = time.monotonic()
+        overloaded = failed or self._is_slow(latency)
+        if not failed:
+            self._add_latency(now, latency)
+        if overloaded:
+            if now - latency >= self._last_decrease:
+                self.drops += 1
+                self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+                self._last_decrease = now
+        elif self.in_flight * 2 >= self._limit:
+            # grow only if limit is actually used, not just never reached
+            self._limit = min(self._limit + 1, self.max_limit)
+
+    def _is_slow(self, latency: float) -> bool:
+        if self.latency_threshold is not None:
+            return latency > self.latency_threshold
+        if self.latency_tolerance is None:
+            return False
+        baseline = self.baseline_latency
+        return baseline is not None and latency > baseline * self.latency_tolerance
+
+    def _add_latency(self, now: float, latency: float):
+        # latencies higher than the new one can't be the lowest while it is in window
+        while self._latencies and self._latencies[-1][1] >= latency:
+            self._latencies.pop()
+        self._latencies.append((now, latency))
+
+    def _reject(self):
+        self.rejected += 1
+        raise JarpcRejected('Concurrency limit exceeded')
+
+
+class AdaptiveLimiter(_AdaptiveLimiterBase):
+    """Thread-safe AIMD concurrency limiter. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        Take slot for a call.
+
+        :raises JarpcRejected: limit is reached and `block` is False
+        :raises JarpcTimeout: no slot became free in `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight >= self.limit:
+                if not self.block:
+                    self._reject()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.rejected += 1
+                    raise JarpcTimeout('No free slot in concurrency limit')
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            self.accepted += 1
+
+    def release(self, latency: Optional[float], failed: bool = False):
+        """Free slot of finished call, latency is None if call was cancelled. """
+        with self._condition:
+            self._update_limit(latency, failed)
+            self.in_flight -= 1
+            self._condition.notify(max(self.limit - self.in_flight, 0))
+
+
+class AsyncAdaptiveLimiter(_AdaptiveLimiterBase):
+    """AIMD concurrency limiter for one event loop. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters = deque()
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """
+        Take slot for a call.
+
+        :raises JarpcRejected: limit is reached and `block` is False
+        :raises JarpcTimeout: no slot became free in `timeout` seconds
+        """
+        if self.in_flight >= self.limit or self._waiters:
+            if not self.block:
+                self._reject()
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # slot is handed over by `release`
+                await asyncio.wait_for(waiter, timeout)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # slot was handed over, but caller is gone
+                    self.release(None)
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.rejected += 1
+                    raise JarpcTimeout('No free slot in concurrency limit') from None
+                raise
+        else:
+            self.in_flight += 1
+        self.accepted += 1
+
+    def release(self, latency: Optional[float], failed: bool = False):
+        """Free slot of finished call, latency is None if call was cancelled. """
+        self._update_limit(latency, failed)
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    Closed breaker opens when share of failures among last `window_size` calls reaches `failure_threshold`
+    (and at least `min_calls` were made). Open breaker rejects calls for `open_duration` seconds, then becomes
+    half-open and lets `half_open_calls` probe calls through: if they all succeed, breaker is closed,
+    otherwise it is opened again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: float = 0.5, min_calls: int = 20, window_size: int = 100,
+                 open_duration: float = 5.0, half_open_calls: int = 1):
+        """
+        :param failure_threshold: share of failed calls to open breaker
+        :param min_calls: min number of calls in window to open breaker
+        :param window_size: number of last calls to count failures in
+        :param open_duration: time (seconds) breaker is open before probing
+        :param half_open_calls: number of probe calls
+        """
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self._outcomes = deque(maxlen=window_size)  # True for failure
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._probes = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._get_state()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self._get_state(),
+                'calls': len(self._outcomes),
+                'failures': self._failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+            }
+
+    def allow(self) -> bool:
+        """Check if call is allowed, call allowed must be finished with `record`. """
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, failed: Optional[bool]):
+        """Record call's outcome, None if call was finished without outcome (e.g. cancelled). """
+        with self._lock:
+            state = self._get_state()
+            if state == self.HALF_OPEN:
+                if failed is None:
+                    self._probes -= 1
+                elif failed:
+                    self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._close()
+            elif state == self.CLOSED and failed is not None:
+                if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+                    self._failures -= 1
+                self._outcomes.append(failed)
+                self._failures += failed
+                if len(self._outcomes) >= self.min_calls and \
+                        self._failures >= self.failure_threshold * len(self._outcomes):
+                    self._open()
+
+    def _get_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+        return self._state
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+    def _close(self):
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+
+class _LimitTransportBase(TransportWrapper):
+
+    # timeout includes waiting for free slot
+    accepts_timeout = True
+
+    def __init__(self, transport, limiter, breaker_factory: Optional[Callable[[], CircuitBreaker]] = CircuitBreaker,
+                 loads: Callable[[str], Any] = json_loads):
+        """
+        :param transport: transport to wrap
+        :param limiter: concurrency limiter, AIMD limiter with default settings if not given
+        :param breaker_factory: makes circuit breaker for each method, None to not use circuit breakers
+        :param loads: json loads
+        """
+        super().__init__(transport, loads=loads)
+        self.limiter = limiter
+        self.breaker_factory = breaker_factory
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'limiter': self.limiter.stats,
+            'breakers': {method: breaker.stats for method, breaker in list(self.breakers.items())},
+        }
+
+    def _get_breaker(self, method: str) -> Optional[CircuitBreaker]:
+        if self.breaker_factory is None:
+            return None
+        breaker = self.breakers.get(method)
+        if breaker is None:
+            breaker = self.breakers.setdefault(method, self.breaker_factory())
+        return breaker
+
+    @staticmethod
+    def _check_breaker(breaker: Optional[CircuitBreaker], request: JarpcRequest):
+        if breaker is not None and not breaker.allow():
+            raise JarpcRejected(f'Circuit breaker of method "{request.method}" is open')
+
+    def _finish(self, breaker: Optional[CircuitBreaker], started: float, outcome):
+        """Record outcome of finished call. """
+        if outcome is CANCELLED_CALL:
+            self.limiter.release(None)
+            failed = None
+        else:
+            failed = is_failure(outcome)
+            self.limiter.release(time.monotonic() - started, failed=failed)
+        if breaker is not None:
+            breaker.record(failed)
+
+
+class LimitTransport(_LimitTransportBase):
+    """Transport for `JarpcClient` with adaptive concurrency limit and per-method circuit breakers. """
+
+    def __init__(self, transport, limiter: Optional[AdaptiveLimiter] = None, *args, **kwargs):
+        super().__init__(transport, AdaptiveLimiter() if limiter is None else limiter, *args, **kwargs)
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                 **kwargs):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        breaker = self._get_breaker(request.method)
+        self._check_breaker(breaker, request)
+        try:
+            self.limiter.acquire(timeout)
+        except BaseException:
+            if breaker is not None:
+                breaker.record(None)
+            raise
+
+        started = time.monotonic()
+        outcome = CANCELLED_CALL
+        try:
+            response = self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+            outcome = response = self._load_response(request, response)
+            return response
+        except Exception as e:
+            outcome = e
+            raise
+        finally:
+            self._finish(breaker, started, outcome)
+
+
+class AsyncLimitTransport(_LimitTransportBase):
+    """Transport for `AsyncJarpcClient` with adaptive concurrency limit and per-method circuit breakers. """
+
+    def __init__(self, transport, limiter: Optional[AsyncAdaptiveLimiter] = None, *args, **kwargs):
+        super().__init__(transport, AsyncAdaptiveLimiter() if limiter is None else limiter, *args, **kwargs)
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                       **kwargs):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        breaker = self._get_breaker(request.method)
+        self._check_breaker(breaker, request)
+        try:
+            await self.limiter.acquire(timeout)
+        except BaseException:
+            if breaker is not None:
+                breaker.record(None)
+            raise
+
+        started = time.monotonic()
+        outcome = CANCELLED_CALL
+        try:
+            response = await self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+            outcome = response = self._load_response(request, response)
+            return response
+        except Exception as e:
+            outcome = e
+            raise
+        finally:
+            self._finish(breaker, started, outcome)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+In-process transports: JARPC client calls manager living in the same process without serialization.
+
+Request and response objects are passed as is, so ttl, errors and manager context work the same way as with
+a remote manager. Since nothing is serialized, caller and handler share params and result objects;
+use `copy=True` to deep-copy them on the boundary if either side may mutate them.
+Call dropped by manager as expired fails with `JarpcTimeout`, as with remote transports.
+"""
+from copy import deepcopy
+from typing import Optional
+
+from .errors import JarpcTimeout
+from .format import JarpcRequest, JarpcResponse
+from .manager import AsyncJarpcManager, JarpcManager
+
+
+class LoopbackTransport:
+    """
+    Transport for `JarpcClient` calling `JarpcManager` in the same process.
+
+    Example of usage:
+    ```
+    manager = JarpcManager(dispatcher)
+    kitchen = JarpcClient(transport=LoopbackTransport(manager))
+    salad = kitchen.cook_salad(name='Caesar')
+    ```
+    """
+
+    # client doesn't have to serialize request
+    needs_request_string = False
+
+    def __init__(self, manager: JarpcManager, copy: bool = False):
+        """
+        :param manager: manager to handle requests
+        :param copy: deep-copy params and result, so caller and handler don't share mutable objects
+        """
+        self.manager = manager
+        self.copy = copy
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, **kwargs) -> Optional[JarpcResponse]:
+        response = self.manager.get_request_response(self._transfer_request(request))
+        return self._transfer_response(request, response)
+
+    def _transfer_request(self, request: JarpcRequest) -> JarpcRequest:
+        """Make request object for manager's side, validated the same way as deserialized one. """
+        data = request.data
+        attachments = request.attachments
+        if self.copy:
+            data = deepcopy(data)
+            attachments = [memoryview(bytes(attachment)) for attachment in attachments]
+        return JarpcRequest.from_data(data, attachments=attachments)
+
+    def _transfer_response(self, request: JarpcRequest,
+                           response: Optional[JarpcResponse]) -> Optional[JarpcResponse]:
+        if response is None and request.rsvp:
+            raise JarpcTimeout('Request expired before it was handled')
+        if response is None or not self.copy:
+            return response
+        return JarpcResponse(request_id=response.request_id, result=deepcopy(response.result),
+                             error=deepcopy(response.error), id=response.id,
+                             attachments=[memoryview(bytes(attachment)) for attachment in response.attachments])
+
+
+class AsyncLoopbackTransport(LoopbackTransport):
+    """
+    Transport for `AsyncJarpcClient` calling `AsyncJarpcManager` in the same process.
+
+    Example of usage:
+    ```
+    manager = AsyncJarpcManager(dispatcher)
+    kitchen = AsyncJarpcClient(transport=AsyncLoopbackTransport(manager))
+    salad = await kitchen.cook_salad(name='Caesar')
+    ```
+    """
+
+    def __init__(self, manager: AsyncJarpcManager, copy: bool = False):
+        super().__init__(manager, copy=copy)
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest,
+                       **kwargs) -> Optional[JarpcResponse]:
+        response = await self.manager.get_request_response(self._transfer_request(request))
+        return self._transfer_response(request, response)
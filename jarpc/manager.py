@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import inspect
 import logging
+import time
 from asyncio import CancelledError
 from collections import deque
-from typing import Optional, Iterable
+from typing import Dict, Optional, Iterable, Sequence, Union
 
+from .compression import AdaptiveCompressor, decompress_payload, is_compressed, registered_codecs
 from .dispatcher import JarpcDispatcher
-from .errors import JarpcServerError, JarpcError, JarpcInvalidParams
-from .format import JarpcRequest, JarpcResponse, json_loads, json_dumps
+from .errors import JarpcServerError, JarpcError, JarpcInvalidParams, JarpcParseError, JarpcTooManyRequests
+from .format import CANCEL_METHOD, JarpcRequest, JarpcResponse, JarpcAttachedResult, json_loads, json_dumps
+from .framing import is_frame, pack_frame, pack_response, unpack_frame
+from .priority import PriorityScheduler
+from .ratelimit import RateLimiter
+from .tracing import Tracer, server_context
 
 logger = logging.getLogger(__name__)
 
@@ -68,35 +75,107 @@ def check_function_call(fun, kwargs: dict, context: dict) -> (bool, Optional[str
     return True, None
 
 
+def make_result_response(request_id: str, result) -> JarpcResponse:
+    """Make successful response, moving attachments of `JarpcAttachedResult` out of JSON result. """
+    if isinstance(result, JarpcAttachedResult):
+        return JarpcResponse(request_id=request_id, result=result.result, attachments=result.attachments)
+    return JarpcResponse(request_id=request_id, result=result)
+
+
 class JarpcManager:
-    def __init__(self, dispatcher: JarpcDispatcher, context: dict = None, loads=json_loads, dumps=json_dumps):
+    def __init__(self, dispatcher: JarpcDispatcher, context: dict = None, loads=json_loads, dumps=json_dumps,
+                 compressor: Optional[AdaptiveCompressor] = None, recorder=None, tracer: Optional[Tracer] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        """
+        :param dispatcher: dispatcher of RPC methods, or other mapping of method names to methods
+        :param context: params passed to methods which have them in signature
+        :param loads: json loads
+        :param dumps: json dumps
+        :param compressor: compresses responses for clients accepting compression (see `jarpc.compression`)
+        :param recorder: records sampled requests handled by `handle` and `handle_frame`, e.g. `TrafficRecorder`
+                         (see `jarpc.capture`)
+        :param tracer: records spans of handling requests, trace context of request is restored anyway
+                       (see `jarpc.tracing`)
+        :param rate_limiter: rejects requests of callers over their rate limits (see `jarpc.ratelimit`)
+        """
         self.dispatcher = dispatcher
         self.context = context or dict()  # per-manager context cannot contain jarpc_request
         self.loads = loads
         self.dumps = dumps
+        self.compressor = compressor
+        self.recorder = recorder
+        self.tracer = tracer
+        self.rate_limiter = rate_limiter
 
-    def handle(self, request: str) -> Optional[str]:
-        """Handle request string, producing either response string or None if no response is required. """
-        jarpc_response = self.get_response(request_string=request)
-        if jarpc_response is not None:
-            return jarpc_response.serialize(dumps=self.dumps)
+    def handle(self, request: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+        """
+        Handle request string, producing either response string or None if no response is required.
+        Response with attachments is returned as binary frame (see `jarpc.framing`).
+        Compressed request is decompressed, response may be compressed (see `jarpc.compression`).
+        """
+        if is_compressed(request):
+            try:
+                request = decompress_payload(request)
+            except ValueError as e:
+                return self.serialize_response(JarpcResponse(request_id=None, error=JarpcParseError(e).as_dict()))
+            if is_frame(request):
+                return self.handle_frame(request)
+        return self._handle_message(request, request)
 
-    def get_response(self, request_string: str) -> Optional[JarpcResponse]:
+    def handle_frame(self, frame: bytes) -> Optional[bytes]:
+        """Handle binary frame (see `jarpc.framing`), producing either response frame or None. """
+        try:
+            envelope, attachments = unpack_frame(frame)
+        except ValueError as e:
+            return pack_response(JarpcResponse(request_id=None, error=JarpcParseError(e).as_dict()), dumps=self.dumps)
+        return self._handle_message(frame, envelope, attachments)
+
+    def get_response(self, request_string: str, attachments: Sequence = ()) -> Optional[JarpcResponse]:
         """Returns either JarpcResponse or None if no response is required. """
-        request_id = None
-        rsvp = True
         try:
-            request = JarpcRequest.from_json(request_string, loads=self.loads)
-            if request.expired:
-                logger.warning(f'Request arrived too late: {request}')
-                return None
+            request = JarpcRequest.from_json(request_string, loads=self.loads, attachments=attachments)
+        except Exception as e:
+            return self._make_error_response(e)
+        return self.get_request_response(request)
+
+    def handle_request(self, request: JarpcRequest, message: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+        """
+        Handle request already parsed from `message` (request string or request frame), producing response
+        as `handle` or `handle_frame` does. For callers which parse requests themselves, e.g. to order them:
+        request is not parsed again, and recorder and rate limiter see it the same way.
+        Sampled requests are recorded with `message` and serialized response, as they were received and sent.
+        """
+        frame = is_frame(message)
+        if self.recorder is None or not self.recorder.sample():
+            return self._encode_response(self.get_request_response(request), frame=frame)
+        received, started = time.time(), time.perf_counter()
+        response = self.get_request_response(request)
+        response_string = self._record(message, request, response, received, started)
+        return self._encode_response(response, response_string, frame=frame)
 
-            request_id = request.id
-            rsvp = request.rsvp
+    def _handle_message(self, message: Union[str, bytes], request_string: Union[str, bytes],
+                        attachments: Sequence = ()) -> Optional[Union[str, bytes]]:
+        """Handle request string, or envelope and attachments of request frame `message`. """
+        try:
+            request = JarpcRequest.from_json(request_string, loads=self.loads, attachments=attachments)
+        except Exception as e:
+            return self._encode_response(self._make_error_response(e), frame=is_frame(message))
+        return self.handle_request(request, message)
 
+    def get_request_response(self, request: JarpcRequest) -> Optional[JarpcResponse]:
+        """
+        Returns either JarpcResponse or None if no response is required.
+        Object-level entry point: takes already parsed request, so in-process callers skip serialization.
+        """
+        if request.expired:
+            logger.warning(f'Request arrived too late: {request}')
+            return None
+        try:
+            # rejected requests are cheap, even for methods which are not imported yet
+            self._check_rate_limit(request)
             method = self.dispatcher[request.method]
             try:
-                result = self._call_method(method, request)
+                result = self._call_traced(method, request)
             except TypeError:
                 is_call_ok, explanation = check_function_call(method, request.params, self.context)
                 if is_call_ok:
@@ -107,13 +186,75 @@ class JarpcManager:
             if request.expired:
                 logger.warning(f'Request took too long to complete: {request}')
                 return None
-            return JarpcResponse(request_id=request_id, result=result) if rsvp else None
-        except JarpcError as e:
-            logger.debug(e, exc_info=True)
-            return JarpcResponse(request_id=request_id, error=e.as_dict()) if rsvp else None
+            return self._make_result_response(request, result) if request.rsvp else None
         except Exception as e:
+            return self._make_error_response(e, request_id=request.id, rsvp=request.rsvp)
+
+    def _make_result_response(self, request: JarpcRequest, result) -> JarpcResponse:
+        response = make_result_response(request.id, result)
+        if self.compressor is not None and request.compression is not None:
+            response.compression = tuple(codec for codec in registered_codecs() if codec in request.compression)
+        return response
+
+    def serialize_response(self, jarpc_response: Optional[JarpcResponse]) -> Optional[Union[str, bytes]]:
+        """Serialize response object as `handle` does: to string, response frame or compressed payload. """
+        return self._encode_response(jarpc_response)
+
+    def _encode_response(self, jarpc_response: Optional[JarpcResponse], response_string: Optional[str] = None,
+                         frame: bool = False) -> Optional[Union[str, bytes]]:
+        """
+        :param response_string: already serialized JSON of `jarpc_response`
+        :param frame: always pack response into frame, as `handle_frame` does
+        """
+        if jarpc_response is None:
+            return None
+        if response_string is None:
+            response_string = jarpc_response.serialize(dumps=self.dumps)
+        if frame or jarpc_response.attachments:
+            # attachments can't be carried by JSON string
+            return pack_frame(response_string.encode(), jarpc_response.attachments)
+        if jarpc_response.compression:
+            return self.compressor.compress(response_string, jarpc_response.compression) or response_string
+        return response_string
+
+    @staticmethod
+    def _make_error_response(e: Exception, request_id: Optional[str] = None,
+                             rsvp: bool = True) -> Optional[JarpcResponse]:
+        """Make error response for exception `e` being handled. """
+        if isinstance(e, JarpcError):
+            logger.debug(e, exc_info=True)
+            error = e.as_dict()
+        else:
             logger.exception(e)
-            return JarpcResponse(request_id=request_id, error=JarpcServerError(e).as_dict()) if rsvp else None
+            error = JarpcServerError(e).as_dict()
+        return JarpcResponse(request_id=request_id, error=error) if rsvp else None
+
+    def _record(self, message: Union[str, bytes], request: JarpcRequest, response: Optional[JarpcResponse],
+                received: float, started: float) -> Optional[str]:
+        """
+        Record handled request, returning serialized response to be sent.
+        Failure of recorder must not change the response.
+        """
+        latency = time.perf_counter() - started
+        response_string = None if response is None else response.serialize(dumps=self.dumps)
+        try:
+            self.recorder.record(message, request, response, response_string, received, latency)
+        except Exception:
+            logger.exception(f'Failed to record request: {request}')
+        return response_string
+
+    def _check_rate_limit(self, request: JarpcRequest):
+        if self.rate_limiter is None:
+            return
+        retry_after = self.rate_limiter.check(request)
+        if retry_after:
+            raise JarpcTooManyRequests({'retry_after': round(retry_after, 3)})
+
+    def _call_traced(self, method, request: JarpcRequest):
+        if self.tracer is None and request.trace is None:
+            return self._call_method(method, request)
+        with server_context(self.tracer, request):
+            return self._call_method(method, request)
 
     def _call_method(self, method, request: JarpcRequest):
         # prepare params passed from manager context
@@ -128,28 +269,107 @@ class JarpcManager:
 
 
 class AsyncJarpcManager(JarpcManager):
-    async def handle(self, request: str) -> Optional[str]:
-        """Handle request string, producing either response string or None if no response is required. """
-        jarpc_response = await self.get_response(request_string=request)
-        if jarpc_response is not None:
-            return jarpc_response.serialize(self.dumps)
+    """
+    Async manager.
+
+    Calls in flight (including ones waiting for slot of `scheduler`) are tracked by request id, and can be cancelled
+    with `cancel` or by request of reserved method `CANCEL_METHOD` with params {"request_id": id}, e.g. sent by
+    `AsyncJarpcClient` when caller gave up on a call. Cancellation interrupts the task awaiting the call,
+    and the call gets no response.
+    """
 
-    async def get_response(self, request_string: str) -> Optional[JarpcResponse]:
+    def __init__(self, *args, scheduler: Optional[PriorityScheduler] = None, **kwargs):
+        """
+        :param scheduler: limits methods running at the same time, giving slots to requests by priority
+                          (see `jarpc.priority`)
+        Other params are the same as of `JarpcManager`.
+        """
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self._cancelled = set()
+
+    def cancel(self, request_id: str) -> bool:
+        """Cancel call in flight, returns False if there is no call with `request_id`. """
+        task = self.in_flight.get(request_id)
+        if task is None or task.done():
+            return False
+        self._cancelled.add(request_id)
+        task.cancel()
+        return True
+
+    async def handle(self, request: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+        """
+        Handle request string, producing either response string or None if no response is required.
+        Response with attachments is returned as binary frame (see `jarpc.framing`).
+        Compressed request is decompressed, response may be compressed (see `jarpc.compression`).
+        """
+        if is_compressed(request):
+            try:
+                request = decompress_payload(request)
+            except ValueError as e:
+                return self.serialize_response(JarpcResponse(request_id=None, error=JarpcParseError(e).as_dict()))
+            if is_frame(request):
+                return await self.handle_frame(request)
+        return await self._handle_message(request, request)
+
+    async def handle_frame(self, frame: bytes) -> Optional[bytes]:
+        """Handle binary frame (see `jarpc.framing`), producing either response frame or None. """
+        try:
+            envelope, attachments = unpack_frame(frame)
+        except ValueError as e:
+            return pack_response(JarpcResponse(request_id=None, error=JarpcParseError(e).as_dict()), dumps=self.dumps)
+        return await self._handle_message(frame, envelope, attachments)
+
+    async def get_response(self, request_string: str, attachments: Sequence = ()) -> Optional[JarpcResponse]:
         """Returns either JarpcResponse or None if no response is required. """
-        request_id = None
-        rsvp = True
         try:
-            request = JarpcRequest.from_json(request_string, loads=self.loads)
-            if request.expired:
-                logger.warning(f'Request arrived too late: {request}')
-                return None
+            request = JarpcRequest.from_json(request_string, loads=self.loads, attachments=attachments)
+        except Exception as e:
+            return self._make_error_response(e)
+        return await self.get_request_response(request)
 
-            request_id = request.id
-            rsvp = request.rsvp
+    async def handle_request(self, request: JarpcRequest, message: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+        """
+        Handle request already parsed from `message` (request string or request frame), producing response
+        as `handle` or `handle_frame` does, see `JarpcManager.handle_request`.
+        """
+        frame = is_frame(message)
+        if self.recorder is None or not self.recorder.sample():
+            return self._encode_response(await self.get_request_response(request), frame=frame)
+        received, started = time.time(), time.perf_counter()
+        response = await self.get_request_response(request)
+        response_string = self._record(message, request, response, received, started)
+        return self._encode_response(response, response_string, frame=frame)
 
-            method = self.dispatcher[request.method]
+    async def _handle_message(self, message: Union[str, bytes], request_string: Union[str, bytes],
+                              attachments: Sequence = ()) -> Optional[Union[str, bytes]]:
+        try:
+            request = JarpcRequest.from_json(request_string, loads=self.loads, attachments=attachments)
+        except Exception as e:
+            return self._encode_response(self._make_error_response(e), frame=is_frame(message))
+        return await self.handle_request(request, message)
+
+    async def get_request_response(self, request: JarpcRequest) -> Optional[JarpcResponse]:
+        """
+        Returns either JarpcResponse or None if no response is required.
+        Object-level entry point: takes already parsed request, so in-process callers skip serialization.
+        """
+        if request.expired:
+            logger.warning(f'Request arrived too late: {request}')
+            return None
+        if request.method == CANCEL_METHOD:
+            return self._handle_cancel(request)
+        # tracked from the start, so request waiting for scheduler can be cancelled too
+        task = asyncio.current_task()
+        self.in_flight[request.id] = task
+        try:
+            self._check_rate_limit(request)
+            # custom dispatchers and plain dicts of methods may have no `get_async`
+            get_async = getattr(self.dispatcher, 'get_async', None)
+            method = await get_async(request.method) if get_async is not None else self.dispatcher[request.method]
             try:
-                result = await self._call_method(method, request)
+                result = await self._call_scheduled(method, request)
             except TypeError:
                 is_call_ok, explanation = check_function_call(method, request.params, self.context)
                 if is_call_ok:
@@ -160,15 +380,48 @@ class AsyncJarpcManager(JarpcManager):
             if request.expired:
                 logger.warning(f'Request took too long to complete: {request}')
                 return None
-            return JarpcResponse(request_id=request_id, result=result) if rsvp else None
+            return self._make_result_response(request, result) if request.rsvp else None
         except CancelledError:
+            if request.id in self._cancelled:
+                # cancellation of the caller's task ends here
+                if hasattr(task, 'uncancel'):
+                    task.uncancel()
+                logger.debug(f'Request was cancelled by client: {request}')
+                return None
             raise
-        except JarpcError as e:
-            logger.debug(e, exc_info=True)
-            return JarpcResponse(request_id=request_id, error=e.as_dict()) if rsvp else None
         except Exception as e:
-            logger.exception(e)
-            return JarpcResponse(request_id=request_id, error=JarpcServerError(e).as_dict()) if rsvp else None
+            return self._make_error_response(e, request_id=request.id, rsvp=request.rsvp)
+        finally:
+            self._cancelled.discard(request.id)
+            if self.in_flight.get(request.id) is task:
+                del self.in_flight[request.id]
+
+    def _handle_cancel(self, request: JarpcRequest) -> Optional[JarpcResponse]:
+        try:
+            request_id = request.params['request_id']
+        except (KeyError, TypeError):
+            return self._make_error_response(JarpcInvalidParams('Missing arguments: request_id'),
+                                             request_id=request.id, rsvp=request.rsvp)
+        cancelled = self.cancel(request_id)
+        return JarpcResponse(request_id=request.id, result=cancelled) if request.rsvp else None
+
+    async def _call_scheduled(self, method, request: JarpcRequest):
+        if self.scheduler is None:
+            return await self._call_traced(method, request)
+        await self.scheduler.acquire(self.scheduler.get_lane(request, self.dispatcher))
+        try:
+            if request.expired:
+                # response is dropped anyway, see `get_request_response`
+                return None
+            return await self._call_traced(method, request)
+        finally:
+            self.scheduler.release()
+
+    async def _call_traced(self, method, request: JarpcRequest):
+        if self.tracer is None and request.trace is None:
+            return await self._call_method(method, request)
+        with server_context(self.tracer, request):
+            return await self._call_method(method, request)
 
     async def _call_method(self, method, request: JarpcRequest):
         result = super()._call_method(method, request)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Outbox for notifications: fire-and-forget calls don't wait for transport.
+
+`AsyncOutboxTransport` wraps transport of `AsyncJarpcClient`: notifications (rsvp=False) are put to bounded
+in-memory queue and the call returns at once, background task sends them by batches of up to `batch_size`
+concurrent transport calls. Calls with rsvp=True are sent as usual.
+- when queue is full, `overflow` policy is applied: drop the oldest notification, block the call until
+  there is space (not longer than request's ttl), or raise `JarpcServerError`,
+- notifications with the same `collapse_key` supersede each other: the newer one replaces the queued one,
+- notifications expired while queued are dropped,
+- `close` sends all queued notifications.
+Errors of sending notifications are logged and counted, notifications are not resent.
+
+Example of usage:
+```
+outbox = AsyncOutboxTransport(AsyncStreamTransport(path='/run/kitchen.sock'),
+                              collapse_key=lambda method, params: params.get('order_id'))
+kitchen = AsyncJarpcClient(transport=outbox, default_notification_ttl=60.0)
+await kitchen(method='order_status', params={'order_id': 1, 'status': 'cooking'}, rsvp=False)
+...
+await outbox.close()
+```
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .client import TransportWrapper
+from .errors import JarpcServerError, JarpcTimeout
+from .format import JarpcRequest
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+ERROR = 'error'
+
+
+class AsyncOutboxTransport(TransportWrapper):
+    """Transport for `AsyncJarpcClient` sending notifications in background. """
+
+    def __init__(self, transport, max_size: int = 10000, overflow: str = DROP_OLDEST, batch_size: int = 100,
+                 flush_interval: float = 0.0, collapse_key: Optional[Callable[[str, dict], Optional[str]]] = None):
+        """
+        :param transport: transport to wrap
+        :param max_size: max number of queued notifications
+        :param overflow: policy when queue is full: `DROP_OLDEST`, `BLOCK` or `ERROR`
+        :param batch_size: max number of notifications sent concurrently
+        :param flush_interval: time (seconds) to wait for more notifications before sending incomplete batch
+        :param collapse_key: makes key from method and params, queued notification with the same key is replaced
+        """
+        if overflow not in (DROP_OLDEST, BLOCK, ERROR):
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+        super().__init__(transport)
+        self.accepts_timeout = self._transport_accepts_timeout
+        self.max_size = max_size
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.collapse_key = collapse_key
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.expired = 0
+        self.collapsed = 0
+        self._queue = OrderedDict()  # key -> (request string, request, kwargs, deadline)
+        self._sending = 0
+        self._task = None
+        self._closed = False
+        self._not_empty = None
+        self._not_full = None
+        self._idle = None
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queued': len(self._queue),
+            'sending': self._sending,
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'expired': self.expired,
+            'collapsed': self.collapsed,
+        }
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, **kwargs):
+        if request.rsvp:
+            return await self.transport(request_string, request, **kwargs)
+        if self._closed:
+            raise JarpcServerError('Outbox is closed')
+        self._start()
+
+        timeout = kwargs.pop('timeout', request.remaining)
+        entry = (request_string, request, kwargs, None if timeout is None else time.monotonic() + timeout)
+        key = request.id
+        if self.collapse_key is not None:
+            collapse_key = self.collapse_key(request.method, request.params)
+            if collapse_key is not None:
+                key = (request.method, collapse_key)
+                if key in self._queue:
+                    self.collapsed += 1
+                    self._queue[key] = entry
+                    return None
+
+        if len(self._queue) >= self.max_size:
+            await self._make_space(entry[3])
+        self._queue[key] = entry
+        self._not_empty.set()
+        self._idle.clear()
+        if len(self._queue) >= self.max_size:
+            self._not_full.clear()
+        return None
+
+    async def flush(self):
+        """Wait until all queued notifications are sent. """
+        if self._task is not None:
+            await self._idle.wait()
+
+    async def close(self):
+        """Send queued notifications and stop. """
+        self._closed = True
+        if self._task is None:
+            return
+        self._not_empty.set()
+        await self._task
+
+    def _start(self):
+        if self._task is None:
+            self._not_empty = asyncio.Event()
+            self._not_full = asyncio.Event()
+            self._not_full.set()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _make_space(self, deadline: Optional[float]):
+        if self.overflow == DROP_OLDEST:
+            self._queue.popitem(last=False)
+            self.dropped += 1
+        elif self.overflow == ERROR:
+            self.dropped += 1
+            raise JarpcServerError('Outbox is full')
+        else:
+            while len(self._queue) >= self.max_size:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                try:
+                    await asyncio.wait_for(self._not_full.wait(), timeout)
+                except asyncio.TimeoutError:
+                    self.dropped += 1
+                    raise JarpcTimeout('No space in outbox') from None
+
+    async def _run(self):
+        while True:
+            await self._not_empty.wait()
+            if self.flush_interval and len(self._queue) < self.batch_size and not self._closed:
+                await asyncio.sleep(self.flush_interval)
+            batch = [self._queue.popitem(last=False)[1] for _ in range(min(self.batch_size, len(self._queue)))]
+            self._not_full.set()
+            if not self._queue:
+                self._not_empty.clear()
+            self._sending = len(batch)
+            await asyncio.gather(*(self._send(*entry) for entry in batch))
+            self._sending = 0
+            if not self._queue:
+                self._idle.set()
+                if self._closed:
+                    return
+
+    async def _send(self, request_string: Optional[str], request: JarpcRequest, kwargs: dict,
+                    deadline: Optional[float]):
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self.expired += 1
+                return
+            if self.accepts_timeout:
+                kwargs = {**kwargs, 'timeout': timeout}
+        try:
+            await self.transport(request_string, request, **kwargs)
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f'Notification {request.method} was not sent: {e!r}')
+        else:
+            self.sent += 1
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Priority lanes for `AsyncJarpcManager`: interactive calls are not starved by bulk traffic sharing the manager.
+
+`PriorityScheduler` given to manager as `scheduler` limits the number of methods running at the same time.
+Requests over the limit wait in lanes, and free slots are given to lanes by smooth weighted round-robin:
+lane with weight 8 gets 8 slots for each slot of lane with weight 1 while both have waiting requests,
+and any lane gets all slots while others are empty. Within a lane requests are served in arrival order.
+Requests expired while waiting are dropped without being handled.
+
+Lane of request is chosen by the first of:
+- "priority" field of request, if it names a lane,
+- priority of method set in dispatcher (`add_rpc_method(f, priority='low')`),
+- `notification_lane` for notifications (rsvp=False),
+- `default_lane`.
+
+Example of usage:
+```
+dispatcher.add_rpc_method(export_report, priority='low')
+manager = AsyncJarpcManager(dispatcher, scheduler=PriorityScheduler(concurrency=50))
+...
+salad = await kitchen(method='cook_salad', params={'name': 'Caesar'}, priority='high')
+```
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Sequence, Tuple
+
+from .dispatcher import JarpcDispatcher
+from .format import JarpcRequest
+
+DEFAULT_LANES = (('high', 8), ('normal', 4), ('low', 1))
+
+
+class _Lane:
+    __slots__ = ('name', 'weight', 'waiters', 'current_weight', 'admitted', 'wait_time', 'max_wait_time')
+
+    def __init__(self, name: str, weight: int):
+        self.name = name
+        self.weight = weight
+        self.waiters = deque()  # (future, time queued)
+        self.current_weight = 0
+        self.admitted = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for future, _ in self.waiters if not future.done())
+
+    def admit(self, wait_time: float):
+        self.admitted += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+class PriorityScheduler:
+    def __init__(self, concurrency: int = 100, lanes: Sequence[Tuple[str, int]] = DEFAULT_LANES,
+                 default_lane: str = 'normal', notification_lane: str = 'low'):
+        """
+        :param concurrency: max number of methods running at the same time
+        :param lanes: pairs of lane name and weight
+        :param default_lane: lane of requests without priority
+        :param notification_lane: lane of notifications without priority
+        """
+        self.concurrency = concurrency
+        self.lanes = OrderedDict((name, _Lane(name, weight)) for name, weight in lanes)
+        for lane in (default_lane, notification_lane):
+            if lane not in self.lanes:
+                raise ValueError(f'Unknown lane: {lane}')
+        self.default_lane = default_lane
+        self.notification_lane = notification_lane
+        self.active = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'lanes': {
+                name: {
+                    'weight': lane.weight,
+                    'depth': lane.depth,
+                    'admitted': lane.admitted,
+                    'mean_wait_time': lane.wait_time / lane.admitted if lane.admitted else 0.0,
+                    'max_wait_time': lane.max_wait_time,
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+    def get_lane(self, request: JarpcRequest, dispatcher: Optional[JarpcDispatcher] = None) -> str:
+        if request.priority in self.lanes:
+            return request.priority
+        get_priority = getattr(dispatcher, 'get_priority', None)
+        priority = get_priority(request.method) if get_priority is not None else None
+        if priority in self.lanes:
+            return priority
+        return self.default_lane if request.rsvp else self.notification_lane
+
+    async def acquire(self, lane: str):
+        """Wait for free slot in `lane`. """
+        lane = self.lanes[lane]
+        # free slots are given to waiting requests right away, so there are none waiting while slots are free
+        if self.active < self.concurrency:
+            self.active += 1
+            lane.admit(0.0)
+            return
+        future = asyncio.get_event_loop().create_future()
+        lane.waiters.append((future, time.perf_counter()))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # slot was given right before cancellation
+                self.release()
+            raise
+
+    def release(self):
+        """Free slot taken by `acquire`. """
+        self.active -= 1
+        while self.active < self.concurrency:
+            lane = self._pick_lane()
+            if lane is None:
+                return
+            future, queued = lane.waiters.popleft()
+            if future.done():
+                continue
+            self.active += 1
+            lane.admit(time.perf_counter() - queued)
+            future.set_result(None)
+
+    def _pick_lane(self) -> Optional[_Lane]:
+        """Choose lane of next waiting request by smooth weighted round-robin. """
+        total = 0
+        best = None
+        for lane in self.lanes.values():
+            while lane.waiters and lane.waiters[0][0].done():
+                lane.waiters.popleft()
+            if not lane.waiters:
+                continue
+            lane.current_weight += lane.weight
+            total += lane.weight
+            if best is None or lane.current_weight > best.current_weight:
+                best = lane
+        if best is not None:
+            best.current_weight -= total
+        return best
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side per-caller rate limiting: one misbehaving caller cannot monopolize the manager.
+
+`RateLimiter` given to `JarpcManager`/`AsyncJarpcManager` as `rate_limiter` keeps token buckets per caller,
+and optionally per caller and method for methods given in `method_limits`. Caller of request is told by `key`
+function, e.g. from request fields or from context variable set by transport's middleware; requests with key None
+are not limited. Call is allowed if all its buckets have a token, otherwise it gets `JarpcTooManyRequests` error
+with "retry_after" hint in its data, before its method is looked up, queued or called.
+
+Bucket refilled to its burst is the same as no bucket, so buckets idle for that long are evicted:
+memory is proportional to the number of callers active within the last `burst / rate` seconds.
+
+Example of usage:
+```
+caller = ContextVar('caller')  # set by middleware from authenticated token
+limiter = RateLimiter(key=lambda request: caller.get(None), rate=50, burst=100,
+                      method_limits={'export_report': (0.1, 2)})
+manager = AsyncJarpcManager(dispatcher, rate_limiter=limiter)
+```
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from .format import JarpcRequest
+
+
+class _Bucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def get_wait_time(self) -> float:
+        """Seconds until bucket has a token. """
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Thread-safe token bucket rate limiter of callers. """
+
+    def __init__(self, key: Callable[[JarpcRequest], Optional[Hashable]], rate: Optional[float] = None,
+                 burst: Optional[float] = None,
+                 method_limits: Optional[Dict[str, Tuple[float, Optional[float]]]] = None):
+        """
+        :param key: returns caller of request, None to not limit request
+        :param rate: calls per second allowed to each caller, None to limit only methods from `method_limits`
+        :param burst: calls allowed to each caller at once, `rate` (but at least 1) if not given
+        :param method_limits: method name -> (rate, burst) of calls of method allowed to each caller,
+                              burst None is `rate` (but at least 1)
+        :raises ValueError: rate is not positive (or is None in `method_limits`) or burst is less than 1
+        """
+        for limit_rate, limit_burst in [(rate, burst), *(method_limits or {}).values()]:
+            if limit_rate is not None and limit_rate <= 0:
+                raise ValueError(f'Rate must be positive, got {limit_rate}')
+            if limit_burst is not None and limit_burst < 1:
+                raise ValueError(f'Burst must be at least 1, got {limit_burst}')
+        for method, (limit_rate, _) in (method_limits or {}).items():
+            if limit_rate is None:
+                raise ValueError(f'Rate of method {method} must be given')
+        self.key = key
+        self.rate = rate
+        self.burst = self._get_burst(rate, burst)
+        self.method_limits = {
+            method: (limit_rate, self._get_burst(limit_rate, limit_burst))
+            for method, (limit_rate, limit_burst) in (method_limits or {}).items()
+        }
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets: Dict[Tuple[Hashable, Optional[str]], _Bucket] = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_burst(rate: Optional[float], burst: Optional[float]) -> Optional[float]:
+        return max(rate, 1) if burst is None and rate is not None else burst
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'buckets': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+    def check(self, request: JarpcRequest) -> float:
+        """Take token for request, returns 0 if it is allowed, otherwise seconds until it would be. """
+        caller = self.key(request)
+        if caller is None:
+            return 0.0
+        return self.acquire(caller, request.method)
+
+    def acquire(self, caller: Hashable, method: str) -> float:
+        """Take token for call of `method` by `caller`, returns 0 if it is allowed, otherwise seconds until it is. """
+        limits = []
+        if self.rate is not None:
+            limits.append((None, self.rate, self.burst))
+        if method in self.method_limits:
+            limits.append((method, *self.method_limits[method]))
+        if not limits:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            buckets = [self._get_bucket((caller, name), rate, burst, now) for name, rate, burst in limits]
+            wait_time = max(bucket.get_wait_time() for bucket in buckets)
+            if wait_time > 0:
+                self.rejected += 1
+                return wait_time
+            for bucket in buckets:
+                bucket.tokens -= 1
+            self.allowed += 1
+            return 0.0
+
+    def _get_bucket(self, key: Tuple[Hashable, Optional[str]], rate: float, burst: float, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(rate, burst, now)
+        else:
+            bucket.refill(now)
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now: float):
+        """Drop least recently used buckets which are full by now. """
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if not bucket.is_full(now):
+                return
+            del self._buckets[key]
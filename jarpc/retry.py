@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Retries and hedged requests for idempotent methods.
+
+`RetryTransport` and `AsyncRetryTransport` wrap client transport:
+- attempt failed with transport error, `JarpcServerError` or `JarpcExternalServiceUnavailable` is retried
+  with exponential backoff, while request's ttl (or call timeout) leaves time for it,
+- if response is not received in `hedge_delay` seconds (or observed `hedge_percentile` of latency),
+  duplicate attempt is sent; the first successful response is taken, other attempts are cancelled.
+All attempts of a call send the same request with the same id.
+Retries and hedges are limited with `RetryBudget`, so they don't multiply load on a failing server.
+
+Only calls of `idempotent_methods` or calls with `idempotent=True` kwarg are retried, notifications never are.
+
+Example of usage:
+```
+transport = AsyncRetryTransport(AsyncStreamTransport(path='/run/kitchen.sock'),
+                                idempotent_methods={'get_menu'}, hedge_percentile=0.95)
+kitchen = AsyncJarpcClient(transport=transport, default_rpc_ttl=2.0)
+menu = await kitchen.get_menu()
+salad = await kitchen(method='cook_salad', params={'name': 'Caesar'}, idempotent=True)
+```
+"""
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Iterable, Optional
+
+from .client import TransportWrapper, load_response
+from .errors import JarpcError, JarpcExternalServiceUnavailable, JarpcServerError, JarpcTimeout
+from .format import JarpcRequest, JarpcResponse, json_loads
+
+RETRYABLE_ERRORS = (JarpcServerError, JarpcExternalServiceUnavailable)
+RETRYABLE_ERROR_CODES = frozenset(error.code for error in RETRYABLE_ERRORS)
+
+
+class RetryBudget:
+    """
+    Thread-safe limit of retries relative to calls.
+
+    Retry is allowed while retries made in last `ttl` seconds don't exceed `ratio` of calls made in the same time
+    plus `min_retries_per_second` (so rarely called methods still can be retried).
+    """
+
+    def __init__(self, ratio: float = 0.1, min_retries_per_second: float = 10.0, ttl: float = 10.0):
+        """
+        :param ratio: allowed share of retries
+        :param min_retries_per_second: retries allowed regardless of calls
+        :param ttl: time window (seconds)
+        """
+        self.ratio = ratio
+        self.min_retries_per_second = min_retries_per_second
+        self.ttl = ttl
+        self._buckets = deque()  # [second, calls, retries]
+        self._calls = 0
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Count call. """
+        with self._lock:
+            self._bucket()[1] += 1
+            self._calls += 1
+
+    def withdraw(self) -> bool:
+        """Count retry if it is allowed, returns if it is. """
+        with self._lock:
+            bucket = self._bucket()
+            if self._retries >= self.min_retries_per_second * self.ttl + self.ratio * self._calls:
+                return False
+            bucket[2] += 1
+            self._retries += 1
+            return True
+
+    def _bucket(self) -> list:
+        second = int(time.monotonic())
+        while self._buckets and self._buckets[0][0] <= second - self.ttl:
+            _, calls, retries = self._buckets.popleft()
+            self._calls -= calls
+            self._retries -= retries
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        return self._buckets[-1]
+
+
+class LatencyWindow:
+    """Latencies of last `size` successful calls. """
+
+    def __init__(self, size: int = 1000):
+        self._latencies = deque(maxlen=size)
+        self._sorted = None
+        self._added = 0  # since latencies were sorted
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def add(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._added += 1
+            # sort latencies again when a tenth of window is replaced
+            if self._added * 10 >= len(self._latencies):
+                self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency `q`-quantile (e.g. 0.95), None if no latencies are known. """
+        with self._lock:
+            if not self._latencies:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._latencies)
+                self._added = 0
+            return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+
+class _RetryTransportBase(TransportWrapper):
+
+    # timeout is applied to all attempts together, so client's timeout is always needed
+    accepts_timeout = True
+
+    def __init__(self, transport, idempotent_methods: Iterable[str] = (), max_attempts: int = 3,
+                 hedge_delay: Optional[float] = None, hedge_percentile: Optional[float] = None,
+                 min_hedge_samples: int = 20, backoff: float = 0.05, max_backoff: float = 1.0,
+                 budget: Optional[RetryBudget] = None, loads: Callable[[str], Any] = json_loads):
+        """
+        :param transport: transport to wrap
+        :param idempotent_methods: methods which are safe to call more than once
+        :param max_attempts: max number of attempts of a call, including hedged ones
+        :param hedge_delay: time (seconds) to wait for response before sending hedged attempt
+        :param hedge_percentile: if `hedge_delay` is not set, hedge after this quantile of observed latency, e.g. 0.95
+        :param min_hedge_samples: min number of observed latencies for `hedge_percentile`
+        :param backoff: delay (seconds) before the first retry, doubled for each next one, with full jitter
+        :param max_backoff: max delay (seconds) before retry
+        :param budget: retry budget, may be shared between transports
+        :param loads: json loads
+        """
+        super().__init__(transport, loads=loads)
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.max_attempts = max_attempts
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_samples = min_hedge_samples
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = RetryBudget() if budget is None else budget
+        self.latencies = LatencyWindow()
+
+    @property
+    def hedging(self) -> bool:
+        return self.hedge_delay is not None or self.hedge_percentile is not None
+
+    @property
+    def forwards_cancel(self) -> bool:
+        # hedged attempts share request id, so cancellation would reach only one of them
+        return self._forwards_cancel and not self.hedging
+
+    @forwards_cancel.setter
+    def forwards_cancel(self, value: bool):
+        self._forwards_cancel = value
+
+    def _get_hedge_delay(self) -> Optional[float]:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if self.hedge_percentile is not None and len(self.latencies) >= self.min_hedge_samples:
+            return self.latencies.percentile(self.hedge_percentile)
+        return None
+
+    def _get_backoff(self, attempts: int) -> float:
+        return random.uniform(0, min(self.backoff * 2 ** (attempts - 1), self.max_backoff))
+
+    def _is_retried(self, request: JarpcRequest, kwargs: dict) -> bool:
+        idempotent = kwargs.pop('idempotent', request.method in self.idempotent_methods)
+        return request.rsvp and idempotent
+
+    @staticmethod
+    def _is_retryable(outcome) -> bool:
+        """Check if attempt's outcome (response or exception) is worth retrying. """
+        if isinstance(outcome, JarpcResponse):
+            return not outcome.success and outcome.error.get('code') in RETRYABLE_ERROR_CODES
+        return isinstance(outcome, RETRYABLE_ERRORS) or not isinstance(outcome, JarpcError)
+
+    def _schedule_retry(self, next_attempt_at: Optional[float], attempts: int,
+                        deadline: Optional[float]) -> Optional[float]:
+        if attempts >= self.max_attempts:
+            return next_attempt_at
+        retry_at = time.monotonic() + self._get_backoff(attempts)
+        if deadline is not None and retry_at >= deadline:
+            return next_attempt_at
+        return retry_at if next_attempt_at is None else min(next_attempt_at, retry_at)
+
+    @staticmethod
+    def _get_wait_timeout(next_attempt_at: Optional[float], deadline: Optional[float]) -> Optional[float]:
+        now = time.monotonic()
+        timeouts = [moment - now for moment in (next_attempt_at, deadline) if moment is not None]
+        return max(min(timeouts), 0) if timeouts else None
+
+    def _handle_outcome(self, outcome, started: float):
+        """Return or raise final outcome, returns None if outcome is retryable. """
+        if self._is_retryable(outcome):
+            return None
+        if isinstance(outcome, JarpcResponse):
+            if outcome.success:
+                self.latencies.add(time.monotonic() - started)
+            return outcome
+        raise outcome
+
+    @staticmethod
+    def _finish(last_outcome):
+        if isinstance(last_outcome, JarpcResponse):
+            return last_outcome
+        raise last_outcome
+
+
+class RetryTransport(_RetryTransportBase):
+    """
+    Transport for `JarpcClient` retrying and hedging calls of idempotent methods.
+
+    Hedged attempts are sent from threads of own executor, so wrapped transport must be thread-safe.
+    """
+
+    def __init__(self, transport, *args, hedge_workers: int = 32, **kwargs):
+        """
+        :param hedge_workers: max number of threads sending hedged attempts
+        """
+        super().__init__(transport, *args, **kwargs)
+        self.hedge_workers = hedge_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                 **kwargs):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._is_retried(request, kwargs):
+            return self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+
+        self.budget.deposit()
+        hedge_delay = self._get_hedge_delay()
+        pending = {}  # future -> attempt start time
+        attempts = 0
+        last_outcome = None
+        next_attempt_at = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if next_attempt_at is not None and now >= next_attempt_at:
+                    next_attempt_at = None
+                    if attempts == 0 or self.budget.withdraw():
+                        attempts += 1
+                        pending[self._start_attempt(request_string, request, kwargs, deadline)] = now
+                        if hedge_delay is not None and attempts < self.max_attempts:
+                            next_attempt_at = now + hedge_delay
+                if not pending and next_attempt_at is None:
+                    return self._finish(last_outcome)
+                if deadline is not None and now >= deadline:
+                    raise JarpcTimeout('No successful attempt in time')
+
+                wait_timeout = self._get_wait_timeout(next_attempt_at, deadline)
+                if not pending:
+                    time.sleep(wait_timeout)
+                    continue
+                done, _ = concurrent.futures.wait(pending, timeout=wait_timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    started = pending.pop(future)
+                    outcome = future.exception() or future.result()
+                    result = self._handle_outcome(outcome, started)
+                    if result is not None:
+                        return result
+                    last_outcome = outcome
+                    next_attempt_at = self._schedule_retry(next_attempt_at, attempts, deadline)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """Shut down hedging threads. """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _attempt(self, request_string: Optional[str], request: JarpcRequest, kwargs: dict,
+                 deadline: Optional[float]) -> JarpcResponse:
+        response = self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+        return load_response(response, loads=self.loads)
+
+    def _start_attempt(self, request_string: Optional[str], request: JarpcRequest, kwargs: dict,
+                       deadline: Optional[float]) -> concurrent.futures.Future:
+        if not self.hedging:
+            # attempts don't overlap, so they are made in caller's thread
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(self._attempt(request_string, request, kwargs, deadline))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.hedge_workers,
+                                                                       thread_name_prefix='jarpc-hedge')
+            return self._executor.submit(self._attempt, request_string, request, kwargs, deadline)
+
+
+class AsyncRetryTransport(_RetryTransportBase):
+    """Transport for `AsyncJarpcClient` retrying and hedging calls of idempotent methods. """
+
+    async def __call__(self, request_string: Optional[str], request: JarpcRequest, timeout: Optional[float] = None,
+                       **kwargs):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._is_retried(request, kwargs):
+            return await self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+
+        self.budget.deposit()
+        hedge_delay = self._get_hedge_delay()
+        pending = {}  # task -> attempt start time
+        attempts = 0
+        last_outcome = None
+        next_attempt_at = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if next_attempt_at is not None and now >= next_attempt_at:
+                    next_attempt_at = None
+                    if attempts == 0 or self.budget.withdraw():
+                        attempts += 1
+                        task = asyncio.ensure_future(self._attempt(request_string, request, kwargs, deadline))
+                        pending[task] = now
+                        if hedge_delay is not None and attempts < self.max_attempts:
+                            next_attempt_at = now + hedge_delay
+                if not pending and next_attempt_at is None:
+                    return self._finish(last_outcome)
+                if deadline is not None and now >= deadline:
+                    raise JarpcTimeout('No successful attempt in time')
+
+                wait_timeout = self._get_wait_timeout(next_attempt_at, deadline)
+                if not pending:
+                    await asyncio.sleep(wait_timeout)
+                    continue
+                done, _ = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    started = pending.pop(task)
+                    outcome = task.exception() or task.result()
+                    result = self._handle_outcome(outcome, started)
+                    if result is not None:
+                        return result
+                    last_outcome = outcome
+                    next_attempt_at = self._schedule_retry(next_attempt_at, attempts, deadline)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, request_string: Optional[str], request: JarpcRequest, kwargs: dict,
+                       deadline: Optional[float]) -> JarpcResponse:
+        response = await self.transport(request_string, request, **self._make_call_kwargs(kwargs, deadline))
+        return load_response(response, loads=self.loads)
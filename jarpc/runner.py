@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-fork multi-process runner for `JarpcStreamServer`.
+
+Master process imports the application (dispatcher and modules of its methods) once and forks workers from it,
+workers don't import it again. Objects of master are frozen for garbage collector (`gc.freeze`) before workers
+are forked, so collections in workers don't write to their memory pages, which stay shared. Every worker listens
+on the same address with SO_REUSEPORT, letting the kernel balance connections, and runs its own event loop, server
+and manager.
+
+Master signals:
+- SIGTERM, SIGINT: graceful shutdown, workers stop accepting and drain requests being handled,
+- SIGHUP: graceful restart, new workers are forked before old ones drain (code is not reimported).
+
+Example of usage:
+```
+dispatcher = JarpcDispatcher()  # with all RPC methods imported
+runner = PreforkRunner(lambda: AsyncJarpcManager(dispatcher), host='0.0.0.0', port=8765, workers=4)
+runner.run()
+```
+"""
+import asyncio
+import gc
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+from .manager import AsyncJarpcManager
+from .stream import JarpcStreamServer
+
+logger = logging.getLogger(__name__)
+
+
+class PreforkRunner:
+    def __init__(self, manager_factory: Callable[[], AsyncJarpcManager], host: str = '127.0.0.1', port: int = 0,
+                 workers: Optional[int] = None, drain_timeout: float = 30.0, stats_interval: float = 1.0,
+                 backlog: int = 1024, server_class=JarpcStreamServer, **server_kwargs):
+        """
+        :param manager_factory: makes manager in each worker
+        :param host: host to listen
+        :param port: port to listen, if 0 - free port is chosen before workers are started
+        :param workers: number of worker processes, CPU count by default
+        :param drain_timeout: time (seconds) given to worker to finish requests being handled before it is killed
+        :param stats_interval: how often (seconds) workers report their stats
+        :param backlog: listen backlog of each worker
+        :param server_class: server class, `JarpcStreamServer` or its subclass
+        :param server_kwargs: passed to `server_class`
+        """
+        self.manager_factory = manager_factory
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.drain_timeout = drain_timeout
+        self.stats_interval = stats_interval
+        self.backlog = backlog
+        self.server_class = server_class
+        self.server_kwargs = server_kwargs
+
+        self._family = socket.AF_INET
+        self._placeholder = None
+        self._selector = None
+        self._workers: Dict[int, dict] = {}  # pid -> worker state
+        self._handled_by_exited = 0
+        self._stop_requested = False
+        self._restart_requested = False
+
+    def stats(self) -> dict:
+        """Stats aggregated from workers. """
+        workers = {pid: worker['stats'] for pid, worker in self._workers.items()}
+        return {
+            'workers': len(workers),
+            'connections': sum(stats.get('connections', 0) for stats in workers.values()),
+            'in_flight': sum(stats.get('in_flight', 0) for stats in workers.values()),
+            'handled': self._handled_by_exited + sum(stats.get('handled', 0) for stats in workers.values()),
+            'per_worker': workers,
+        }
+
+    def stop(self):
+        """Request graceful shutdown. """
+        self._stop_requested = True
+
+    def restart(self):
+        """Request graceful restart of workers. """
+        self._restart_requested = True
+
+    def bind(self):
+        """Resolve listening address, choosing free port if `port` is 0. """
+        if self._placeholder is not None:
+            return
+        self._family = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0][0]
+        # bound but not listening socket holds the port in SO_REUSEPORT group, it never gets connections
+        self._placeholder = self._make_socket()
+        self.port = self._placeholder.getsockname()[1]
+
+    def run(self):
+        """Start workers and supervise them until shutdown. """
+        self.bind()
+        self._selector = selectors.DefaultSelector()
+        previous_handlers = {
+            signal.SIGTERM: signal.signal(signal.SIGTERM, lambda *args: self.stop()),
+            signal.SIGINT: signal.signal(signal.SIGINT, lambda *args: self.stop()),
+            signal.SIGHUP: signal.signal(signal.SIGHUP, lambda *args: self.restart()),
+        }
+        logger.info(f'Starting {self.workers} workers on {self.host}:{self.port}')
+        # imported application is never collected, and pages with its objects are not copied on collection
+        gc.freeze()
+        try:
+            for _ in range(self.workers):
+                self._spawn_worker()
+            stopping = False
+            while self._workers:
+                self._read_stats(timeout=min(self.stats_interval, 0.2))
+                self._reap_workers(respawn=not stopping)
+                if self._stop_requested and not stopping:
+                    stopping = True
+                    self._retire_workers(list(self._workers))
+                if self._restart_requested and not stopping:
+                    self._restart_requested = False
+                    self._restart_workers()
+                self._kill_stuck_workers()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            self._selector.close()
+            self._placeholder.close()
+            self._placeholder = None
+        logger.info('Stopped')
+
+    def _make_socket(self) -> socket.socket:
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _spawn_worker(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._run_worker(write_fd)
+        os.close(write_fd)
+        os.set_blocking(read_fd, False)
+        self._workers[pid] = {'fd': read_fd, 'buffer': b'', 'stats': {}, 'kill_at': None}
+        self._selector.register(read_fd, selectors.EVENT_READ, pid)
+        logger.info(f'Worker {pid} started')
+
+    def _run_worker(self, stats_fd: int):
+        """Worker process main, never returns. """
+        exit_code = 0
+        try:
+            for signum in (signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            # terminal sends SIGINT to whole process group, workers are stopped by master
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self._selector.close()
+            for worker in self._workers.values():
+                os.close(worker['fd'])
+            self._placeholder.close()
+
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self._serve(stats_fd))
+        except BaseException:
+            logger.exception('Worker failed')
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    async def _serve(self, stats_fd: int):
+        server = self.server_class(self.manager_factory(), **self.server_kwargs)
+        sock = self._make_socket()
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        await server.start(sock=sock)
+
+        stop = asyncio.Event()
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        while not stop.is_set():
+            self._report_stats(stats_fd, server)
+            try:
+                await asyncio.wait_for(stop.wait(), self.stats_interval)
+            except asyncio.TimeoutError:
+                pass
+        await server.close(timeout=self.drain_timeout)
+        self._report_stats(stats_fd, server)
+
+    @staticmethod
+    def _report_stats(stats_fd: int, server: JarpcStreamServer):
+        # line is shorter than PIPE_BUF, so it is written atomically
+        os.write(stats_fd, json.dumps(server.stats).encode() + b'\n')
+
+    def _read_stats(self, timeout: float):
+        for key, _ in self._selector.select(timeout=timeout):
+            self._read_worker_stats(key.data)
+
+    def _read_worker_stats(self, pid: int):
+        worker = self._workers[pid]
+        try:
+            data = os.read(worker['fd'], 65536)
+        except BlockingIOError:
+            return
+        *lines, worker['buffer'] = (worker['buffer'] + data).split(b'\n')
+        if lines:
+            worker['stats'] = json.loads(lines[-1])
+
+    def _reap_workers(self, respawn: bool):
+        # only workers are waited for, other children of the process are left to their owners
+        for pid in list(self._workers):
+            try:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                # already reaped elsewhere, exit status is lost
+                reaped, status = pid, None
+            if reaped == 0:
+                continue
+            worker = self._workers.pop(pid)
+            self._selector.unregister(worker['fd'])
+            self._read_final_stats(worker)
+            os.close(worker['fd'])
+            self._handled_by_exited += worker['stats'].get('handled', 0)
+
+            if status is not None and hasattr(os, 'waitstatus_to_exitcode'):
+                exit_code = os.waitstatus_to_exitcode(status)
+            else:
+                exit_code = status
+            if worker['kill_at'] is None:
+                logger.warning(f'Worker {pid} exited unexpectedly with code {exit_code}')
+                if respawn:
+                    self._spawn_worker()
+            else:
+                logger.info(f'Worker {pid} stopped with code {exit_code}')
+
+    @staticmethod
+    def _read_final_stats(worker: dict):
+        data = worker['buffer']
+        while True:
+            try:
+                chunk = os.read(worker['fd'], 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        lines = [line for line in data.split(b'\n') if line]
+        if lines:
+            worker['stats'] = json.loads(lines[-1])
+
+    def _retire_workers(self, pids):
+        kill_at = time.monotonic() + self.drain_timeout + 5.0
+        for pid in pids:
+            self._workers[pid]['kill_at'] = kill_at
+            os.kill(pid, signal.SIGTERM)
+
+    def _restart_workers(self):
+        logger.info('Restarting workers')
+        old = [pid for pid, worker in self._workers.items() if worker['kill_at'] is None]
+        for _ in range(self.workers):
+            self._spawn_worker()
+        self._retire_workers(old)
+
+    def _kill_stuck_workers(self):
+        now = time.monotonic()
+        for pid, worker in self._workers.items():
+            if worker['kill_at'] is not None and worker['kill_at'] < now:
+                logger.warning(f'Worker {pid} did not drain in time, killing')
+                os.kill(pid, signal.SIGKILL)
+                worker['kill_at'] = float('inf')
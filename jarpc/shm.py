@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory payload handoff for stream transport between processes on the same host.
+
+Payloads larger than threshold are written to `multiprocessing.shared_memory` segment by the sender,
+and only a handle is sent over the socket:
+```
+b'JSHM' | payload size: uint64 | segment name: ascii
+```
+Segment starts with in-use flag (one byte, padded to 8), followed by payload. Segments are pooled by the sender:
+it sets the flag when it writes payload, the receiver clears it when it is done with payload, and the sender
+reuses the segment for the next payload of the same size class. So there is no `shm_open`/`mmap`/`unlink` per
+message, only a copy into the segment and the reads of the receiver:
+- server gives request frame to manager as `memoryview` of the segment, so attachments are not copied;
+  they are valid only while the request is handled, method keeping them must copy them,
+- other payloads (JSON, compressed) are copied out, as `loads` and decompression need bytes,
+- client copies response out and clears the flag at once.
+
+Segments are unlinked by the sender on close, or when their flag is not cleared in `claim_timeout` seconds
+(receiver died or lost the handle). Segments of a crashed sender are unlinked by its `multiprocessing` resource
+tracker. Receiver keeps up to `max_attached` segments mapped. If the receiver can't attach to the segment
+(it was already unlinked), the call fails with `JarpcServerError`.
+
+Requires Python 3.8+ (`multiprocessing.shared_memory`), the rest of the package works without this module.
+
+Example of usage:
+```
+server = ShmStreamServer(AsyncJarpcManager(dispatcher))
+await server.start_unix('/run/kitchen.sock')
+
+kitchen = AsyncJarpcClient(transport=AsyncShmStreamTransport(path='/run/kitchen.sock'))
+salad = await kitchen.cook_salad(name='Caesar')
+```
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from .framing import is_frame
+from .stream import AsyncStreamTransport, JarpcStreamServer, StreamTransport
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8
+    resource_tracker = shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+SHM_MAGIC = b'JSHM'
+DEFAULT_THRESHOLD = 128 * 1024
+DEFAULT_CLAIM_TIMEOUT = 60.0
+DEFAULT_POOL_SIZE = 8
+DEFAULT_MAX_ATTACHED = 64
+
+_handle = struct.Struct('>4sQ')
+_PAYLOAD_OFFSET = 8
+_FREE = 0
+_IN_USE = 1
+
+# segments created by this process, attaching to them must not affect their resource tracking
+_own_segments = set()
+
+
+def _attach(name: str) -> 'shared_memory.SharedMemory':
+    """Attach to existing segment without registering it in resource tracker: segment is owned by the sender. """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers attached segment
+        segment = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix' and name not in _own_segments:
+            # tracker knows POSIX segments by name with leading slash
+            resource_tracker.unregister(f'/{segment.name}', 'shared_memory')
+        return segment
+
+
+class SharedMemoryPayloads:
+    """
+    Moves payloads larger than threshold to shared memory segments pooled by the sender,
+    and reads payloads moved by the other side.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, max_attached: int = DEFAULT_MAX_ATTACHED):
+        """
+        :param threshold: min payload size (bytes) sent through shared memory
+        :param claim_timeout: time (seconds) receiver has to release payload before its segment is unlinked
+        :param pool_size: max number of free segments kept for reuse per size class
+        :param max_attached: max number of segments of the other side kept mapped
+        :raises RuntimeError: `multiprocessing.shared_memory` is not available
+        """
+        if shared_memory is None:
+            raise RuntimeError('Shared memory payloads require Python 3.8 or newer')
+        self.threshold = threshold
+        self.claim_timeout = claim_timeout
+        self.pool_size = pool_size
+        self.max_attached = max_attached
+        self.created = 0
+        self.reused = 0
+        self._free: Dict[int, List[shared_memory.SharedMemory]] = {}  # capacity -> free segments
+        # name -> (segment, capacity, claim deadline), oldest first
+        self._busy: Dict[str, Tuple[shared_memory.SharedMemory, int, float]] = OrderedDict()
+        self._attached: Dict[str, shared_memory.SharedMemory] = OrderedDict()  # least recently used first
+        self._retired = []  # attached segments evicted while their payload was still used
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'busy': len(self._busy),
+            'free': sum(len(segments) for segments in self._free.values()),
+            'attached': len(self._attached),
+        }
+
+    def encode(self, payload_parts: list) -> list:
+        """Replace payload with shared memory handle if it is large enough. """
+        size = sum(memoryview(part).nbytes for part in payload_parts)
+        if size < self.threshold:
+            return payload_parts
+
+        segment = self._acquire(size)
+        offset = _PAYLOAD_OFFSET
+        for part in payload_parts:
+            part = memoryview(part).cast('B')
+            segment.buf[offset:offset + part.nbytes] = part
+            offset += part.nbytes
+        return [_handle.pack(SHM_MAGIC, size), segment.name.encode()]
+
+    def decode(self, payload: bytes, borrow: bool = False) -> Union[bytes, memoryview]:
+        """
+        Restore payload from shared memory handle.
+        Payload is copied out and its segment is released, unless `borrow` is set: then frame is returned as
+        `memoryview` of the segment, and `release` must be called with the same handle once payload is not used.
+
+        :raises FileNotFoundError: segment is already unlinked
+        """
+        handle = self._parse_handle(payload)
+        if handle is None:
+            return payload
+        name, size = handle
+        segment = self._get_attached(name)
+        view = segment.buf[_PAYLOAD_OFFSET:_PAYLOAD_OFFSET + size]
+        if borrow and is_frame(view):
+            return view
+        try:
+            return bytes(view)
+        finally:
+            view.release()
+            if not borrow:
+                segment.buf[0] = _FREE
+
+    def release(self, payload: bytes):
+        """Let the sender reuse segment of received payload, no-op for payload not moved to shared memory. """
+        handle = self._parse_handle(payload)
+        if handle is None:
+            return
+        try:
+            segment = self._get_attached(handle[0])
+        except FileNotFoundError:
+            return
+        segment.buf[0] = _FREE
+
+    def sweep(self):
+        """Return released segments to the pool, unlink segments which were not released in time. """
+        with self._lock:
+            expired = self._collect()
+        for segment in expired:
+            self._unlink(segment)
+
+    def close(self):
+        """Unlink own segments and detach from segments of the other side. """
+        with self._lock:
+            own = [segment for segment, _, _ in self._busy.values()]
+            own += [segment for segments in self._free.values() for segment in segments]
+            attached = list(self._attached.values()) + self._retired
+            self._busy.clear()
+            self._free.clear()
+            self._attached.clear()
+            self._retired = []
+        for segment in own:
+            self._unlink(segment)
+        for segment in attached:
+            self._detach(segment)
+
+    def _acquire(self, size: int) -> 'shared_memory.SharedMemory':
+        """Take free segment fitting `size` bytes from the pool or create one, marking it as in use. """
+        # power of two size classes: segments are reused by payloads of similar size
+        capacity = max(self.threshold, 1 << (size - 1).bit_length())
+        with self._lock:
+            expired = self._collect()
+            free = self._free.get(capacity)
+            segment = free.pop() if free else None
+        for expired_segment in expired:
+            self._unlink(expired_segment)
+        if segment is None:
+            segment = shared_memory.SharedMemory(create=True, size=_PAYLOAD_OFFSET + capacity)
+            _own_segments.add(segment.name)
+            self.created += 1
+        else:
+            self.reused += 1
+        segment.buf[0] = _IN_USE
+        with self._lock:
+            self._busy[segment.name] = (segment, capacity, time.monotonic() + self.claim_timeout)
+        return segment
+
+    def _collect(self) -> list:
+        """Move released segments to the pool, returns segments to unlink (lock must be held). """
+        now = time.monotonic()
+        to_unlink = []
+        for name, (segment, capacity, deadline) in list(self._busy.items()):
+            if segment.buf[0] == _FREE:
+                del self._busy[name]
+                free = self._free.setdefault(capacity, [])
+                if len(free) < self.pool_size:
+                    free.append(segment)
+                else:
+                    to_unlink.append(segment)
+            elif deadline <= now:
+                # receiver may still read it, so it is not reused
+                del self._busy[name]
+                to_unlink.append(segment)
+        return to_unlink
+
+    def _get_attached(self, name: str) -> 'shared_memory.SharedMemory':
+        with self._lock:
+            segment = self._attached.get(name)
+            if segment is not None:
+                self._attached.move_to_end(name)
+                return segment
+        segment = _attach(name)
+        with self._lock:
+            self._attached[name] = segment
+            evicted = []
+            while len(self._attached) > self.max_attached:
+                evicted.append(self._attached.popitem(last=False)[1])
+            retired, self._retired = self._retired, []
+        for evicted_segment in retired + evicted:
+            if not self._detach(evicted_segment):
+                with self._lock:
+                    self._retired.append(evicted_segment)
+        return segment
+
+    @staticmethod
+    def _parse_handle(payload) -> Optional[Tuple[str, int]]:
+        if bytes(payload[:len(SHM_MAGIC)]) != SHM_MAGIC:
+            return None
+        _, size = _handle.unpack_from(payload)
+        return bytes(payload[_handle.size:]).decode(), size
+
+    @staticmethod
+    def _detach(segment: 'shared_memory.SharedMemory') -> bool:
+        """Unmap segment of the other side, returns False if its payload is still used. """
+        try:
+            segment.close()
+        except BufferError:
+            return False
+        return True
+
+    @staticmethod
+    def _unlink(segment: 'shared_memory.SharedMemory'):
+        _own_segments.discard(segment.name)
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShmStreamServer(JarpcStreamServer):
+    """`JarpcStreamServer` receiving and sending large payloads through shared memory. """
+
+    def __init__(self, *args, threshold: int = DEFAULT_THRESHOLD, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, max_attached: int = DEFAULT_MAX_ATTACHED, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shm_payloads = SharedMemoryPayloads(threshold=threshold, claim_timeout=claim_timeout,
+                                                 pool_size=pool_size, max_attached=max_attached)
+
+    async def close(self, timeout=None):
+        await super().close(timeout=timeout)
+        self.shm_payloads.close()
+
+    def _encode_payload(self, correlation_id, payload_parts):
+        return self.shm_payloads.encode(payload_parts)
+
+    def _decode_payload(self, payload):
+        # request segment is released once its response is sent
+        return self.shm_payloads.decode(payload, borrow=True)
+
+    def _release_payload(self, payload):
+        self.shm_payloads.release(payload)
+
+
+class AsyncShmStreamTransport(AsyncStreamTransport):
+    """`AsyncStreamTransport` sending and receiving large payloads through shared memory. """
+
+    def __init__(self, *args, threshold: int = DEFAULT_THRESHOLD, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, max_attached: int = DEFAULT_MAX_ATTACHED, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shm_payloads = SharedMemoryPayloads(threshold=threshold, claim_timeout=claim_timeout,
+                                                 pool_size=pool_size, max_attached=max_attached)
+
+    async def close(self):
+        await super().close()
+        self.shm_payloads.close()
+
+    def _encode_payload(self, correlation_id, payload_parts):
+        return self.shm_payloads.encode(payload_parts)
+
+    def _decode_payload(self, payload):
+        return self.shm_payloads.decode(payload)
+
+    def _release_payload(self, payload):
+        self.shm_payloads.release(payload)
+
+
+class ShmStreamTransport(StreamTransport):
+    """`StreamTransport` sending and receiving large payloads through shared memory. """
+
+    def __init__(self, *args, threshold: int = DEFAULT_THRESHOLD, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, max_attached: int = DEFAULT_MAX_ATTACHED, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shm_payloads = SharedMemoryPayloads(threshold=threshold, claim_timeout=claim_timeout,
+                                                 pool_size=pool_size, max_attached=max_attached)
+
+    def close(self):
+        super().close()
+        self.shm_payloads.close()
+
+    def _encode_payload(self, correlation_id, payload_parts):
+        return self.shm_payloads.encode(payload_parts)
+
+    def _decode_payload(self, payload):
+        return self.shm_payloads.decode(payload)
+
+    def _release_payload(self, payload):
+        self.shm_payloads.release(payload)
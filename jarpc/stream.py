@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio stream transport: length-prefixed messages over persistent TCP or Unix socket connections.
+
+Message layout (all integers are big-endian):
+```
+payload length: uint32 | correlation id length: uint16 | correlation id: utf-8 | payload
+```
+Correlation id is JARPC request id, up to 65535 bytes. Payload is JSON request/response or binary frame
+(see `jarpc.framing`).
+Payloads are passed to manager and client as bytes, so custom `loads` must accept bytes (as `json.loads` does).
+
+Requests are pipelined: server handles requests of a connection concurrently and writes responses as soon as
+they are ready, `AsyncStreamTransport` matches responses with waiting calls by correlation id.
+`StreamTransport` is a blocking transport for `JarpcClient`, sending calls one by one.
+
+Example of usage:
+```
+server = JarpcStreamServer(AsyncJarpcManager(dispatcher))
+await server.start(host='127.0.0.1', port=8765)
+
+kitchen = AsyncJarpcClient(transport=AsyncStreamTransport(host='127.0.0.1', port=8765))
+salad = await kitchen.cook_salad(name='Caesar')
+```
+"""
+import asyncio
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple, Union
+
+from .errors import JarpcServerError, JarpcTimeout
+from .format import JarpcRequest, JarpcResponse
+from .framing import frame_parts, is_frame
+from .manager import AsyncJarpcManager, JarpcManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+_header = struct.Struct('>IH')
+
+MAX_CORRELATION_ID_SIZE = 0xffff
+
+
+def message_parts(correlation_id: str, payload_parts: List) -> list:
+    """
+    Make message as a list of buffers for `StreamWriter.writelines`.
+
+    :raises ValueError: correlation id is longer than `MAX_CORRELATION_ID_SIZE` bytes
+    """
+    correlation_id = correlation_id.encode()
+    if len(correlation_id) > MAX_CORRELATION_ID_SIZE:
+        raise ValueError(f'Correlation id is too long: {len(correlation_id)} bytes')
+    payload_length = sum(memoryview(part).nbytes for part in payload_parts)
+    return [_header.pack(payload_length, len(correlation_id)), correlation_id, *payload_parts]
+
+
+async def read_message(reader: asyncio.StreamReader,
+                       max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE) -> Tuple[str, bytes]:
+    """
+    Read message from stream, returns correlation id and payload.
+
+    :raises asyncio.IncompleteReadError: connection closed
+    :raises ValueError: payload exceeds `max_message_size`
+    """
+    payload_length, id_length = _header.unpack(await reader.readexactly(_header.size))
+    if payload_length > max_message_size:
+        raise ValueError(f'Message is too large: {payload_length} bytes')
+    correlation_id = (await reader.readexactly(id_length)).decode()
+    payload = await reader.readexactly(payload_length)
+    return correlation_id, payload
+
+
+def request_payload_parts(request_string: Union[str, bytes], request: JarpcRequest) -> list:
+    """Make request payload: request string or binary frame if request has attachments. """
+    if isinstance(request_string, str):
+        request_string = request_string.encode()
+    if request.attachments:
+        return frame_parts(request_string, request.attachments)
+    return [request_string]
+
+
+class JarpcStreamServer:
+    """
+    Asyncio stream server for `AsyncJarpcManager`.
+    `JarpcManager` is supported too, its requests are handled in default executor.
+    """
+
+    def __init__(self, manager: Union[AsyncJarpcManager, JarpcManager], max_concurrency: int = 100,
+                 max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        """
+        :param manager: manager to handle requests
+        :param max_concurrency: max number of requests handled concurrently per connection,
+                                connection is not read while limit is reached
+        :param max_message_size: connection sending larger message is closed
+        """
+        self.manager = manager
+        self.max_concurrency = max_concurrency
+        self.max_message_size = max_message_size
+        self._servers = []
+        self._connections = set()
+        self._tasks = set()
+        self._closing = False
+        self.handled = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests being handled. """
+        return len(self._tasks)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'connections': len(self._connections),
+            'in_flight': self.in_flight,
+            'handled': self.handled,
+        }
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None, **kwargs) -> asyncio.AbstractServer:
+        """Start listening TCP socket, `kwargs` are passed to `asyncio.start_server`. """
+        server = await asyncio.start_server(self._handle_connection, host, port, **kwargs)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path: Optional[str] = None, **kwargs) -> asyncio.AbstractServer:
+        """Start listening Unix socket, `kwargs` are passed to `asyncio.start_unix_server`. """
+        server = await asyncio.start_unix_server(self._handle_connection, path, **kwargs)
+        self._servers.append(server)
+        return server
+
+    async def close(self, timeout: Optional[float] = None):
+        """Stop accepting connections and requests, wait for requests being handled and close connections. """
+        self._closing = True
+        for server in self._servers:
+            server.close()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # connections still add tasks for messages read before closing
+        while self._tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+        for writer in list(self._connections):
+            writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        def task_done(task):
+            tasks.discard(task)
+            self._tasks.discard(task)
+            semaphore.release()
+
+        try:
+            while not self._closing:
+                await semaphore.acquire()
+                try:
+                    correlation_id, payload = await read_message(reader, self.max_message_size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                # message already read while closing is answered too, the next ones are not read
+                task = asyncio.ensure_future(self._handle_message(correlation_id, payload, writer, write_lock))
+                tasks.add(task)
+                self._tasks.add(task)
+                task.add_done_callback(task_done)
+        except ValueError as e:
+            logger.warning(f'Closing connection: {e}')
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_message(self, correlation_id: str, payload: bytes, writer: asyncio.StreamWriter,
+                              write_lock: asyncio.Lock):
+        try:
+            decoded = self._decode_payload(payload)
+        except Exception as e:
+            logger.warning(f'Request {correlation_id} payload is not available: {e}')
+            response = self._make_error_response(correlation_id, e)
+        else:
+            try:
+                handle = self.manager.handle_frame if is_frame(decoded) else self.manager.handle
+                if isinstance(self.manager, AsyncJarpcManager):
+                    response = await handle(decoded)
+                else:
+                    response = await asyncio.get_event_loop().run_in_executor(None, handle, decoded)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # manager turns method errors into error responses, this is a bug of manager or its hooks,
+                # still the caller gets a response instead of waiting until timeout
+                logger.exception(f'Request {correlation_id} failed: {e!r}')
+                response = self._make_error_response(correlation_id, e)
+            finally:
+                # response is serialized already, it doesn't refer to request payload
+                self._release_payload(payload)
+        self.handled += 1
+        if response is None:
+            return
+        if isinstance(response, str):
+            response = response.encode()
+        try:
+            async with write_lock:
+                writer.writelines(message_parts(correlation_id, self._encode_payload(correlation_id, [response])))
+                await writer.drain()
+        except ConnectionError as e:
+            logger.debug(f'Response to {correlation_id} is not sent: {e}')
+
+    def _make_error_response(self, correlation_id: str, e: Exception) -> str:
+        response = JarpcResponse(request_id=correlation_id, error=JarpcServerError(e).as_dict())
+        return response.serialize(dumps=self.manager.dumps)
+
+    def _encode_payload(self, correlation_id: str, payload_parts: list) -> list:
+        """Hook to change payload representation before it is sent. """
+        return payload_parts
+
+    def _decode_payload(self, payload: bytes) -> bytes:
+        """Hook to restore payload changed by `_encode_payload`. """
+        return payload
+
+    def _release_payload(self, payload: bytes):
+        """Hook called with received payload once request is handled. """
+
+
+class AsyncStreamTransport:
+    """
+    Multiplexing `AsyncJarpcClient` transport for `JarpcStreamServer`.
+
+    All calls share one persistent connection, which is opened on first call and reopened after it is lost.
+    Call waits for response at most `timeout` seconds, or until request expires if `timeout` is not given.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None,
+                 max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE, **kwargs):
+        """
+        :param host: server host
+        :param port: server port
+        :param path: server Unix socket path, used instead of host and port
+        :param max_message_size: connection is closed if server sends larger message
+        :param kwargs: passed to `asyncio.open_connection`/`asyncio.open_unix_connection`
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_message_size = max_message_size
+        self._connection_kwargs = kwargs
+        self._writer = None
+        self._reader_task = None
+        self._pending: Dict[str, deque] = {}
+        self._connect_lock = None
+        self._write_lock = None
+
+    async def __call__(self, request_string: Union[str, bytes], request: JarpcRequest,
+                       timeout: Optional[float] = None):
+        writer = await self._get_writer()
+        payload_parts = self._encode_payload(request.id, request_payload_parts(request_string, request))
+        parts = message_parts(request.id, payload_parts)
+
+        future = None
+        if request.rsvp:
+            future = asyncio.get_event_loop().create_future()
+            self._pending.setdefault(request.id, deque()).append(future)
+        try:
+            async with self._write_lock:
+                writer.writelines(parts)
+                await writer.drain()
+            if future is None:
+                return None
+            timeout = request.remaining if timeout is None else timeout
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise JarpcTimeout(f'No response in {timeout:.3f}s')
+        finally:
+            if future is not None:
+                self._discard_pending(request.id, future)
+
+    async def close(self):
+        """Close connection, failing calls waiting for response. """
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await asyncio.wait([self._reader_task])
+
+    def _encode_payload(self, correlation_id: str, payload_parts: list) -> list:
+        """Hook to change payload representation before it is sent. """
+        return payload_parts
+
+    def _decode_payload(self, payload: bytes) -> bytes:
+        """Hook to restore payload changed by `_encode_payload`. """
+        return payload
+
+    def _release_payload(self, payload: bytes):
+        """Hook called with received payload which is not decoded, as nobody awaits it. """
+
+    async def _get_writer(self) -> asyncio.StreamWriter:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+            self._write_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None:
+                if self.path is not None:
+                    reader, writer = await asyncio.open_unix_connection(self.path, **self._connection_kwargs)
+                else:
+                    reader, writer = await asyncio.open_connection(self.host, self.port, **self._connection_kwargs)
+                self._writer = writer
+                self._reader_task = asyncio.ensure_future(self._read_responses(reader, writer))
+            return self._writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        error = None
+        try:
+            while True:
+                correlation_id, payload = await read_message(reader, self.max_message_size)
+                futures = self._pending.get(correlation_id)
+                if not futures:
+                    logger.debug(f'Response to {correlation_id} is not awaited')
+                    self._release_payload(payload)
+                    continue
+                future = futures.popleft()
+                if not futures:
+                    del self._pending[correlation_id]
+                if future.done():
+                    self._release_payload(payload)
+                    continue
+                try:
+                    future.set_result(self._decode_payload(payload))
+                except Exception as e:
+                    future.set_exception(JarpcServerError(e))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            error = e
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(JarpcServerError(f'Connection lost: {error}'))
+
+    def _discard_pending(self, request_id: str, future: asyncio.Future):
+        futures = self._pending.get(request_id)
+        if futures and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self._pending[request_id]
+
+
+class StreamTransport:
+    """
+    Blocking `JarpcClient` transport for `JarpcStreamServer`.
+
+    Thread-safe: calls are sent one by one over one persistent connection,
+    which is opened on first call and reopened after it is lost or call is timed out.
+    Call waits for response at most `timeout` seconds, or until request expires if `timeout` is not given.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None,
+                 max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE, connect_timeout: Optional[float] = None):
+        """
+        :param host: server host
+        :param port: server port
+        :param path: server Unix socket path, used instead of host and port
+        :param max_message_size: connection is closed if server sends larger message
+        :param connect_timeout: connection timeout
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_message_size = max_message_size
+        self.connect_timeout = connect_timeout
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def __call__(self, request_string: Union[str, bytes], request: JarpcRequest, timeout: Optional[float] = None):
+        timeout = request.remaining if timeout is None else timeout
+        if timeout is not None and timeout <= 0:
+            raise JarpcTimeout('Request is expired')
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            payload_parts = self._encode_payload(request.id, request_payload_parts(request_string, request))
+            # invalid message fails the call, not the connection
+            parts = message_parts(request.id, payload_parts)
+            try:
+                sock = self._get_socket()
+                sock.settimeout(timeout)
+                for part in parts:
+                    sock.sendall(part)
+                if not request.rsvp:
+                    return None
+                while True:
+                    if deadline is not None:
+                        sock.settimeout(max(deadline - time.monotonic(), 1e-3))
+                    correlation_id, payload = self._read_message(sock)
+                    if correlation_id == request.id:
+                        return self._decode_payload(payload)
+                    logger.debug(f'Response to {correlation_id} is not awaited')
+                    self._release_payload(payload)
+            except socket.timeout:
+                # connection may be left in the middle of a message
+                self._disconnect()
+                raise JarpcTimeout(f'No response in {timeout:.3f}s')
+            except (OSError, EOFError, ValueError) as e:
+                self._disconnect()
+                raise JarpcServerError(f'Connection lost: {e}')
+
+    def close(self):
+        """Close connection. """
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _get_socket(self) -> socket.socket:
+        if self._socket is None:
+            if self.path is not None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.connect_timeout)
+                try:
+                    sock.connect(self.path)
+                except OSError:
+                    sock.close()
+                    raise
+            else:
+                sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket = sock
+        return self._socket
+
+    def _read_message(self, sock: socket.socket) -> Tuple[str, bytes]:
+        payload_length, id_length = _header.unpack(self._read_exactly(sock, _header.size))
+        if payload_length > self.max_message_size:
+            raise ValueError(f'Message is too large: {payload_length} bytes')
+        correlation_id = self._read_exactly(sock, id_length).decode()
+        return correlation_id, self._read_exactly(sock, payload_length)
+
+    @staticmethod
+    def _read_exactly(sock: socket.socket, size: int) -> bytearray:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = sock.recv_into(view[received:])
+            if not count:
+                raise EOFError('Connection closed')
+            received += count
+        return buffer
+
+    def _encode_payload(self, correlation_id: str, payload_parts: list) -> list:
+        """Hook to change payload representation before it is sent. """
+        return payload_parts
+
+    def _decode_payload(self, payload: bytes) -> bytes:
+        """Hook to restore payload changed by `_encode_payload`. """
+        return payload
+
+    def _release_payload(self, payload: bytes):
+        """Hook called with received payload which is not decoded, as nobody awaits it. """
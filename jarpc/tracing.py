@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Distributed trace context propagation: correlate client calls with server-side handling that caused them.
+
+Trace context of the current span is kept in a context variable. Client puts it into "trace" field of request
+(`"<trace id>-<span id>-<sampled flag>"`, 32 and 16 hex digits), and manager restores it while the method is called,
+so calls made by the method continue the same trace. It works without tracers too: only spans are not recorded.
+
+`Tracer` given to `JarpcClient`/`AsyncJarpcClient` and `JarpcManager`/`AsyncJarpcManager` as `tracer` records spans
+of calls ("client" spans) and of their handling ("server" spans), and exports finished spans to exporter:
+any object with `export(span)` method, e.g. `InMemoryExporter` or `JsonLinesExporter`.
+
+Sampling decision is made once, at the root of the trace (by the first tracer without incoming trace context),
+and travels with the trace context. Unsampled calls only pass the context on (`UNSAMPLED`, the same for all
+unsampled traces): no spans, ids or timings are made.
+
+Example of usage:
+```
+tracer = Tracer(JsonLinesExporter('/var/log/kitchen/spans.jsonl'), sample_rate=0.01)
+manager = AsyncJarpcManager(dispatcher, tracer=tracer)
+pantry = AsyncJarpcClient(transport, tracer=tracer)  # calls from methods of dispatcher continue their traces
+
+with tracer.span('restock'):  # spans of code other than calls
+    await pantry.restock(item='tomato')
+```
+"""
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from .errors import JarpcError
+from .format import JarpcRequest
+
+_current: ContextVar = ContextVar('jarpc_trace_context', default=None)
+
+
+class TraceContext:
+    """Identifiers of span and sampling decision of its trace. """
+
+    __slots__ = ('trace_id', 'span_id', 'sampled', 'header')
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.header = f'{trace_id}-{span_id}-{1 if sampled else 0}'
+
+    def __repr__(self):
+        return f'<TraceContext {self.header}>'
+
+    @classmethod
+    def from_header(cls, header: str) -> Optional['TraceContext']:
+        """Parse "trace" field of request, None if it is malformed. """
+        parts = header.split('-')
+        if len(parts) != 3 or len(parts[0]) != 32 or len(parts[1]) != 16 or parts[2] not in ('0', '1'):
+            return None
+        return cls(parts[0], parts[1], parts[2] == '1')
+
+
+# context of all unsampled traces: it carries only the sampling decision, so no ids are generated for it
+UNSAMPLED = TraceContext('0' * 32, '0' * 16, False)
+
+
+def get_trace_context() -> Optional[TraceContext]:
+    """Get trace context of the current span, None outside of traces. """
+    return _current.get()
+
+
+@contextmanager
+def use_trace_context(context: Optional[TraceContext]):
+    """Make `context` current within the block. """
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+class Span:
+    """Timed operation of a trace. """
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'error', 'attributes',
+                 '_started')
+
+    def __init__(self, name: str, kind: str, trace_id: str, span_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[dict] = None):
+        """
+        :param name: operation name, method for calls
+        :param kind: "client", "server" or "internal"
+        :param trace_id: id of trace
+        :param span_id: id of span
+        :param parent_id: id of parent span, None for root span
+        :param attributes: extra data of span
+        """
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def __repr__(self):
+        return f'<Span {self.kind} {self.name}, trace {self.trace_id}, span {self.span_id}, ' \
+               f'parent {self.parent_id}, duration {self.duration}>'
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+def _describe_error(e: BaseException) -> str:
+    if isinstance(e, JarpcError):
+        return f'{e.code} {e.message}'
+    return e.__class__.__name__
+
+
+class InMemoryExporter:
+    """Exporter keeping last `max_spans` finished spans in memory, e.g. for tests. """
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def get_spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        return [span for span in self.spans if trace_id is None or span.trace_id == trace_id]
+
+    def clear(self):
+        self.spans.clear()
+
+
+class JsonLinesExporter:
+    """Exporter appending finished spans to file as JSON lines. Writes are buffered, see `flush`. """
+
+    def __init__(self, path: str, service: Optional[str] = None, dumps=json.dumps):
+        """
+        :param path: file path
+        :param service: service name added to each span
+        :param dumps: json dumps
+        """
+        self.path = path
+        self.service = service
+        self.dumps = dumps
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def export(self, span: Span):
+        data = span.as_dict()
+        if self.service is not None:
+            data['service'] = self.service
+        line = self.dumps(data) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Tracer:
+    """Recorder of spans of sampled traces. """
+
+    def __init__(self, exporter, sample_rate: float = 1.0):
+        """
+        :param exporter: gets finished spans by `export(span)`
+        :param sample_rate: share of traces started by this tracer to sample, from 0 to 1
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._random = random.Random()
+
+    def _start(self, name: str, kind: str, parent: Optional[TraceContext],
+               attributes: Optional[dict] = None) -> (Optional[Span], TraceContext):
+        """Start span under `parent` or new trace, returns None instead of span if trace is not sampled. """
+        if parent is None:
+            if self.sample_rate < 1 and self._random.random() >= self.sample_rate:
+                return None, UNSAMPLED
+            trace_id = f'{self._random.getrandbits(128):032x}'
+            parent_id = None
+        elif not parent.sampled:
+            return None, parent
+        else:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        span = Span(name, kind, trace_id, f'{self._random.getrandbits(64):016x}', parent_id, attributes)
+        return span, TraceContext(trace_id, span.span_id, True)
+
+    def _finish(self, span: Span, error: Optional[BaseException] = None):
+        span.duration = time.perf_counter() - span._started
+        if error is not None:
+            span.error = _describe_error(error)
+        self.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record span of the block, as child of the current span or as root of new trace. """
+        span, context = self._start(name, 'internal', _current.get(), attributes)
+        token = _current.set(context)
+        try:
+            yield span
+        except BaseException as e:
+            if span is not None:
+                self._finish(span, e)
+                span = None
+            raise
+        finally:
+            _current.reset(token)
+            if span is not None:
+                self._finish(span)
+
+    @contextmanager
+    def client_span(self, request: JarpcRequest):
+        """Record span of call, passing its trace context with request. """
+        span, context = self._start(request.method, 'client', _current.get(), {'request_id': request.id})
+        request.trace = context.header
+        if span is None:
+            yield None
+            return
+        try:
+            yield span
+        except BaseException as e:
+            self._finish(span, e)
+            raise
+        self._finish(span)
+
+    @contextmanager
+    def server_span(self, request: JarpcRequest):
+        """Record span of handling request, making its trace context current. """
+        parent = TraceContext.from_header(request.trace) if request.trace is not None else None
+        span, context = self._start(request.method, 'server', parent, {'request_id': request.id})
+        token = _current.set(context)
+        try:
+            yield span
+        except BaseException as e:
+            if span is not None:
+                self._finish(span, e)
+                span = None
+            raise
+        finally:
+            _current.reset(token)
+            if span is not None:
+                self._finish(span)
+
+
+@contextmanager
+def server_context(tracer: Optional[Tracer], request: JarpcRequest):
+    """Restore trace context of request within the block, recording span of handling with `tracer` if it is given. """
+    if tracer is not None:
+        with tracer.server_span(request) as span:
+            yield span
+        return
+    with use_trace_context(TraceContext.from_header(request.trace)):
+        yield None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI and WSGI applications for JARPC managers.
+
+Request body is passed to manager as bytes, so custom `loads` must accept bytes (as `json.loads` does).
+Binary frames (see `jarpc.framing`) and compressed payloads (see `jarpc.compression`) are supported in both directions.
+Notifications (rsvp=False) and dropped expired requests get empty "204 No Content" response.
+Request of ASGI client which disconnected before sending the whole body is not handled.
+
+Example of usage:
+```
+app = JarpcAsgiApp(AsyncJarpcManager(dispatcher))  # uvicorn module:app
+app = JarpcWsgiApp(JarpcManager(dispatcher))  # gunicorn module:app
+```
+"""
+from typing import Iterable, Optional, Union
+
+from .compression import is_compressed
+from .framing import is_frame
+from .manager import AsyncJarpcManager, JarpcManager
+
+DEFAULT_MAX_BODY_SIZE = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+FRAME_CONTENT_TYPE = 'application/octet-stream'
+
+
+class _ClientDisconnected(Exception):
+    pass
+
+
+def iter_chunks(body: bytes, chunk_size: int) -> Iterable[bytes]:
+    for offset in range(0, len(body), chunk_size):
+        yield body[offset:offset + chunk_size]
+
+
+class _JarpcWebApp:
+    def __init__(self, manager: Union[JarpcManager, AsyncJarpcManager], max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param manager: manager to handle requests
+        :param max_body_size: larger requests are rejected with "413 Payload Too Large"
+        :param chunk_size: response body is yielded to WSGI server by chunks of this size
+        """
+        self.manager = manager
+        self.max_body_size = max_body_size
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _make_body(response: Optional[Union[str, bytes]]) -> (Optional[bytes], str):
+        if response is None:
+            return None, ''
+        if isinstance(response, str):
+            return response.encode(), JSON_CONTENT_TYPE
+        binary = is_frame(response) or is_compressed(response)
+        return response, FRAME_CONTENT_TYPE if binary else JSON_CONTENT_TYPE
+
+
+class JarpcWsgiApp(_JarpcWebApp):
+    """WSGI application for `JarpcManager`. """
+
+    def __call__(self, environ: dict, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response('405 Method Not Allowed', [('Allow', 'POST'), ('Content-Length', '0')])
+            return []
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            length = -1
+        if length > self.max_body_size:
+            start_response('413 Payload Too Large', [('Content-Length', '0')])
+            return []
+        stream = environ['wsgi.input']
+        body = stream.read(length) if length >= 0 else stream.read(self.max_body_size + 1)
+        if len(body) > self.max_body_size:
+            start_response('413 Payload Too Large', [('Content-Length', '0')])
+            return []
+
+        response = self.manager.handle_frame(body) if is_frame(body) else self.manager.handle(body)
+        body, content_type = self._make_body(response)
+        if body is None:
+            start_response('204 No Content', [])
+            return []
+        start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        if len(body) <= self.chunk_size:
+            return [body]
+        return iter_chunks(body, self.chunk_size)
+
+
+class JarpcAsgiApp(_JarpcWebApp):
+    """ASGI application for `AsyncJarpcManager`. """
+
+    async def __call__(self, scope: dict, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported scope type: {scope["type"]}')
+
+        if scope['method'] != 'POST':
+            await self._send_empty(send, 405, [(b'allow', b'POST')])
+            return
+
+        try:
+            body = await self._read_body(scope, receive)
+        except _ClientDisconnected:
+            return
+        if body is None:
+            await self._send_empty(send, 413)
+            return
+
+        response = await (self.manager.handle_frame(body) if is_frame(body) else self.manager.handle(body))
+        body, content_type = self._make_body(response)
+        if body is None:
+            await self._send_empty(send, 204)
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+        })
+        # body is already in memory, chunks would only add sends
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _read_body(self, scope: dict, receive) -> Optional[bytes]:
+        """
+        Read request body, returns None if body is too large.
+
+        :raises _ClientDisconnected: client disconnected before sending the whole body
+        """
+        for name, value in scope.get('headers', ()):
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_body_size:
+                return None
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise _ClientDisconnected
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_size:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    @staticmethod
+    async def _send_empty(send, status: int, headers: list = ()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def _handle_lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
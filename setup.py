@@ -21,9 +21,16 @@ setup(
     description='JSON Advanced RPC',
     packages=['jarpc'],
     long_description=read('README.md'),
+    python_requires='>=3.7',
     classifiers=[
         'Development Status :: 3 - Alpha',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
+        'Programming Language :: Python :: 3.13',
         'Topic :: Utilities',
     ],
 )
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+
+from ..jarpc import AffinityTransport, AsyncAffinityTransport, AsyncJarpcClient, HashRing, JarpcClient
+
+
+class Replica:
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.keys = []
+
+    def __call__(self, request_string, request):
+        self.keys.append(request.params.get('key'))
+        return json.dumps({'result': self.name, 'request_id': request.id, 'id': '1'})
+
+
+class AsyncReplica(Replica):
+    async def __call__(self, request_string, request):
+        await asyncio.sleep(self.delay)
+        return super().__call__(request_string, request)
+
+
+def by_key(method, params):
+    return params.get('key')
+
+
+class TestHashRing:
+
+    def test_stable(self):
+        ring = HashRing(['a', 'b', 'c'])
+        other_ring = HashRing(['c', 'a', 'b'])
+        for i in range(100):
+            assert list(ring.iter_nodes(str(i))) == list(other_ring.iter_nodes(str(i)))
+        assert sorted(ring.iter_nodes('key')) == ['a', 'b', 'c']
+        assert len(ring) == 3
+
+    def test_remap(self):
+        ring = HashRing([f'node{i}' for i in range(10)])
+        before = {i: next(ring.iter_nodes(str(i))) for i in range(1000)}
+        ring.add('node10')
+        after = {i: next(ring.iter_nodes(str(i))) for i in range(1000)}
+        moved = [i for i in before if before[i] != after[i]]
+        assert all(after[i] == 'node10' for i in moved)
+        assert len(moved) < 200
+
+        ring.remove('node10')
+        assert before == {i: next(ring.iter_nodes(str(i))) for i in range(1000)}
+
+    def test_empty(self):
+        assert list(HashRing().iter_nodes('key')) == []
+
+
+class TestAffinityTransport:
+
+    def test_affinity(self):
+        replicas = {name: Replica(name) for name in ('a', 'b', 'c')}
+        client = JarpcClient(AffinityTransport(replicas, key_func=by_key))
+        routes = {key: client.get(key=key) for key in range(100)}
+        assert {key: client.get(key=key) for key in range(100)} == routes
+        assert set(routes.values()) == {'a', 'b', 'c'}
+
+    def test_default_key(self):
+        replicas = {name: Replica(name) for name in ('a', 'b', 'c')}
+        client = JarpcClient(AffinityTransport(replicas))
+        assert client.get(a=1, b=2) == client(method='get', params={'b': 2, 'a': 1})
+
+    def test_add_and_remove(self):
+        replicas = {name: Replica(name) for name in ('a', 'b', 'c')}
+        transport = AffinityTransport(replicas, key_func=by_key)
+        client = JarpcClient(transport)
+        routes = {key: client.get(key=key) for key in range(100)}
+
+        transport.add_transport('d', Replica('d'))
+        new_routes = {key: client.get(key=key) for key in range(100)}
+        assert all(new_routes[key] in (routes[key], 'd') for key in routes)
+
+        transport.remove_transport('d')
+        assert {key: client.get(key=key) for key in range(100)} == routes
+        assert 'd' not in transport.in_flight
+
+    def test_no_key(self):
+        replicas = {name: Replica(name) for name in ('a', 'b')}
+        client = JarpcClient(AffinityTransport(replicas, key_func=lambda method, params: None))
+        assert client.get() in ('a', 'b')
+
+    @pytest.mark.parametrize('load_factor', [1, 0.5, 0])
+    def test_invalid_load_factor(self, load_factor):
+        with pytest.raises(ValueError):
+            AffinityTransport({'a': Replica('a')}, load_factor=load_factor)
+
+    def test_over_capacity(self):
+        replicas = {name: Replica(name) for name in ('a', 'b')}
+        transport = AffinityTransport(replicas, key_func=by_key)
+        transport.load_factor = 0.1
+        transport.in_flight.update(a=5, b=3)
+        # no replica is under capacity, call goes to the least loaded one
+        assert JarpcClient(transport).get(key='hot') == 'b'
+
+    @pytest.mark.asyncio
+    async def test_bounded_load(self):
+        replicas = {name: AsyncReplica(name, delay=0.02) for name in ('a', 'b', 'c', 'd')}
+        transport = AsyncAffinityTransport(replicas, key_func=by_key, load_factor=1.25)
+        client = AsyncJarpcClient(transport)
+        # all calls have the same key, but no replica gets more than 1.25 of average load
+        results = await asyncio.gather(*(client.get(key='hot') for _ in range(40)))
+        counts = {name: results.count(name) for name in replicas}
+        assert max(counts.values()) <= 13
+        assert all(count == 0 for count in transport.in_flight.values())
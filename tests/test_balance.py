@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+import pytest
+
+from ..jarpc import AsyncBalancingTransport, AsyncJarpcClient, BalancingTransport, JarpcClient, JarpcServerError
+
+
+class Replica:
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.broken = False
+        self.calls = 0
+
+    def respond(self, request):
+        self.calls += 1
+        if self.broken:
+            raise ConnectionRefusedError
+        return json.dumps({'result': self.name, 'request_id': request.id, 'id': '1'})
+
+    def __call__(self, request_string, request, timeout=None):
+        time.sleep(self.delay)
+        return self.respond(request)
+
+
+class AsyncReplica(Replica):
+    async def __call__(self, request_string, request, timeout=None):
+        await asyncio.sleep(self.delay)
+        return self.respond(request)
+
+
+class TestBalancingTransport:
+
+    def test_latency(self):
+        slow, fast = Replica('slow', delay=0.03), Replica('fast')
+        client = JarpcClient(BalancingTransport([slow, fast]))
+        for _ in range(20):
+            client.get()
+        assert fast.calls >= 18
+
+    @pytest.mark.asyncio
+    async def test_in_flight(self):
+        replicas = [AsyncReplica(str(i), delay=0.02) for i in range(4)]
+        transport = AsyncBalancingTransport(replicas)
+        client = AsyncJarpcClient(transport)
+        await asyncio.gather(*(client.get() for _ in range(40)))
+        assert all(replica.calls >= 4 for replica in replicas)
+        assert all(stats['in_flight'] == 0 for stats in transport.stats)
+
+    def test_ejection(self):
+        broken, healthy = Replica('broken'), Replica('healthy', delay=0.02)
+        broken.broken = True
+        transport = BalancingTransport([broken, healthy], failure_threshold=2, ejection_duration=0.3,
+                                       initial_latency=0.001)
+        client = JarpcClient(transport)
+        failures = 0
+        for _ in range(6):
+            try:
+                assert client.get() == 'healthy'
+            except JarpcServerError:
+                failures += 1
+        assert failures == broken.calls == 2
+        assert transport.stats[0]['ejected']
+
+        # probe fails, replica is ejected again
+        time.sleep(0.31)
+        with pytest.raises(JarpcServerError):
+            client.get()
+        assert broken.calls == 3
+        assert client.get() == 'healthy'
+
+        # probe succeeds, replica is re-admitted
+        broken.broken = False
+        time.sleep(0.31)
+        assert client.get() == 'broken'
+        assert not transport.stats[0]['ejected']
+        assert transport.stats[0]['ejections'] == 2
+
+    def test_max_ejection_ratio(self):
+        replica = Replica('broken')
+        replica.broken = True
+        client = JarpcClient(BalancingTransport([replica], failure_threshold=1))
+        for _ in range(3):
+            with pytest.raises(JarpcServerError):
+                client.get()
+        assert replica.calls == 3
+
+    def test_no_transports(self):
+        with pytest.raises(ValueError):
+            BalancingTransport([])
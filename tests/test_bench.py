@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+
+from ..jarpc import AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport
+from ..jarpc.bench import LoadReport, Workload, main, make_demo_dispatcher, run_closed_loop, run_open_loop
+
+
+def make_client():
+    return AsyncJarpcClient(AsyncLoopbackTransport(AsyncJarpcManager(make_demo_dispatcher())))
+
+
+class TestWorkload:
+
+    def test_next_call(self):
+        workload = Workload(methods={'echo': 3, 'sleep': 1}, payload_sizes={0: 1, 10: 1}, ttl=(0.1, 0.2),
+                            params={'delay': 0}, seed=1)
+        calls = [workload.next_call() for _ in range(1000)]
+        methods = [method for method, _, _ in calls]
+        assert 650 < methods.count('echo') < 850
+        assert {len(params.get('payload', '')) for _, params, _ in calls} == {0, 10}
+        assert all(params['delay'] == 0 for _, params, _ in calls)
+        assert all(0.1 <= ttl <= 0.2 for _, _, ttl in calls)
+
+    def test_report(self):
+        report = LoadReport()
+        for i in range(1, 101):
+            report.record_response(i / 1000)
+        report.record_expired()
+        report.elapsed = 2.0
+        summary = report.summary
+        assert summary['completed'] == 100
+        assert summary['throughput'] == 50.0
+        assert summary['latency_ms']['p50'] == pytest.approx(50.0)
+        assert summary['latency_ms']['p99'] == pytest.approx(99.0)
+        assert summary['expired'] == 1
+
+
+@pytest.mark.asyncio
+class TestLoadGenerator:
+
+    async def test_open_loop(self):
+        report = await run_open_loop(make_client(), Workload(methods={'echo': 1, 'fail': 1}, seed=1),
+                                     rate=500, duration=0.2)
+        assert 90 <= report.sent <= 100
+        assert report.completed == report.sent
+        assert 0 < report.errors['-32000 Server error'] < report.sent
+        assert report.expired == report.overflow == 0
+
+    async def test_open_loop_latency_since_schedule(self):
+        # stalled manager: requests are held back, latency is counted from their scheduled time
+        lock = asyncio.Lock()
+        dispatcher = make_demo_dispatcher()
+
+        async def stall():
+            async with lock:
+                await asyncio.sleep(0.05)
+        dispatcher.add_rpc_method(stall)
+        client = AsyncJarpcClient(AsyncLoopbackTransport(AsyncJarpcManager(dispatcher)))
+        report = await run_open_loop(client, Workload(methods={'stall': 1}), rate=100, duration=0.1)
+        assert report.completed == report.sent == 10
+        assert max(report.latencies) > 0.4
+
+    async def test_expired_and_overflow(self):
+        report = await run_open_loop(make_client(), Workload(methods={'sleep': 1}, params={'delay': 0.2},
+                                                             ttl=(0.01, 0.01)),
+                                     rate=200, duration=0.1, max_in_flight=5)
+        assert report.expired == report.sent == 5
+        assert report.overflow > 0
+
+    async def test_closed_loop(self):
+        report = await run_closed_loop(make_client(), Workload(methods={'sleep': 1}, params={'delay': 0.01}),
+                                       concurrency=4, duration=0.1, warmup=0.05)
+        # at most 4 sleeps of 10 ms at a time; fewer calls complete on a loaded machine
+        assert 10 <= report.completed <= 44
+        assert not report.errors
+
+
+def test_main(capsys):
+    main(['--concurrency', '2', '--duration', '0.1', '--warmup', '0', '--method', 'echo:2', '--method', 'fail',
+          '--payload', '100', '--ttl', '1:2', '--json'])
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['completed'] > 0
+    assert summary['errors']['-32000 Server error'] > 0
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from ..jarpc import (AsyncCacheTransport, AsyncJarpcClient, CacheTransport, JarpcClient, JarpcServerError,
+                     JarpcTimeout)
+from ..jarpc.cache import ResultCache
+from ..jarpc.format import JarpcResponse
+
+
+class Backend:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+        self.requests = []
+
+    def respond(self, request):
+        self.calls += 1
+        self.requests.append(request)
+        if self.fail:
+            raise ConnectionResetError
+        return json.dumps({'result': [request.params, self.calls], 'request_id': request.id, 'id': '1'})
+
+    def __call__(self, request_string, request, timeout=None):
+        time.sleep(self.delay)
+        return self.respond(request)
+
+
+class AsyncBackend(Backend):
+    async def __call__(self, request_string, request, timeout=None):
+        await asyncio.sleep(self.delay)
+        return self.respond(request)
+
+
+class ExpiringBackend(AsyncBackend):
+    async def __call__(self, request_string, request, timeout=None):
+        if timeout is not None and timeout < self.delay:
+            await asyncio.sleep(timeout)
+            raise JarpcTimeout
+        return await super().__call__(request_string, request)
+
+
+class TestResultCache:
+
+    def test_lru(self):
+        cache = ResultCache(max_entries=2)
+        for key in 'abc':
+            cache.put(key, JarpcResponse(request_id=key, result=key), ttl=10)
+            cache.get('a')
+        assert cache.get('a') is not None
+        assert cache.get('b') is None
+        assert cache.get('c') is not None
+
+    def test_expiration(self):
+        cache = ResultCache()
+        cache.put('a', JarpcResponse(request_id='a', result='a'), ttl=0.02, stale_ttl=0.02)
+        assert cache.get('a').fresh_until > time.monotonic()
+        time.sleep(0.02)
+        assert cache.get('a').fresh_until <= time.monotonic()
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+class TestCacheTransport:
+
+    def test_cache(self):
+        backend = Backend()
+        transport = CacheTransport(backend, ttls={'get': 10.0})
+        client = JarpcClient(transport)
+        assert client.get(a=1, b=2) == [{'a': 1, 'b': 2}, 1]
+        assert client(method='get', params={'b': 2, 'a': 1}) == [{'a': 1, 'b': 2}, 1]
+        assert client.get(a=2) == [{'a': 2}, 2]
+        assert client.other() == [{}, 3]
+        assert client.other() == [{}, 4]
+        assert transport.stats == {'entries': 2, 'hits': 1, 'stale_hits': 0, 'misses': 2, 'pending': 0}
+
+        transport.invalidate('get', {'a': 2})
+        assert client.get(a=2) == [{'a': 2}, 5]
+
+    def test_ttl(self):
+        backend = Backend()
+        client = JarpcClient(CacheTransport(backend, ttls={'get': 0.02}, stale_ttl=10))
+        assert client.get() == [{}, 1]
+        time.sleep(0.03)
+        assert client.get() == [{}, 2]
+
+    def test_errors_are_not_cached(self):
+        backend = Backend()
+        backend.fail = True
+        client = JarpcClient(CacheTransport(backend, ttls={'get': 10.0}))
+        with pytest.raises(JarpcServerError):
+            client.get()
+        backend.fail = False
+        assert client.get() == [{}, 2]
+
+    def test_concurrent_misses(self):
+        backend = Backend(delay=0.05)
+        client = JarpcClient(CacheTransport(backend, ttls={'get': 10.0}))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.get())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [[{}, 1]] * 5
+        assert backend.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_async_concurrent_misses(self):
+        backend = AsyncBackend(delay=0.02)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 10.0}))
+        results = await asyncio.gather(*(client.get() for _ in range(5)))
+        assert results == [[{}, 1]] * 5
+        assert backend.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_async_stale_while_revalidate(self):
+        backend = AsyncBackend(delay=0.01)
+        transport = AsyncCacheTransport(backend, ttls={'get': 0.1}, stale_ttl=10)
+        client = AsyncJarpcClient(transport)
+        assert await client.get() == [{}, 1]
+        await asyncio.sleep(0.11)
+        # stale response is returned at once and refreshed in background
+        assert await client.get() == [{}, 1]
+        assert await client.get() == [{}, 1]
+        await asyncio.sleep(0.03)
+        assert await client.get() == [{}, 2]
+        assert backend.calls == 2
+        assert transport.stats['stale_hits'] == 2
+
+    @pytest.mark.asyncio
+    async def test_async_refresh_error_logged_once(self, caplog):
+        backend = AsyncBackend(delay=0.01)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 0.01}, stale_ttl=10))
+        assert await client.get() == [{}, 1]
+        await asyncio.sleep(0.02)
+        backend.fail = True
+        for _ in range(5):
+            assert await client.get() == [{}, 1]
+        await asyncio.sleep(0.03)
+        assert backend.calls == 2
+        assert len([record for record in caplog.records if 'refresh failed' in record.message]) == 1
+
+    @pytest.mark.asyncio
+    async def test_async_cancelled_caller(self):
+        backend = AsyncBackend(delay=0.02)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 10.0}))
+        first = asyncio.ensure_future(client.get())
+        second = asyncio.ensure_future(client.get())
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == [{}, 1]
+
+    @pytest.mark.asyncio
+    async def test_async_first_caller_cancelled(self):
+        backend = AsyncBackend(delay=0.02)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 10.0}), cancel_remote=True)
+        first = asyncio.ensure_future(client(method='get', params={}, id='first'))
+        second = asyncio.ensure_future(client(method='get', params={}, id='second'))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == [{}, 1]
+        await asyncio.sleep(0.01)  # cancel notification is sent in background
+        # shared fetch has its own id, so cancellation of the first caller doesn't reach it
+        fetch, cancel = backend.requests
+        assert fetch.id not in ('first', 'second')
+        assert cancel.params == {'request_id': 'first'}
+
+    @pytest.mark.asyncio
+    async def test_async_waiter_deadlines(self):
+        backend = AsyncBackend(delay=0.05)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 10.0}))
+        first = asyncio.ensure_future(client(method='get', params={}, ttl=0.2))
+        second = asyncio.ensure_future(client(method='get', params={}, ttl=0.01))
+        with pytest.raises(JarpcTimeout):
+            await second
+        assert await first == [{}, 1]
+
+    @pytest.mark.asyncio
+    async def test_async_waiter_outlives_fetch(self):
+        backend = ExpiringBackend(delay=0.05)
+        client = AsyncJarpcClient(AsyncCacheTransport(backend, ttls={'get': 10.0}))
+        first = asyncio.ensure_future(client(method='get', params={}, ttl=0.02))
+        second = asyncio.ensure_future(client(method='get', params={}, ttl=0.2))
+        with pytest.raises(JarpcTimeout):
+            await first
+        # fetch expired with the first caller's deadline, the second caller starts its own
+        assert await second == [{}, 1]
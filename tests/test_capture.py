@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from ..jarpc import (AsyncJarpcManager, JarpcClient, JarpcDispatcher, JarpcManager, JarpcResponse, JarpcServerError,
+                     pack_request)
+from ..jarpc.capture import TrafficRecorder, main, read_capture, replay
+from ..jarpc.client import load_response
+
+
+def make_dispatcher(answer=42):
+    dispatcher = JarpcDispatcher()
+
+    @dispatcher.rpc_method
+    def get_answer():
+        return answer
+
+    @dispatcher.rpc_method
+    def fail():
+        raise JarpcServerError('failed')
+
+    @dispatcher.rpc_method
+    def slow(delay: float):
+        time.sleep(delay)
+
+    @dispatcher.rpc_method
+    def count_blobs(jarpc_request):
+        return len(jarpc_request.attachments)
+
+    return dispatcher
+
+
+def make_capture_path(tmp_path):
+    return str(tmp_path / 'traffic.cap')
+
+
+def record_traffic(path, **kwargs):
+    recorder = TrafficRecorder(path, **kwargs)
+    manager = JarpcManager(make_dispatcher(), recorder=recorder)
+    client = JarpcClient(lambda request_string, request: manager.handle(request_string))
+    client(method='get_answer', params={})
+    with pytest.raises(JarpcServerError):
+        client(method='fail', params={})
+    client(method='get_answer', params={}, rsvp=False)
+    manager.handle_frame(pack_request(client._prepare_request('count_blobs', {}, attachments=[b'a', b'b'])))
+    manager.handle(client._prepare_request('slow', {'delay': 0.02}, ttl=0.01).serialize())
+    recorder.close()
+    return recorder
+
+
+def client_request(method):
+    return JarpcClient(lambda *args: None)._prepare_request(method, {}).serialize()
+
+
+class TestTrafficRecorder:
+
+    def test_record(self, tmp_path):
+        recorder = record_traffic(make_capture_path(tmp_path))
+        assert recorder.recorded == 5
+        calls = list(read_capture(make_capture_path(tmp_path)))
+        assert [(call.method, call.outcome) for call in calls] == [
+            ('get_answer', 'ok'), ('fail', 'error'), ('get_answer', 'notification'), ('count_blobs', 'ok'),
+            ('slow', 'dropped'),
+        ]
+        assert calls[1].error_code == -32000
+        assert calls[4].latency >= 0.02
+        assert isinstance(calls[0].request, str)
+        assert isinstance(calls[3].request, bytes)
+        assert calls[2].response is None
+        assert calls[0].received <= calls[1].received
+
+    def test_sampling(self, tmp_path):
+        recorder = TrafficRecorder(make_capture_path(tmp_path), sample_rate=0.1)
+        manager = JarpcManager(make_dispatcher(), recorder=recorder)
+        client = JarpcClient(lambda request_string, request: manager.handle(request_string))
+        for _ in range(1000):
+            client(method='get_answer', params={})
+        recorder.close()
+        assert 50 < recorder.recorded < 150
+
+    def test_rotation(self, tmp_path):
+        path = make_capture_path(tmp_path)
+        recorder = TrafficRecorder(path, max_bytes=1000, backup_count=2)
+        manager = JarpcManager(make_dispatcher(), recorder=recorder)
+        client = JarpcClient(lambda request_string, request: manager.handle(request_string))
+        for _ in range(50):
+            client(method='get_answer', params={})
+        recorder.close()
+        assert os.path.exists(f'{path}.2') and not os.path.exists(f'{path}.3')
+        assert all(os.path.getsize(p) < 1300 for p in (path, f'{path}.1', f'{path}.2'))
+        calls = list(read_capture(path))
+        assert 0 < len(calls) < 50
+        assert [call.received for call in calls] == sorted(call.received for call in calls)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_failing_recorder(self, tmp_path, is_async):
+        recorder = TrafficRecorder(make_capture_path(tmp_path))
+        recorder.close()
+        recorder.record = lambda *args: 1 / 0
+        manager = (AsyncJarpcManager if is_async else JarpcManager)(make_dispatcher(), recorder=recorder)
+        response = manager.handle(client_request('get_answer'))
+        if is_async:
+            response = await response
+        assert load_response(response).result == 42
+
+    def test_queue_full(self, tmp_path):
+        request = client_request('get_answer')
+        # queue fits requests and responses of two calls
+        recorder = TrafficRecorder(make_capture_path(tmp_path), max_queue_bytes=2 * len(request) + 100)
+        manager = JarpcManager(make_dispatcher(), recorder=recorder)
+        with recorder._lock:
+            # writer is blocked, records over the queue are dropped
+            for _ in range(5):
+                assert load_response(manager.handle(request)).result == 42
+        recorder.close()
+        assert recorder.recorded + recorder.dropped == 5
+        assert recorder.dropped >= 2
+
+    def test_response_not_serialized_again(self, tmp_path, monkeypatch):
+        recorder = TrafficRecorder(make_capture_path(tmp_path))
+        manager = JarpcManager(make_dispatcher(), recorder=recorder)
+        serialized = []
+        monkeypatch.setattr(JarpcResponse, 'serialize', lambda response, dumps: serialized.append(response) or '{}')
+        manager.handle(client_request('get_answer'))
+        recorder.close()
+        assert len(serialized) == 1
+        assert next(read_capture(make_capture_path(tmp_path))).response == '{}'
+
+    def test_truncated(self, tmp_path):
+        path = make_capture_path(tmp_path)
+        record_traffic(path)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        assert len(list(read_capture(path))) == 4
+
+
+@pytest.mark.asyncio
+class TestReplay:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_replay(self, tmp_path, is_async):
+        record_traffic(make_capture_path(tmp_path))
+        manager_class = AsyncJarpcManager if is_async else JarpcManager
+        report = await replay(manager_class(make_dispatcher()), read_capture(make_capture_path(tmp_path)))
+        assert report.replayed == 5
+        assert report.outcomes == report.original_outcomes
+        assert report.compared == 4
+        assert report.mismatched == 0
+
+    async def test_diff(self, tmp_path):
+        record_traffic(make_capture_path(tmp_path))
+        report = await replay(AsyncJarpcManager(make_dispatcher(answer=43)), read_capture(make_capture_path(tmp_path)))
+        assert report.mismatched == 1
+        assert report.diffs[0]['method'] == 'get_answer'
+        assert report.diffs[0]['expected'] == {'result': 42}
+        assert report.diffs[0]['actual'] == {'result': 43}
+
+    async def test_pace(self, tmp_path):
+        path = make_capture_path(tmp_path)
+        recorder = TrafficRecorder(path)
+        manager = JarpcManager(make_dispatcher(), recorder=recorder)
+        client = JarpcClient(lambda request_string, request: manager.handle(request_string))
+        for _ in range(3):
+            client(method='get_answer', params={}, ttl=0.15)
+            time.sleep(0.1)
+        recorder.close()
+
+        # ts is shifted, so requests don't expire on replay
+        report = await replay(AsyncJarpcManager(make_dispatcher()), read_capture(path))
+        assert 0.2 <= report.elapsed < 0.3
+        assert report.outcomes['ok'] == 3
+        report = await replay(AsyncJarpcManager(make_dispatcher()), read_capture(path), speed=4)
+        assert report.elapsed < 0.1
+
+
+def test_main(tmp_path, capsys):
+    record_traffic(make_capture_path(tmp_path))
+    main(['show', make_capture_path(tmp_path)])
+    assert 'get_answer: ok 1, notification 1' in capsys.readouterr().out
+    main(['replay', make_capture_path(tmp_path), '--dispatcher', f'{__name__}:DISPATCHER', '--speed', '10'])
+    assert 'mismatched 0' in capsys.readouterr().out
+
+
+DISPATCHER = make_dispatcher()
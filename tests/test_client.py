@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 from unittest import mock
 
@@ -6,7 +7,9 @@ import pytest
 from asynctest import CoroutineMock, Mock, ANY
 from freezegun import freeze_time
 
-from ..jarpc import AsyncJarpcClient, JarpcClient, JarpcRequest, JarpcServerError, JarpcTimeout, JarpcValidationError
+from ..jarpc import (CANCEL_METHOD, AsyncAffinityTransport, AsyncBalancingTransport, AsyncJarpcClient,
+                     AsyncLimitTransport, AsyncRetryTransport, JarpcClient, JarpcRequest, JarpcServerError,
+                     JarpcTimeout, JarpcValidationError)
 
 
 class TestJarpcClient:
@@ -240,3 +243,119 @@ class TestJarpcClient:
                 await call_result
 
         transport.assert_called_once()
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.parametrize('ttl, timeout, expected_timeout', [
+        (None, None, None),
+        (None, 5.0, 5.0),
+        (10.0, None, 10.0),
+        (10.0, 5.0, 5.0),
+        (10.0, 20.0, 10.0),
+    ])
+    @pytest.mark.asyncio
+    @freeze_time('2012-01-14')
+    async def test_call_timeout_from_ttl(self, is_async, ttl, timeout, expected_timeout):
+        if is_async:
+            mock_class = CoroutineMock
+            client = AsyncJarpcClient
+        else:
+            mock_class = Mock
+            client = JarpcClient
+
+        transport = mock_class(return_value=json.dumps({'result': 1, 'request_id': '1', 'id': '2'}),
+                               accepts_timeout=True)
+        jarpc_client = client(transport=transport)
+
+        call_kwargs = dict(method='method', params={}, ttl=ttl)
+        if timeout is not None:
+            call_kwargs['timeout'] = timeout
+        call_result = jarpc_client(**call_kwargs)
+        if is_async:
+            await call_result
+
+        _, kwargs = transport.call_args
+        assert kwargs.get('timeout') == expected_timeout
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.asyncio
+    async def test_call_timeout_not_accepted(self, is_async):
+        calls = []
+
+        def transport(request_string, request):
+            calls.append(request)
+            return json.dumps({'result': 1, 'request_id': request.id, 'id': '2'})
+
+        async def async_transport(request_string, request):
+            return transport(request_string, request)
+
+        jarpc_client = AsyncJarpcClient(async_transport) if is_async else JarpcClient(transport)
+        call_result = jarpc_client(method='method', params={}, ttl=10.0)
+        if is_async:
+            call_result = await call_result
+        assert call_result == 1
+        assert len(calls) == 1
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.asyncio
+    async def test_call_expired(self, is_async):
+        transport = (CoroutineMock if is_async else Mock)()
+        jarpc_client = (AsyncJarpcClient if is_async else JarpcClient)(transport=transport)
+
+        with freeze_time('2012-01-14 00:00:00') as frozen_time:
+            request = jarpc_client._prepare_request(method='method', params={}, ttl=1.0)
+            frozen_time.tick(2)
+            with pytest.raises(JarpcTimeout):
+                call_result = jarpc_client(method='method', params={}, ts=request.ts, ttl=request.ttl)
+                if is_async:
+                    await call_result
+
+        transport.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_cancel_remote(self):
+        calls = []
+        cancelled = asyncio.Event()
+
+        async def transport(request_string, request):
+            calls.append(request)
+            if request.method == CANCEL_METHOD:
+                cancelled.set()
+                return
+            await asyncio.sleep(10)
+
+        jarpc_client = AsyncJarpcClient(transport, cancel_remote=True)
+        task = asyncio.ensure_future(jarpc_client.method())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(cancelled.wait(), 1.0)
+
+        call, cancel = calls
+        assert cancel.method == CANCEL_METHOD
+        assert cancel.params == {'request_id': call.id}
+        assert not cancel.rsvp
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('wrap, forwarded', [
+        (lambda transport: AsyncLimitTransport(transport), True),
+        (lambda transport: AsyncBalancingTransport([transport, transport]), False),
+        (lambda transport: AsyncLimitTransport(AsyncAffinityTransport({'a': transport})), False),
+        (lambda transport: AsyncRetryTransport(transport, hedge_delay=1.0), False),
+    ])
+    async def test_cancel_remote_through_wrappers(self, wrap, forwarded):
+        calls = []
+
+        async def transport(request_string, request):
+            calls.append(request.method)
+            if request.method != CANCEL_METHOD:
+                await asyncio.sleep(10)
+
+        jarpc_client = AsyncJarpcClient(wrap(transport), cancel_remote=True)
+        task = asyncio.ensure_future(jarpc_client.method())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.01)
+        assert calls == (['method', CANCEL_METHOD] if forwarded else ['method'])
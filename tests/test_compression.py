@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+from ..jarpc import (AdaptiveCompressor, AsyncJarpcClient, AsyncJarpcManager, Codec, JarpcClient, JarpcDispatcher,
+                     JarpcManager, JarpcParseError, JarpcRequest, compress_payload, decompress_payload, is_compressed,
+                     register_codec)
+from ..jarpc import compression
+
+COMPRESSIBLE = json.dumps([{'name': 'Caesar', 'price': 100}] * 1000)
+
+
+class TestPayload:
+
+    @pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+    def test_roundtrip(self, codec):
+        payload = compress_payload(COMPRESSIBLE.encode(), codec)
+        assert is_compressed(payload)
+        assert len(payload) < len(COMPRESSIBLE) / 10
+        assert decompress_payload(payload) == COMPRESSIBLE.encode()
+
+    @pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+    def test_max_size(self, codec):
+        payload = compress_payload(COMPRESSIBLE.encode(), codec)
+        with pytest.raises(ValueError):
+            decompress_payload(payload, max_size=1000)
+
+    @pytest.mark.parametrize('payload', [
+        b'JRPZ',
+        compress_payload(b'data', 'zlib')[:-2],
+        b'JRPZ\x04zstd' + b'data',
+    ])
+    def test_malformed(self, payload):
+        with pytest.raises(ValueError):
+            decompress_payload(payload)
+
+    def test_not_compressed(self):
+        assert not is_compressed('{"result": 1}')
+        assert not is_compressed(b'JRPF')
+
+    def test_register_codec(self):
+        register_codec(Codec('reverse', compress=lambda data: data[::-1], decompress=lambda data, max_size: data[::-1]))
+        try:
+            assert decompress_payload(compress_payload(b'abc', 'reverse')) == b'abc'
+        finally:
+            compression._codecs.pop('reverse')
+
+
+class TestAdaptiveCompressor:
+
+    def test_threshold(self):
+        compressor = AdaptiveCompressor(threshold=len(COMPRESSIBLE) + 1)
+        assert compressor.compress(COMPRESSIBLE) is None
+        assert compressor.stats['skipped'] == 1
+
+    def test_accepted(self):
+        compressor = AdaptiveCompressor(codecs=('lzma', 'zlib'), threshold=100)
+        assert decompress_payload(compressor.compress(COMPRESSIBLE, ['zlib'])) == COMPRESSIBLE.encode()
+        assert compressor.compress(COMPRESSIBLE, []) is None
+
+    def test_incompressible(self):
+        compressor = AdaptiveCompressor(threshold=1000, max_threshold=8000, probe_interval=3)
+        noise = os.urandom(5000)
+        assert compressor.compress(noise) is None
+        assert compressor.compress(noise) is None
+        assert compressor.compress(noise) is None
+        assert compressor.threshold == 8000
+        assert compressor.stats['incompressible'] == 3
+
+        # payloads below raised threshold are probed once in a while
+        compressible = COMPRESSIBLE[:5000]
+        assert compressor.compress(compressible) is None
+        assert compressor.compress(compressible) is None
+        assert compressor.compress(compressible) is not None
+        assert compressor.threshold == 4000
+
+
+def make_dispatcher():
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda value: value, 'echo')
+    return dispatcher
+
+
+class Transport:
+    """Transport to manager which keeps payloads it carried. """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.requests = []
+        self.responses = []
+
+    def __call__(self, request_string, request):
+        self.requests.append(request_string)
+        response = self.manager.handle(request_string)
+        self.responses.append(response)
+        return response
+
+
+class AsyncTransport(Transport):
+    async def __call__(self, request_string, request):
+        self.requests.append(request_string)
+        response = await self.manager.handle(request_string)
+        self.responses.append(response)
+        return response
+
+
+def get_classes(is_async):
+    if is_async:
+        return AsyncJarpcManager, AsyncJarpcClient, AsyncTransport
+    return JarpcManager, JarpcClient, Transport
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('is_async', [False, True])
+class TestNegotiation:
+
+    async def call(self, client, value, is_async):
+        result = client(method='echo', params={'value': value})
+        return await result if is_async else result
+
+    async def test_negotiated(self, is_async):
+        manager_class, client_class, transport_class = get_classes(is_async)
+        transport = transport_class(manager_class(make_dispatcher(), compressor=AdaptiveCompressor(threshold=100)))
+        client = client_class(transport, compressor=AdaptiveCompressor(threshold=100))
+
+        assert await self.call(client, COMPRESSIBLE, is_async) == COMPRESSIBLE
+        # server doesn't know yet that client accepts compression
+        assert not is_compressed(transport.requests[0])
+        assert is_compressed(transport.responses[0])
+
+        assert await self.call(client, COMPRESSIBLE, is_async) == COMPRESSIBLE
+        assert is_compressed(transport.requests[1])
+        assert is_compressed(transport.responses[1])
+
+        assert await self.call(client, 'small', is_async) == 'small'
+        assert not is_compressed(transport.requests[2])
+        assert not is_compressed(transport.responses[2])
+
+    @pytest.mark.parametrize('server_compresses', [False, True])
+    async def test_uncompressed_peer(self, is_async, server_compresses):
+        manager_class, client_class, transport_class = get_classes(is_async)
+        server_compressor = AdaptiveCompressor(threshold=100) if server_compresses else None
+        client_compressor = None if server_compresses else AdaptiveCompressor(threshold=100)
+        transport = transport_class(manager_class(make_dispatcher(), compressor=server_compressor))
+        client = client_class(transport, compressor=client_compressor)
+
+        for _ in range(2):
+            assert await self.call(client, COMPRESSIBLE, is_async) == COMPRESSIBLE
+        assert not any(is_compressed(payload) for payload in transport.requests + transport.responses)
+
+    async def test_malformed_request(self, is_async):
+        manager = (AsyncJarpcManager if is_async else JarpcManager)(make_dispatcher())
+        response = manager.handle(b'JRPZ\x04zlib' + b'garbage')
+        if is_async:
+            response = await response
+        assert json.loads(response)['error']['code'] == JarpcParseError.code
+
+
+def test_request_compression_field():
+    request = JarpcRequest(method='echo', params={}, compression=['zlib'])
+    assert JarpcRequest.from_json(request.serialize()).compression == ('zlib',)
+    assert JarpcRequest.from_json(JarpcRequest(method='echo', params={}).serialize()).compression is None
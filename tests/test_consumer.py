@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+import pytest
+
+from ..jarpc import AsyncJarpcManager, InMemoryBroker, JarpcDispatcher, JarpcRequest, QueueConsumer, pack_request
+
+
+def make_request(method='cook', params=None, ttl=None, ts=None, rsvp=True) -> str:
+    return JarpcRequest(method=method, params=params or {}, ttl=ttl, ts=ts, rsvp=rsvp).serialize()
+
+
+async def wait_for(condition, timeout=1.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        await asyncio.sleep(0.001)
+
+
+class Kitchen:
+    def __init__(self):
+        self.cooked = []
+        self.release = asyncio.Event()
+        self.release.set()
+        self.dispatcher = JarpcDispatcher()
+        self.dispatcher.add_rpc_method(self.cook)
+
+    async def cook(self, name='salad'):
+        await self.release.wait()
+        self.cooked.append(name)
+        return name
+
+
+class FlakyBroker(InMemoryBroker):
+    def __init__(self):
+        super().__init__()
+        self.publish_failures = 1
+
+    async def publish(self, reply_to, body):
+        if self.publish_failures:
+            self.publish_failures -= 1
+            raise ConnectionError
+        await super().publish(reply_to, body)
+
+
+class SlowAckBroker(InMemoryBroker):
+    async def ack(self, message):
+        await asyncio.sleep(1.0)
+        await super().ack(message)
+
+
+class ListRecorder:
+    def __init__(self):
+        self.records = []
+
+    def sample(self):
+        return True
+
+    def record(self, message, request, response, response_string, received, latency):
+        self.records.append((message, response))
+
+
+@pytest.mark.asyncio
+class TestQueueConsumer:
+
+    async def test_handle(self):
+        kitchen = Kitchen()
+        broker = InMemoryBroker()
+        consumer = QueueConsumer(AsyncJarpcManager(kitchen.dispatcher), broker)
+        consumer.start()
+        for i in range(5):
+            broker.send(make_request(params={'name': str(i)}), reply_to='orders')
+        broker.send(make_request(params={'name': 'notification'}, rsvp=False), reply_to='orders')
+        broker.send(make_request(params={'name': 'no reply'}))
+        broker.send('not a request', reply_to='orders')
+        await wait_for(lambda: broker.acked == 8)
+
+        responses = [json.loads(reply) for reply in broker.replies['orders']]
+        assert responses[0]['error']['code'] == -32700
+        assert sorted(response['result'] for response in responses[1:]) == [str(i) for i in range(5)]
+        assert sorted(kitchen.cooked) == sorted([str(i) for i in range(5)] + ['notification', 'no reply'])
+        assert consumer.stats['handled'] == 8 and consumer.stats['published'] == 6
+        await consumer.stop()
+
+    async def test_deadline_order(self):
+        kitchen = Kitchen()
+        broker = InMemoryBroker()
+        now = time.time()
+        broker.send(make_request(params={'name': 'no ttl'}))
+        broker.send(make_request(params={'name': 'late'}, ts=now, ttl=10))
+        broker.send(make_request(params={'name': 'expired'}, ts=now - 10, ttl=1))
+        broker.send(make_request(params={'name': 'soon'}, ts=now, ttl=1))
+        broker.send(make_request(params={'name': 'sooner'}, ts=now - 1, ttl=1.5))
+        consumer = QueueConsumer(AsyncJarpcManager(kitchen.dispatcher), broker, concurrency=1)
+        consumer.start()
+        await wait_for(lambda: broker.acked == 5)
+        assert kitchen.cooked == ['sooner', 'soon', 'late', 'no ttl']
+        assert consumer.stats['purged'] == 1
+        await consumer.stop()
+
+    async def test_prefetch(self):
+        kitchen = Kitchen()
+        kitchen.release.clear()
+        broker = InMemoryBroker()
+        for i in range(10):
+            broker.send(make_request(params={'name': str(i)}))
+        consumer = QueueConsumer(AsyncJarpcManager(kitchen.dispatcher), broker, prefetch=4, concurrency=2)
+        consumer.start()
+        await wait_for(lambda: consumer.stats['outstanding'] == 4)
+        await asyncio.sleep(0.01)
+        assert len(broker.unacked) == 4 and len(broker.queue) == 6
+        kitchen.release.set()
+        await wait_for(lambda: broker.acked == 10)
+        await consumer.stop()
+
+    async def test_publish_failure(self):
+        kitchen = Kitchen()
+        broker = FlakyBroker()
+        consumer = QueueConsumer(AsyncJarpcManager(kitchen.dispatcher), broker)
+        consumer.start()
+        broker.send(make_request(), reply_to='orders')
+        await wait_for(lambda: broker.acked == 1)
+        assert len(broker.replies['orders']) == 1
+        assert kitchen.cooked == ['salad', 'salad']
+        assert consumer.stats['failed'] == 1
+        await consumer.stop()
+
+    async def test_stop(self):
+        kitchen = Kitchen()
+        kitchen.release.clear()
+        broker = InMemoryBroker()
+        for i in range(5):
+            broker.send(make_request(params={'name': str(i)}))
+        consumer = QueueConsumer(AsyncJarpcManager(kitchen.dispatcher), broker, concurrency=1)
+        consumer.start()
+        await wait_for(lambda: consumer.stats['received'] == 5)
+        await consumer.stop(timeout=0.01)
+        assert not kitchen.cooked
+        assert len(broker.queue) == 5 and not broker.unacked
+        assert consumer.stats['outstanding'] == 0
+
+    async def test_stop_while_acking(self):
+        broker = SlowAckBroker()
+        broker.send(make_request())
+        consumer = QueueConsumer(AsyncJarpcManager(Kitchen().dispatcher), broker)
+        consumer.start()
+        await wait_for(lambda: consumer.stats['handled'] == 1)
+        await consumer.stop(timeout=0.01)
+        # ack may have reached broker, so message is not rejected too
+        assert not broker.queue and len(broker.unacked) == 1
+        assert consumer.stats['outstanding'] == 0
+
+    async def test_recorder(self):
+        recorder = ListRecorder()
+        broker = InMemoryBroker()
+        consumer = QueueConsumer(AsyncJarpcManager(Kitchen().dispatcher, recorder=recorder), broker)
+        consumer.start()
+        request = make_request()
+        broker.send(request, reply_to='orders')
+        await wait_for(lambda: broker.acked == 1)
+        assert [message for message, _ in recorder.records] == [request]
+        await consumer.stop()
+
+    async def test_parsed_once(self, monkeypatch):
+        recorder = ListRecorder()
+        broker = InMemoryBroker()
+        consumer = QueueConsumer(AsyncJarpcManager(Kitchen().dispatcher, recorder=recorder), broker)
+        parsed = []
+        from_json = JarpcRequest.from_json.__func__
+
+        def counting_from_json(cls, *args, **kwargs):
+            parsed.append(args[0])
+            return from_json(cls, *args, **kwargs)
+
+        monkeypatch.setattr(JarpcRequest, 'from_json', classmethod(counting_from_json))
+        consumer.start()
+        broker.send(make_request(ttl=10.0), reply_to='orders')
+        broker.send(pack_request(JarpcRequest(method='cook', params={}, attachments=[b'a'])), reply_to='orders')
+        await wait_for(lambda: broker.acked == 2)
+        assert len(parsed) == 2
+        assert len(recorder.records) == 2
+        assert [type(reply) for reply in broker.replies['orders']] == [str, bytes]
+        await consumer.stop()
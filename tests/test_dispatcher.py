@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import builtins
+import sys
+import threading
+
+import pytest
+
+from ..jarpc import (AsyncJarpcManager, JarpcDispatcher, JarpcInternalError, JarpcManager, JarpcMethodNotFound,
+                     JarpcRequest)
+
+KITCHEN_MODULE = '''
+import time
+
+imported = getattr(__import__('builtins'), 'kitchen_imports', 0) + 1
+__import__('builtins').kitchen_imports = imported
+time.sleep(0.05)
+
+
+def cook_salad(name):
+    return name
+
+
+class Oven:
+    @staticmethod
+    def bake(name):
+        return 'baked ' + name
+'''
+
+
+@pytest.fixture
+def kitchen(tmp_path, monkeypatch):
+    """Name of module with methods, not imported yet. """
+    (tmp_path / 'lazy_kitchen.py').write_text(KITCHEN_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr('builtins.kitchen_imports', 0, raising=False)
+    yield 'lazy_kitchen'
+    sys.modules.pop('lazy_kitchen', None)
+
+
+class TestLazyMethods:
+
+    def test_import_on_first_call(self, kitchen):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(f'{kitchen}:cook_salad')
+        dispatcher.add_rpc_method(f'{kitchen}:Oven.bake', name='bake_pie', priority='low')
+        assert kitchen not in sys.modules
+        assert dispatcher.get_priority('bake_pie') == 'low'
+
+        manager = JarpcManager(dispatcher)
+        assert manager.get_request_response(JarpcRequest(method='cook_salad', params={'name': 'Caesar'})).result \
+            == 'Caesar'
+        assert kitchen in sys.modules
+        assert dispatcher['bake_pie']('pie') == 'baked pie'
+        assert dispatcher.lazy_methods == {}
+        with pytest.raises(JarpcMethodNotFound):
+            dispatcher['cook_soup']
+
+    def test_threads(self, kitchen):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(f'{kitchen}:cook_salad')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(dispatcher['cook_salad']('Greek')))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ['Greek'] * 10
+        assert builtins.kitchen_imports == 1
+
+    @pytest.mark.asyncio
+    async def test_async_import(self, kitchen):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(f'{kitchen}:cook_salad')
+        manager = AsyncJarpcManager(dispatcher)
+        request = JarpcRequest(method='cook_salad', params={'name': 'Caesar'})
+        call = asyncio.ensure_future(manager.get_request_response(request))
+        # module is imported in executor, event loop is not blocked
+        await asyncio.sleep(0.01)
+        assert not call.done()
+        assert (await call).result == 'Caesar'
+        assert builtins.kitchen_imports == 1
+
+    def test_warm_up(self, kitchen):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(f'{kitchen}:cook_salad')
+        dispatcher.add_rpc_method('missing_kitchen_module:cook_soup')
+        dispatcher.warm_up(background=True).join()
+        assert kitchen in sys.modules
+        assert dispatcher.lazy_methods == {'cook_soup': 'missing_kitchen_module:cook_soup'}
+
+    @pytest.mark.asyncio
+    async def test_import_error(self):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method('missing_kitchen_module:cook_soup')
+        with pytest.raises(JarpcInternalError):
+            dispatcher['cook_soup']
+
+        response = await AsyncJarpcManager(dispatcher).get_request_response(JarpcRequest(method='cook_soup',
+                                                                                         params={}))
+        assert response.error['code'] == JarpcInternalError.code
+        assert 'missing_kitchen_module' in response.error['data']
+
+    def test_override(self, kitchen):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(f'{kitchen}:cook_salad')
+        dispatcher.add_rpc_method(lambda name: 'eager ' + name, name='cook_salad')
+        assert dispatcher['cook_salad']('Caesar') == 'eager Caesar'
+
+        other = JarpcDispatcher()
+        other.add_rpc_method(f'{kitchen}:cook_salad')
+        dispatcher.update(other)
+        assert dispatcher['cook_salad']('Caesar') == 'Caesar'
+
+        with pytest.raises(ValueError):
+            dispatcher.add_rpc_method('lazy_kitchen.cook_salad')
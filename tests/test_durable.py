@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from ..jarpc import AsyncDurableOutboxTransport, AsyncJarpcClient, DurableLog, DurableOutboxTransport, JarpcClient
+
+
+class Backend:
+    def __init__(self, down=False):
+        self.down = down
+        self.received = []
+        self.calls = 0
+
+    def __call__(self, request_string, request):
+        self.calls += 1
+        if self.down:
+            raise ConnectionRefusedError
+        self.received.append((request.params, list(request.attachments)))
+        if request.rsvp:
+            return f'{{"result": "ok", "request_id": "{request.id}", "id": "1"}}'
+
+
+class AsyncBackend(Backend):
+    async def __call__(self, request_string, request):
+        return super().__call__(request_string, request)
+
+
+def make_log_path(tmp_path):
+    return str(tmp_path / 'outbox.log')
+
+
+class TestDurableLog:
+
+    def test_replay(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path))
+        assert log.put('1', b'one')
+        assert log.put('2', b'two')
+        assert log.put('3', b'three')
+        assert not log.put('2', b'two again')
+        log.ack('1')
+        log.close()
+
+        log = DurableLog(make_log_path(tmp_path))
+        assert log.replay() == [('2', b'two'), ('3', b'three')]
+        assert len(log) == 2
+        assert not log.put('3', b'three again')
+        log.close()
+
+    def test_corrupted_tail(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path))
+        log.put('1', b'one')
+        log.put('2', b'two')
+        log.close()
+        size = os.path.getsize(make_log_path(tmp_path))
+        with open(make_log_path(tmp_path), 'r+b') as f:
+            f.truncate(size - 1)
+
+        log = DurableLog(make_log_path(tmp_path))
+        assert log.replay() == [('1', b'one')]
+        log.put('3', b'three')
+        log.close()
+        log = DurableLog(make_log_path(tmp_path))
+        assert log.replay() == [('1', b'one'), ('3', b'three')]
+        log.close()
+
+    def test_group_commit(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path), commit_delay=0.01)
+
+        def put(i):
+            for j in range(10):
+                log.put(f'{i}-{j}', b'x' * 100)
+
+        threads = [threading.Thread(target=put, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(log) == 100
+        assert log.commits < 50
+        log.close()
+
+    def test_ack_timer(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path), ack_delay=0.01)
+        log.put('1', b'one')
+        log.put('2', b'two')
+        log.ack('1')
+        time.sleep(0.05)
+        # acks are committed without waiting for the next put
+        other = DurableLog(make_log_path(tmp_path))
+        assert other.replay() == [('2', b'two')]
+        other.close()
+        log.close()
+
+    def test_acked_duplicates(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path), max_acked=1)
+        log.put('1', b'one')
+        log.ack('1')
+        assert not log.put('1', b'one again')
+        log.put('2', b'two')
+        log.ack('2')
+        log.close()
+
+        log = DurableLog(make_log_path(tmp_path), max_acked=1)
+        assert not log.put('2', b'two again')
+        # only the last acked ids are remembered
+        assert log.put('1', b'one again')
+        log.close()
+
+    def test_compact(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path), compact_size=1000)
+        for i in range(20):
+            log.put(str(i), b'x' * 100)
+        for i in range(20):
+            log.ack(str(i))
+        log.commit()
+        # only acks remembered to drop duplicates are left
+        assert os.path.getsize(make_log_path(tmp_path)) < 1000
+        log.close()
+
+        log = DurableLog(make_log_path(tmp_path))
+        assert not log.replay()
+        assert not log.put('19', b'x' * 100)
+        log.close()
+
+    def test_compact_pending(self, tmp_path):
+        log = DurableLog(make_log_path(tmp_path), compact_size=10000, fsync=False, max_acked=10)
+        log.put('0', b'x' * 100)
+        for i in range(1, 2000):
+            log.put(str(i), b'x' * 100)
+            log.ack(str(i - 1))
+            assert os.path.getsize(make_log_path(tmp_path)) < 10000 + 200
+        log.close()
+
+        log = DurableLog(make_log_path(tmp_path))
+        assert log.replay() == [('1999', b'x' * 100)]
+        assert not log.put('1998', b'x' * 100)
+        log.close()
+
+
+class TestDurableOutboxTransport:
+
+    def test_recovery(self, tmp_path):
+        backend = Backend(down=True)
+        transport = DurableOutboxTransport(backend, make_log_path(tmp_path), retry_delay=0.01)
+        client = JarpcClient(transport=transport)
+        for i in range(5):
+            assert client(method='notify', params={'i': i}, rsvp=False, durable=True) is None
+        assert client(method='notify', params={'i': 4}, rsvp=False, durable=True, id='4') is None
+        assert client(method='notify', params={'i': 4}, rsvp=False, durable=True, id='4') is None
+        assert transport.stats['duplicates'] == 1
+
+        backend.down = False
+        transport.flush()
+        assert backend.received == [({'i': i}, []) for i in range(5)] + [({'i': 4}, [])]
+        assert transport.stats['pending'] == 0
+        assert transport.stats['failed'] > 0
+        transport.close()
+
+    def test_replay(self, tmp_path):
+        backend = Backend(down=True)
+        transport = DurableOutboxTransport(backend, make_log_path(tmp_path), retry_delay=10.0)
+        client = JarpcClient(transport=transport)
+        for i in range(3):
+            client(method='notify', params={'i': i}, rsvp=False, durable=True, attachments=[b'blob'] if i else None)
+        transport.close()
+
+        backend = Backend()
+        transport = DurableOutboxTransport(backend, make_log_path(tmp_path))
+        transport.flush()
+        assert backend.received == [({'i': 0}, []), ({'i': 1}, [b'blob']), ({'i': 2}, [b'blob'])]
+        transport.close()
+
+    def test_not_durable(self, tmp_path):
+        backend = Backend()
+        transport = DurableOutboxTransport(backend, make_log_path(tmp_path))
+        client = JarpcClient(transport=transport)
+        assert client(method='call', params={}, durable=True) == 'ok'
+        client(method='notify', params={}, rsvp=False)
+        assert len(backend.received) == 2
+        assert transport.stats['pending'] == 0
+        assert transport.log.commits == 0
+        transport.close()
+
+
+@pytest.mark.asyncio
+class TestAsyncDurableOutboxTransport:
+
+    async def test_recovery(self, tmp_path):
+        backend = AsyncBackend(down=True)
+        transport = AsyncDurableOutboxTransport(backend, make_log_path(tmp_path), retry_delay=0.01)
+        client = AsyncJarpcClient(transport=transport)
+        await asyncio.gather(*(client(method='notify', params={'i': i}, rsvp=False, durable=True) for i in range(5)))
+        assert transport.stats['pending'] == 5
+
+        backend.down = False
+        await transport.flush()
+        assert sorted(params['i'] for params, _ in backend.received) == list(range(5))
+        assert transport.stats['pending'] == 0
+        await transport.close()
+
+    async def test_replay(self, tmp_path):
+        backend = AsyncBackend(down=True)
+        transport = AsyncDurableOutboxTransport(backend, make_log_path(tmp_path), retry_delay=10.0)
+        client = AsyncJarpcClient(transport=transport)
+        for i in range(3):
+            await client(method='notify', params={'i': i}, rsvp=False, durable=True)
+        await transport.close()
+
+        backend = AsyncBackend()
+        transport = AsyncDurableOutboxTransport(backend, make_log_path(tmp_path))
+        transport.start()
+        await transport.flush()
+        assert backend.received == [({'i': i}, []) for i in range(3)]
+        await transport.close()
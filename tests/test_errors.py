@@ -2,13 +2,14 @@
 import pytest
 
 from ..jarpc import (JarpcUnauthorized, JarpcForbidden, JarpcExternalServiceUnavailable, JarpcValidationError,
-                     JarpcUnknownError, JarpcError, raise_exception)
+                     JarpcUnknownError, JarpcError, JarpcTooManyRequests, raise_exception)
 
 
 @pytest.mark.parametrize('code, error_class, data',
                          [
                              (1000, JarpcUnauthorized, 'test1'),
                              (1001, JarpcForbidden, 'test2'),
+                             (1002, JarpcTooManyRequests, {'retry_after': 0.5}),
                              (2000, JarpcValidationError, 'test3'),
                              (3000, JarpcExternalServiceUnavailable, 'test3'),
                              (9999, JarpcUnknownError, 'test4')
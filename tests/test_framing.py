@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from ..jarpc import (AsyncJarpcManager, JarpcAttachedResult, JarpcClient, JarpcDispatcher, JarpcInvalidRequest,
+                     JarpcManager, JarpcParseError, JarpcRequest, JarpcResponse, JarpcServerError, is_frame,
+                     pack_frame, pack_request, pack_response, unpack_frame, unpack_request, unpack_response)
+
+
+REQUEST_KWARGS = {
+    'method': 'upload',
+    'params': {'name': 'file.bin'},
+    'ts': float(1 << 31),
+    'ttl': 10.0,
+    'id': '429284302',
+    'rsvp': True,
+}
+
+
+class TestFrame:
+
+    @pytest.mark.parametrize('attachments', [[], [b''], [b'abc'], [b'abc', bytearray(b'\x00' * 1000), b'd']])
+    def test_round_trip(self, attachments):
+        frame = pack_frame(b'{"a": 1}', attachments)
+        assert is_frame(frame)
+        envelope, parts = unpack_frame(frame)
+        assert envelope == b'{"a": 1}'
+        assert [bytes(part) for part in parts] == [bytes(attachment) for attachment in attachments]
+
+    def test_no_copy(self):
+        frame = bytearray(pack_frame(b'{}', [b'abc']))
+        _, parts = unpack_frame(frame)
+        assert isinstance(parts[0], memoryview)
+        frame[-1:] = b'x'
+        assert bytes(parts[0]) == b'abx'
+
+    @pytest.mark.parametrize('data', ['{}', b'{}', b'', 123])
+    def test_is_not_frame(self, data):
+        assert not is_frame(data)
+
+    @pytest.mark.parametrize('frame', [b'JRPF', b'XXXX' + pack_frame(b'{}')[4:], pack_frame(b'{}', [b'abc'])[:-1],
+                                       pack_frame(b'{}', [b'abc']) + b'x'])
+    def test_malformed(self, frame):
+        with pytest.raises(ValueError):
+            unpack_frame(frame)
+
+
+class TestMessages:
+
+    def test_request(self):
+        request = JarpcRequest(**REQUEST_KWARGS, attachments=[b'\x00\x01', b'\x02'])
+        assert request.data['attachments'] == 2
+
+        unpacked = unpack_request(pack_request(request))
+        assert unpacked.data == request.data
+        assert [bytes(part) for part in unpacked.attachments] == [b'\x00\x01', b'\x02']
+
+    def test_request_attachments_mismatch(self):
+        request = JarpcRequest(**REQUEST_KWARGS, attachments=[b'\x00\x01'])
+        with pytest.raises(JarpcInvalidRequest) as e:
+            JarpcRequest.from_json(request.serialize())
+        assert e.value.data == 'Bad "attachments" value'
+
+    def test_request_malformed(self):
+        with pytest.raises(JarpcParseError):
+            unpack_request(b'JRPF')
+
+    def test_response(self):
+        response = JarpcResponse(request_id='1', result={'size': 2}, attachments=[b'ab'])
+        unpacked = unpack_response(pack_response(response))
+        assert unpacked.data == response.data
+        assert [bytes(part) for part in unpacked.attachments] == [b'ab']
+
+    def test_response_malformed(self):
+        with pytest.raises(JarpcServerError):
+            unpack_response(b'JRPF')
+
+
+@pytest.mark.asyncio
+class TestManager:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_handle_frame(self, is_async):
+        dispatcher = JarpcDispatcher()
+        manager = AsyncJarpcManager(dispatcher) if is_async else JarpcManager(dispatcher)
+
+        @dispatcher.rpc_method
+        def upload(jarpc_request, name):
+            assert isinstance(jarpc_request.attachments[0], memoryview)
+            data = bytes(jarpc_request.attachments[0])
+            return JarpcAttachedResult(result={'name': name, 'size': len(data)}, attachments=[data[::-1]])
+
+        frame = pack_request(JarpcRequest(**REQUEST_KWARGS, attachments=[b'abc']))
+        response_frame = await manager.handle_frame(frame) if is_async else manager.handle_frame(frame)
+        response = unpack_response(response_frame)
+        assert response.request_id == REQUEST_KWARGS['id']
+        assert response.result == {'name': 'file.bin', 'size': 3}
+        assert [bytes(part) for part in response.attachments] == [b'cba']
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_handle_frame_malformed(self, is_async):
+        manager = AsyncJarpcManager(JarpcDispatcher()) if is_async else JarpcManager(JarpcDispatcher())
+        response_frame = await manager.handle_frame(b'JRPF') if is_async else manager.handle_frame(b'JRPF')
+        envelope, _ = unpack_frame(response_frame)
+        assert json.loads(envelope)['error']['code'] == JarpcParseError.code
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_handle_attached_result(self, is_async):
+        dispatcher = JarpcDispatcher()
+        manager = AsyncJarpcManager(dispatcher) if is_async else JarpcManager(dispatcher)
+        dispatcher.add_rpc_method(lambda name: JarpcAttachedResult(result=name, attachments=[b'x']), 'upload')
+
+        request_string = json.dumps(JarpcRequest(**REQUEST_KWARGS).data)
+        response = await manager.handle(request_string) if is_async else manager.handle(request_string)
+        assert is_frame(response)
+        assert unpack_response(response).result == 'file.bin'
+
+
+def test_client_round_trip():
+    dispatcher = JarpcDispatcher()
+    manager = JarpcManager(dispatcher)
+
+    @dispatcher.rpc_method
+    def reverse(jarpc_request):
+        return JarpcAttachedResult(result=None, attachments=[bytes(part)[::-1] for part in jarpc_request.attachments])
+
+    client = JarpcClient(transport=lambda request_string, request: manager.handle_frame(
+        pack_frame(request_string.encode(), request.attachments)))
+    result = client(method='reverse', params={}, attachments=[b'abc', b'de'])
+    assert isinstance(result, JarpcAttachedResult)
+    assert [bytes(part) for part in result.attachments] == [b'cba', b'ed']
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ..jarpc import HttpTransport, JarpcClient, JarpcDispatcher, JarpcManager, JarpcServerError, JarpcTimeout
+
+
+class JarpcHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.ports.add(self.client_address[1])
+        self.server.requests += 1
+        if self.server.requests in self.server.lost_responses:
+            # connection is lost after request is sent
+            self.close_connection = True
+            return
+        response = self.server.manager.handle(body)
+        if response is None:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            response = response.encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+        if self.server.drop_connections:
+            # close keep-alive connection without telling the client
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda value: value, 'echo')
+    dispatcher.add_rpc_method(lambda delay: time.sleep(delay), 'sleep')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), JarpcHandler)
+    server.manager = JarpcManager(dispatcher)
+    server.ports = set()
+    server.drop_connections = False
+    server.requests = 0
+    server.lost_responses = set()
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_transport(server, **kwargs):
+    return HttpTransport(url=f'http://127.0.0.1:{server.server_address[1]}/jsonrpc', **kwargs)
+
+
+class TestHttpTransport:
+
+    def test_keep_alive(self, server):
+        transport = make_transport(server)
+        client = JarpcClient(transport=transport)
+        for i in range(5):
+            assert client.echo(value=i) == i
+        assert len(server.ports) == 1
+        transport.close()
+
+    def test_notification(self, server):
+        client = JarpcClient(transport=make_transport(server))
+        assert client(method='echo', params={'value': 1}, rsvp=False) is None
+
+    def test_threads(self, server):
+        transport = make_transport(server, pool_size=2)
+        client = JarpcClient(transport=transport)
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(client.echo(value=i))) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == list(range(10))
+        assert len(server.ports) <= 2
+
+    def test_fail_fast(self, server):
+        transport = make_transport(server, pool_size=1, block=False)
+        client = JarpcClient(transport=transport)
+        thread = threading.Thread(target=lambda: client.sleep(delay=0.3))
+        thread.start()
+        time.sleep(0.1)
+        with pytest.raises(JarpcServerError) as e:
+            client.echo(value=1)
+        assert e.value.data == 'Connection pool is full'
+        thread.join()
+
+    def test_pool_timeout(self, server):
+        transport = make_transport(server, pool_size=1)
+        client = JarpcClient(transport=transport)
+        thread = threading.Thread(target=lambda: client.sleep(delay=0.5))
+        thread.start()
+        time.sleep(0.1)
+        with pytest.raises(JarpcTimeout):
+            client(method='echo', params={'value': 1}, ttl=0.1)
+        thread.join()
+
+    def test_timeout_from_ttl(self, server):
+        client = JarpcClient(transport=make_transport(server))
+        started = time.monotonic()
+        with pytest.raises(JarpcTimeout):
+            client(method='sleep', params={'delay': 1}, ttl=0.2)
+        assert time.monotonic() - started < 0.9
+
+    def test_expired(self, server):
+        client = JarpcClient(transport=make_transport(server))
+        with pytest.raises(JarpcTimeout):
+            client(method='echo', params={'value': 1}, ts=time.time() - 10, ttl=1)
+        assert not server.ports
+
+    def test_stale_connection(self, server):
+        server.drop_connections = True
+        client = JarpcClient(transport=make_transport(server))
+        for i in range(3):
+            assert client.echo(value=i) == i
+            # closed connection is dropped from pool before reuse
+            time.sleep(0.01)
+        assert len(server.ports) == 3
+        assert server.requests == 3
+
+    @pytest.mark.parametrize('idempotent, requests', [(False, 2), (True, 3)])
+    def test_lost_after_sending(self, server, idempotent, requests):
+        server.lost_responses = {2}
+        transport = make_transport(server, idempotent_methods={'echo'} if idempotent else ())
+        client = JarpcClient(transport=transport)
+        assert client.echo(value=1) == 1
+        if idempotent:
+            assert client.echo(value=2) == 2
+        else:
+            # server could have handled request, so it is not sent again
+            with pytest.raises(JarpcServerError):
+                client.echo(value=2)
+        assert server.requests == requests
+
+    def test_http_error(self, server):
+        transport = HttpTransport(url=f'http://127.0.0.1:{server.server_address[1]}/jsonrpc')
+        transport.path = '/missing'
+        server.RequestHandlerClass = type('NotFound', (JarpcHandler,), {'do_POST': lambda self: self.send_error(404)})
+        with pytest.raises(JarpcServerError):
+            JarpcClient(transport=transport).echo(value=1)
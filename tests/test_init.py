@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+from .. import jarpc
+
+
+def test_lazy_imports():
+    package = jarpc.__name__
+    code = f'import sys; import {package}; print(sorted(name for name in sys.modules if name.startswith("{package}.")))'
+    # directory containing top-level package
+    root = os.path.dirname(jarpc.__file__)
+    for _ in package.split('.'):
+        root = os.path.dirname(root)
+    modules = subprocess.run([sys.executable, '-c', code], cwd=root, check=True, capture_output=True,
+                             text=True).stdout
+    assert f"'{package}.client'" in modules
+    assert f"'{package}.stream'" not in modules
+    assert f"'{package}.shm'" not in modules
+
+    for name in jarpc.__all__:
+        assert getattr(jarpc, name) is not None
+    assert 'StreamTransport' in dir(jarpc)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from ..jarpc import (AdaptiveLimiter, AsyncAdaptiveLimiter, AsyncJarpcClient, AsyncLimitTransport, CircuitBreaker,
+                     JarpcClient, JarpcRejected, JarpcServerError, JarpcTimeout, JarpcValidationError, LimitTransport,
+                     RetryTransport)
+from ..jarpc import limit
+
+
+class Backend:
+    """Transport counting concurrent calls, fails methods from `failing`. """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.failing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self, request):
+        with self.lock:
+            self.in_flight -= 1
+        if request.method in self.failing:
+            error = self.failing_error().as_dict()
+            return json.dumps({'error': error, 'request_id': request.id, 'id': '1'})
+        return json.dumps({'result': request.method, 'request_id': request.id, 'id': '1'})
+
+    failing_error = JarpcServerError
+
+    def __call__(self, request_string, request, timeout=None):
+        self.enter()
+        time.sleep(self.delay)
+        return self.leave(request)
+
+
+class AsyncBackend(Backend):
+    async def __call__(self, request_string, request, timeout=None):
+        self.enter()
+        await asyncio.sleep(self.delay)
+        return self.leave(request)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limit, 'time', clock)
+    return clock
+
+
+class TestAdaptiveLimiter:
+
+    def test_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=3)
+        for _ in range(2):
+            limiter.acquire()
+        limiter.release(0.01)
+        limiter.release(0.01)
+        assert limiter.limit == 3
+        for _ in range(3):
+            limiter.acquire()
+        limiter.release(0.01)
+        assert limiter.limit == 3
+
+    def test_not_used_limit_is_not_increased(self):
+        limiter = AdaptiveLimiter(initial_limit=10)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(0.01)
+        assert limiter.limit == 10
+
+    def test_decrease(self, clock):
+        limiter = AdaptiveLimiter(initial_limit=10, backoff_ratio=0.5, min_limit=2, latency_threshold=1.0)
+        for _ in range(3):
+            limiter.acquire()
+        clock.now += 0.01
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == 5
+        # calls sent before the decrease don't decrease limit again
+        limiter.release(0.01, failed=True)
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == 5
+        limiter.acquire()
+        clock.now += 2.0
+        limiter.release(2.0)
+        assert limiter.limit == 2
+        limiter.acquire()
+        clock.now += 0.01
+        limiter.release(0.01, failed=True)
+        assert limiter.limit == 2
+        assert limiter.stats == {'limit': 2, 'in_flight': 0, 'accepted': 5, 'rejected': 0, 'drops': 3}
+
+    def test_baseline_latency(self, clock):
+        limiter = AdaptiveLimiter(initial_limit=10, backoff_ratio=0.5)
+
+        def call(latency):
+            limiter.acquire()
+            clock.now += latency
+            limiter.release(latency)
+            return limiter.limit
+
+        assert call(0.01) == 10
+        assert call(0.015) == 10
+        assert limiter.baseline_latency == 0.01
+        # over twice as slow as the fastest call in window
+        assert call(0.03) == 5
+        clock.now += 11
+        # baseline is forgotten, then set by slower calls
+        assert limiter.baseline_latency is None
+        assert call(0.03) == 5
+        assert call(0.05) == 5
+        assert limiter.baseline_latency == 0.03
+
+    def test_latency_ignored(self, clock):
+        limiter = AdaptiveLimiter(initial_limit=10, latency_tolerance=None)
+        for latency in (0.01, 1.0):
+            limiter.acquire()
+            clock.now += latency
+            limiter.release(latency)
+        assert limiter.limit == 10
+
+    def test_fail_fast(self):
+        limiter = AdaptiveLimiter(initial_limit=1, block=False)
+        limiter.acquire()
+        with pytest.raises(JarpcRejected):
+            limiter.acquire()
+        assert limiter.rejected == 1
+
+    def test_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        limiter.acquire()
+        with pytest.raises(JarpcTimeout):
+            limiter.acquire(timeout=0.05)
+
+    @pytest.mark.asyncio
+    @pytest.mark.asyncio
+    async def test_async_timeout(self):
+        limiter = AsyncAdaptiveLimiter(initial_limit=1)
+        await limiter.acquire()
+        with pytest.raises(JarpcTimeout):
+            await limiter.acquire(timeout=0.05)
+        limiter.release(0.01)
+        assert limiter.in_flight == 0
+        await limiter.acquire(timeout=0.05)
+
+
+class TestCircuitBreaker:
+
+    def test_open_and_close(self):
+        breaker = CircuitBreaker(failure_threshold=0.5, min_calls=4, window_size=4, open_duration=0.05)
+        for failed in (False, True, False):
+            assert breaker.allow()
+            breaker.record(failed)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+        time.sleep(0.06)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+        # one probe at a time
+        assert not breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        time.sleep(0.06)
+        assert breaker.allow()
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.stats == {'state': 'closed', 'calls': 0, 'failures': 0, 'rejected': 2, 'opened': 2}
+
+    def test_window(self):
+        breaker = CircuitBreaker(failure_threshold=0.5, min_calls=4, window_size=4)
+        for failed in (True, False, False, False, False, True):
+            assert breaker.allow()
+            breaker.record(failed)
+        assert breaker.stats['failures'] == 1
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_cancelled_probe(self):
+        breaker = CircuitBreaker(min_calls=1, open_duration=0)
+        breaker.record(True)
+        assert breaker.allow()
+        breaker.record(None)
+        assert breaker.allow()
+
+
+class TestLimitTransport:
+
+    @pytest.mark.asyncio
+    async def test_async_concurrency(self):
+        backend = AsyncBackend(delay=0.02)
+        transport = AsyncLimitTransport(backend, limiter=AsyncAdaptiveLimiter(initial_limit=2, max_limit=2))
+        client = AsyncJarpcClient(transport)
+        results = await asyncio.gather(*(client.get() for _ in range(10)))
+        assert results == ['get'] * 10
+        assert backend.max_in_flight == 2
+        assert transport.stats['limiter']['in_flight'] == 0
+
+    @pytest.mark.asyncio
+    async def test_async_cancel(self):
+        backend = AsyncBackend(delay=1.0)
+        transport = AsyncLimitTransport(backend, limiter=AsyncAdaptiveLimiter(initial_limit=1))
+        client = AsyncJarpcClient(transport)
+        tasks = [asyncio.ensure_future(client.get()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert transport.limiter.in_flight == 0
+        assert transport.limiter.limit == 1
+
+    @pytest.mark.asyncio
+    async def test_async_breaker(self):
+        backend = AsyncBackend()
+        backend.failing.add('broken')
+        transport = AsyncLimitTransport(backend, breaker_factory=lambda: CircuitBreaker(min_calls=3))
+        client = AsyncJarpcClient(transport)
+        for _ in range(3):
+            with pytest.raises(JarpcServerError):
+                await client.broken()
+        with pytest.raises(JarpcRejected) as e:
+            await client.broken()
+        assert 'Circuit breaker' in e.value.data
+        assert backend.calls == 3
+        assert await client.working() == 'working'
+        stats = transport.stats['breakers']
+        assert stats['broken']['state'] == 'open'
+        assert stats['working']['state'] == 'closed'
+
+    @pytest.mark.asyncio
+    async def test_other_errors_are_not_failures(self):
+        backend = AsyncBackend()
+        backend.failing.add('invalid')
+        backend.failing_error = JarpcValidationError
+        transport = AsyncLimitTransport(backend, breaker_factory=lambda: CircuitBreaker(min_calls=1))
+        client = AsyncJarpcClient(transport)
+        for _ in range(3):
+            with pytest.raises(JarpcValidationError):
+                await client.invalid()
+        assert transport.breakers['invalid'].state == 'closed'
+        assert transport.limiter.drops == 0
+
+    def test_threads(self):
+        backend = Backend(delay=0.02)
+        transport = LimitTransport(backend, limiter=AdaptiveLimiter(initial_limit=3, max_limit=3))
+        client = JarpcClient(transport)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.get())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ['get'] * 10
+        assert backend.max_in_flight == 3
+
+    def test_notification(self):
+        backend = Backend()
+        transport = LimitTransport(backend)
+        client = JarpcClient(transport)
+        assert client(method='notify', params={}, rsvp=False) is None
+        assert transport.limiter.drops == 0
+
+    def test_rejection_is_not_retried(self):
+        backend = Backend()
+        backend.failing.add('broken')
+        limit_transport = LimitTransport(backend, breaker_factory=lambda: CircuitBreaker(min_calls=1))
+        client = JarpcClient(RetryTransport(limit_transport, idempotent_methods={'broken'}, max_attempts=3))
+        # breaker opens on the first failure, and its rejection stops retries
+        with pytest.raises(JarpcRejected):
+            client.broken()
+        assert backend.calls == 1
+        assert limit_transport.breakers['broken'].stats['rejected'] == 1
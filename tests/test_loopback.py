@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from ..jarpc import (AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport, JarpcAttachedResult, JarpcClient,
+                     JarpcDispatcher, JarpcInvalidParams, JarpcManager, JarpcMethodNotFound, JarpcTimeout,
+                     JarpcValidationError, LoopbackTransport)
+
+
+def make_client(is_async, dispatcher, context=None, copy=False):
+    if is_async:
+        return AsyncJarpcClient(transport=AsyncLoopbackTransport(AsyncJarpcManager(dispatcher, context), copy=copy))
+    return JarpcClient(transport=LoopbackTransport(JarpcManager(dispatcher, context), copy=copy))
+
+
+async def call(client, *args, **kwargs):
+    result = client(*args, **kwargs)
+    if isinstance(client, AsyncJarpcClient):
+        result = await result
+    return result
+
+
+@pytest.mark.asyncio
+class TestLoopbackTransport:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_result(self, is_async):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(lambda app, a, b: (app, a + b), 'add')
+        client = make_client(is_async, dispatcher, context={'app': 'some app'})
+
+        assert await call(client, method='add', params={'a': 1, 'b': 2}) == ('some app', 3)
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_no_serialization(self, is_async):
+        def dumps(data):
+            assert False
+
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(lambda: 42, 'answer')
+        manager = AsyncJarpcManager(dispatcher, dumps=dumps) if is_async else JarpcManager(dispatcher, dumps=dumps)
+        transport = AsyncLoopbackTransport(manager) if is_async else LoopbackTransport(manager)
+        client = AsyncJarpcClient(transport, dumps=dumps) if is_async else JarpcClient(transport, dumps=dumps)
+
+        assert await call(client, method='answer', params={}) == 42
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.parametrize('method, params, error_class', [
+        ('missing', {}, JarpcMethodNotFound),
+        ('validate', {}, JarpcInvalidParams),
+        ('validate', {'value': 1}, JarpcValidationError),
+    ])
+    async def test_error(self, is_async, method, params, error_class):
+        def validate(value):
+            raise JarpcValidationError('bad value')
+
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(validate)
+        client = make_client(is_async, dispatcher)
+
+        with pytest.raises(error_class):
+            await call(client, method=method, params=params)
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_expired(self, is_async):
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(lambda: 42, 'answer')
+        dispatcher.add_rpc_method(lambda: time.sleep(0.02), 'slow')
+        client = make_client(is_async, dispatcher)
+
+        # client fails expired request without sending
+        with pytest.raises(JarpcTimeout):
+            await call(client, method='answer', params={}, ts=time.time() - 10, ttl=1.0)
+
+        # manager drops request expired while handled
+        with pytest.raises(JarpcTimeout):
+            await call(client, method='slow', params={}, ttl=0.01)
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_notification(self, is_async):
+        calls = []
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(lambda value: calls.append(value), 'notify')
+        client = make_client(is_async, dispatcher)
+
+        assert await call(client, method='notify', params={'value': 1}, rsvp=False) is None
+        assert calls == [1]
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.parametrize('copy', [False, True])
+    async def test_copy(self, is_async, copy):
+        storage = {}
+
+        def store(items):
+            items.append('handler')
+            storage['items'] = items
+            return items
+
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(store)
+        client = make_client(is_async, dispatcher, copy=copy)
+
+        items = ['caller']
+        result = await call(client, method='store', params={'items': items})
+        assert result == ['caller', 'handler']
+        assert (items is storage['items']) is not copy
+        assert (result is storage['items']) is not copy
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_attachments(self, is_async):
+        dispatcher = JarpcDispatcher()
+
+        @dispatcher.rpc_method
+        def reverse(jarpc_request):
+            return JarpcAttachedResult(result=None, attachments=[bytes(jarpc_request.attachments[0])[::-1]])
+
+        client = make_client(is_async, dispatcher, copy=True)
+        result = await call(client, method='reverse', params={}, attachments=[b'abc'])
+        assert bytes(result.attachments[0]) == b'cba'
@@ -7,7 +7,7 @@ from datetime import datetime, timezone
 
 import pytest
 
-from ..jarpc import AsyncJarpcManager, JarpcDispatcher, JarpcManager, JarpcRequest
+from ..jarpc import CANCEL_METHOD, AsyncJarpcManager, JarpcDispatcher, JarpcManager, JarpcRequest
 from ..jarpc.manager import check_function_call
 
 
@@ -311,6 +311,16 @@ class TestGetResponse:
         assert response is not None
         assert response.result == 'return value'
 
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_dict_dispatcher(self, is_async):
+        # plain dict has no `get_async` of `JarpcDispatcher`
+        dispatcher = {'method': lambda param: param}
+        manager = AsyncJarpcManager(dispatcher) if is_async else JarpcManager(dispatcher)
+        response = manager.get_response(json.dumps(self.basic_request))
+        if is_async:
+            response = await response
+        assert response.result == 'value'
+
     async def test_task_cancellation(self):
         dispatcher = JarpcDispatcher()
         manager = AsyncJarpcManager(dispatcher)
@@ -326,6 +336,33 @@ class TestGetResponse:
         with pytest.raises(asyncio.CancelledError):
             await task
 
+    async def test_remote_cancellation(self):
+        dispatcher = JarpcDispatcher()
+        manager = AsyncJarpcManager(dispatcher)
+        log = []
+
+        @dispatcher.rpc_method
+        async def method(param):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                log.append('cancelled')
+                raise
+
+        task = asyncio.ensure_future(manager.get_response(json.dumps(self.basic_request)))
+        await asyncio.sleep(0.01)
+        assert set(manager.in_flight) == {self.basic_request['id']}
+        cancel_request = {**self.basic_request, 'method': CANCEL_METHOD, 'id': '2',
+                          'params': {'request_id': self.basic_request['id']}}
+        response = await manager.get_response(json.dumps(cancel_request))
+        assert response.result is True
+        assert await task is None
+        assert log == ['cancelled']
+        assert manager.in_flight == {}
+
+        response = await manager.get_response(json.dumps(cancel_request))
+        assert response.result is False
+
 
 @pytest.mark.asyncio
 class TestCallMethod:
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from ..jarpc import AsyncJarpcClient, AsyncOutboxTransport, JarpcServerError, JarpcTimeout
+from ..jarpc.outbox import BLOCK, ERROR
+
+
+class Backend:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request_string, request, timeout=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if request.params.get('fail'):
+                raise ConnectionResetError
+            self.received.append(request.params)
+        finally:
+            self.in_flight -= 1
+        if request.rsvp:
+            return f'{{"result": "ok", "request_id": "{request.id}", "id": "1"}}'
+
+
+async def notify(client, **params):
+    return await client(method='notify', params=params, rsvp=False)
+
+
+@pytest.mark.asyncio
+class TestAsyncOutboxTransport:
+
+    async def test_background(self):
+        backend = Backend(delay=0.05)
+        outbox = AsyncOutboxTransport(backend)
+        client = AsyncJarpcClient(outbox)
+        started = time.monotonic()
+        for i in range(5):
+            assert await notify(client, i=i) is None
+        assert time.monotonic() - started < 0.05
+        assert await client.call() == 'ok'
+        await outbox.close()
+        assert sorted(params['i'] for params in backend.received if 'i' in params) == list(range(5))
+        assert outbox.stats['sent'] == 5
+
+    async def test_batches(self):
+        backend = Backend(delay=0.01)
+        outbox = AsyncOutboxTransport(backend, batch_size=3)
+        client = AsyncJarpcClient(outbox)
+        for i in range(10):
+            await notify(client, i=i)
+        await outbox.flush()
+        assert sorted(params['i'] for params in backend.received) == list(range(10))
+        assert backend.max_in_flight == 3
+
+    async def test_drop_oldest(self):
+        backend = Backend()
+        outbox = AsyncOutboxTransport(backend, max_size=3)
+        client = AsyncJarpcClient(outbox)
+        for i in range(5):
+            await notify(client, i=i)
+        await outbox.close()
+        assert backend.received == [{'i': 2}, {'i': 3}, {'i': 4}]
+        assert outbox.stats['dropped'] == 2
+
+    async def test_error(self):
+        outbox = AsyncOutboxTransport(Backend(), max_size=1, overflow=ERROR)
+        client = AsyncJarpcClient(outbox)
+        await notify(client, i=0)
+        with pytest.raises(JarpcServerError):
+            await notify(client, i=1)
+        await outbox.close()
+
+    async def test_block(self):
+        backend = Backend(delay=0.02)
+        outbox = AsyncOutboxTransport(backend, max_size=1, batch_size=1, overflow=BLOCK)
+        client = AsyncJarpcClient(outbox)
+        for i in range(4):
+            await notify(client, i=i)
+        await outbox.close()
+        assert backend.received == [{'i': i} for i in range(4)]
+
+    async def test_block_timeout(self):
+        backend = Backend(delay=0.2)
+        outbox = AsyncOutboxTransport(backend, max_size=1, batch_size=1, overflow=BLOCK)
+        client = AsyncJarpcClient(outbox)
+        await notify(client, i=0)
+        await asyncio.sleep(0)
+        await notify(client, i=1)
+        with pytest.raises(JarpcTimeout):
+            await client(method='notify', params={'i': 2}, rsvp=False, ttl=0.05)
+        await outbox.close()
+        assert backend.received == [{'i': 0}, {'i': 1}]
+
+    async def test_collapse(self):
+        backend = Backend()
+        outbox = AsyncOutboxTransport(backend, collapse_key=lambda method, params: params.get('order'))
+        client = AsyncJarpcClient(outbox)
+        await notify(client, order=1, status='new')
+        await notify(client, order=2, status='new')
+        await notify(client, order=1, status='cooking')
+        await notify(client, status='no key')
+        await outbox.close()
+        assert backend.received == [{'order': 1, 'status': 'cooking'}, {'order': 2, 'status': 'new'},
+                                    {'status': 'no key'}]
+        assert outbox.stats['collapsed'] == 1
+
+    async def test_expired(self):
+        backend = Backend()
+        outbox = AsyncOutboxTransport(backend, flush_interval=0.05)
+        client = AsyncJarpcClient(outbox)
+        await client(method='notify', params={'i': 0}, rsvp=False, ttl=0.01)
+        await client(method='notify', params={'i': 1}, rsvp=False, ttl=10)
+        await asyncio.sleep(0.1)
+        await outbox.close()
+        assert backend.received == [{'i': 1}]
+        assert outbox.stats['expired'] == 1
+
+    async def test_failed(self):
+        backend = Backend()
+        outbox = AsyncOutboxTransport(backend)
+        client = AsyncJarpcClient(outbox)
+        await notify(client, fail=True)
+        await notify(client, i=1)
+        await outbox.close()
+        assert outbox.stats['failed'] == 1
+        assert outbox.stats['sent'] == 1
+
+    async def test_closed(self):
+        outbox = AsyncOutboxTransport(Backend())
+        await outbox.close()
+        with pytest.raises(JarpcServerError):
+            await notify(AsyncJarpcClient(outbox), i=0)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from ..jarpc import AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport, JarpcDispatcher, JarpcRequest, \
+    PriorityScheduler
+
+
+class Kitchen:
+    def __init__(self):
+        self.cooked = []
+        self.release = asyncio.Event()
+        self.dispatcher = JarpcDispatcher()
+        self.dispatcher.add_rpc_method(self.block)
+        self.dispatcher.add_rpc_method(self.cook)
+        self.dispatcher.add_rpc_method(self.cook, 'report', priority='low')
+
+    async def block(self):
+        await self.release.wait()
+
+    async def cook(self, name):
+        self.cooked.append(name)
+        await asyncio.sleep(0)
+        return name
+
+
+def make_request(method='cook', name='salad', **kwargs):
+    return JarpcRequest(method=method, params={'name': name} if method != 'block' else {}, **kwargs)
+
+
+@pytest.mark.asyncio
+class TestPriorityScheduler:
+
+    async def test_weights(self):
+        kitchen = Kitchen()
+        scheduler = PriorityScheduler(concurrency=1)
+        manager = AsyncJarpcManager(kitchen.dispatcher, scheduler=scheduler)
+        blocker = asyncio.ensure_future(manager.get_request_response(make_request('block')))
+        await asyncio.sleep(0)
+        calls = [manager.get_request_response(make_request(name=f'low {i}', priority='low')) for i in range(9)]
+        calls += [manager.get_request_response(make_request(name=f'high {i}', priority='high')) for i in range(9)]
+        tasks = [asyncio.ensure_future(call) for call in calls]
+        await asyncio.sleep(0.01)
+        assert scheduler.stats['lanes']['low']['depth'] == 9
+        assert scheduler.stats['lanes']['high']['depth'] == 9
+
+        kitchen.release.set()
+        responses = await asyncio.gather(blocker, *tasks)
+        assert all(response.success for response in responses)
+        assert sum(name.startswith('high') for name in kitchen.cooked[:9]) == 8
+        assert kitchen.cooked[-1].startswith('low')
+        stats = scheduler.stats
+        assert stats['active'] == 0
+        assert stats['lanes']['high']['admitted'] == 9
+        assert stats['lanes']['normal']['admitted'] == 1
+        assert 0 < stats['lanes']['high']['mean_wait_time'] < stats['lanes']['low']['max_wait_time']
+
+    async def test_get_lane(self):
+        dispatcher = Kitchen().dispatcher
+        scheduler = PriorityScheduler()
+        assert scheduler.get_lane(make_request(), dispatcher) == 'normal'
+        assert scheduler.get_lane(make_request(priority='high'), dispatcher) == 'high'
+        assert scheduler.get_lane(make_request(priority='unknown'), dispatcher) == 'normal'
+        assert scheduler.get_lane(make_request('report'), dispatcher) == 'low'
+        assert scheduler.get_lane(make_request('report', priority='high'), dispatcher) == 'high'
+        assert scheduler.get_lane(make_request(rsvp=False), dispatcher) == 'low'
+        with pytest.raises(ValueError):
+            PriorityScheduler(lanes=[('fast', 2), ('slow', 1)])
+
+    async def test_expired_in_queue(self):
+        kitchen = Kitchen()
+        manager = AsyncJarpcManager(kitchen.dispatcher, scheduler=PriorityScheduler(concurrency=1))
+        blocker = asyncio.ensure_future(manager.get_request_response(make_request('block')))
+        await asyncio.sleep(0)
+        task = asyncio.ensure_future(manager.get_request_response(make_request(ttl=0.01)))
+        await asyncio.sleep(0.02)
+        kitchen.release.set()
+        assert await task is None
+        await blocker
+        assert kitchen.cooked == []
+
+    async def test_cancel_waiting(self):
+        kitchen = Kitchen()
+        scheduler = PriorityScheduler(concurrency=1)
+        manager = AsyncJarpcManager(kitchen.dispatcher, scheduler=scheduler)
+        blocker = asyncio.ensure_future(manager.get_request_response(make_request('block')))
+        await asyncio.sleep(0)
+        task = asyncio.ensure_future(manager.get_request_response(make_request()))
+        await asyncio.sleep(0)
+        task.cancel()
+        kitchen.release.set()
+        await blocker
+        assert scheduler.stats['active'] == 0
+        assert scheduler.stats['lanes']['normal']['depth'] == 0
+        assert (await manager.get_request_response(make_request())).result == 'salad'
+
+    async def test_remote_cancel_waiting(self):
+        kitchen = Kitchen()
+        scheduler = PriorityScheduler(concurrency=1)
+        manager = AsyncJarpcManager(kitchen.dispatcher, scheduler=scheduler)
+        blocker = asyncio.ensure_future(manager.get_request_response(make_request('block')))
+        await asyncio.sleep(0)
+        request = make_request()
+        task = asyncio.ensure_future(manager.get_request_response(request))
+        await asyncio.sleep(0)
+        assert scheduler.stats['lanes']['normal']['depth'] == 1
+        assert manager.cancel(request.id)
+        assert await task is None
+        kitchen.release.set()
+        await blocker
+        assert kitchen.cooked == []
+        assert manager.in_flight == {}
+        assert scheduler.stats['active'] == 0
+
+    async def test_client_priority(self):
+        kitchen = Kitchen()
+        scheduler = PriorityScheduler()
+        client = AsyncJarpcClient(AsyncLoopbackTransport(AsyncJarpcManager(kitchen.dispatcher, scheduler=scheduler)))
+        assert await client(method='cook', params={'name': 'salad'}, priority='high') == 'salad'
+        await client(method='cook', params={'name': 'soup'}, rsvp=False)
+        assert scheduler.stats['lanes']['high']['admitted'] == 1
+        assert scheduler.stats['lanes']['low']['admitted'] == 1
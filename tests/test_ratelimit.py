@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ..jarpc import (AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport, JarpcDispatcher, JarpcManager,
+                     JarpcRequest, JarpcTooManyRequests, RateLimiter)
+from ..jarpc import ratelimit
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def make_dispatcher():
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda name: name, 'cook')
+    dispatcher.add_rpc_method(lambda: 'report', 'export_report')
+    return dispatcher
+
+
+def by_params(request):
+    return request.params.pop('caller', None)
+
+
+def make_request(method='cook', caller='alice', rsvp=True):
+    params = {'name': 'salad'} if method == 'cook' else {}
+    return JarpcRequest(method=method, params={'caller': caller, **params}, rsvp=rsvp)
+
+
+class TestRateLimiter:
+
+    @pytest.mark.parametrize('kwargs', [{'rate': 0}, {'rate': -1}, {'rate': 1, 'burst': 0},
+                                        {'method_limits': {'cook': (0, 1)}}, {'method_limits': {'cook': (None, 1)}}])
+    def test_invalid_limits(self, kwargs):
+        with pytest.raises(ValueError):
+            RateLimiter(key=by_params, **kwargs)
+
+    def test_method_limit_default_burst(self, clock):
+        limiter = RateLimiter(key=by_params, method_limits={'cook': (2, None), 'serve': (0.5, None)})
+        assert [limiter.acquire('alice', 'cook') for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+        assert limiter.acquire('alice', 'serve') == 0
+        assert limiter.acquire('alice', 'serve') == pytest.approx(2)
+
+    def test_burst_and_refill(self, clock):
+        limiter = RateLimiter(key=by_params, rate=2, burst=3)
+        assert [limiter.acquire('alice', 'cook') for _ in range(3)] == [0, 0, 0]
+        assert limiter.acquire('alice', 'cook') == pytest.approx(0.5)
+        assert limiter.acquire('bob', 'cook') == 0
+        clock.now += 0.25
+        assert limiter.acquire('alice', 'cook') == pytest.approx(0.25)
+        clock.now += 0.25
+        assert limiter.acquire('alice', 'cook') == 0
+        # bob's bucket is full again by now
+        assert limiter.stats == {'buckets': 1, 'allowed': 5, 'rejected': 2}
+
+    def test_method_limits(self, clock):
+        limiter = RateLimiter(key=by_params, rate=10, method_limits={'export_report': (0.1, 1)})
+        assert limiter.acquire('alice', 'export_report') == 0
+        assert limiter.acquire('alice', 'export_report') == pytest.approx(10)
+        assert limiter.acquire('bob', 'export_report') == 0
+        assert [limiter.acquire('alice', 'cook') for _ in range(9)] == [0] * 9
+        assert limiter.acquire('alice', 'cook') > 0
+
+        only_methods = RateLimiter(key=by_params, method_limits={'export_report': (0.1, 1)})
+        assert all(only_methods.acquire('alice', 'cook') == 0 for _ in range(100))
+        assert only_methods.stats['buckets'] == 0
+
+    def test_eviction(self, clock):
+        limiter = RateLimiter(key=by_params, rate=1, burst=2)
+        for caller in range(100):
+            limiter.acquire(caller, 'cook')
+        assert limiter.stats['buckets'] == 100
+        clock.now += 0.5
+        limiter.acquire('alice', 'cook')
+        assert limiter.stats['buckets'] == 101
+        clock.now += 0.6
+        limiter.acquire('bob', 'cook')
+        assert limiter.stats['buckets'] == 2  # alice is not refilled yet
+
+        # evicted bucket is recreated full
+        clock.now += 10
+        assert [limiter.acquire('alice', 'cook') for _ in range(3)][-1] > 0
+
+
+@pytest.mark.asyncio
+class TestManagerRateLimit:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_reject(self, clock, is_async):
+        limiter = RateLimiter(key=by_params, rate=1, burst=2)
+        manager_class = AsyncJarpcManager if is_async else JarpcManager
+        manager = manager_class(make_dispatcher(), rate_limiter=limiter)
+
+        async def call(request):
+            response = manager.get_request_response(request)
+            return await response if is_async else response
+
+        assert (await call(make_request())).result == 'salad'
+        assert (await call(make_request())).result == 'salad'
+        response = await call(make_request())
+        assert response.error == {'code': JarpcTooManyRequests.code, 'message': JarpcTooManyRequests.message,
+                                  'data': {'retry_after': 1.0}}
+        assert await call(make_request(rsvp=False)) is None
+        # limit is checked before method lookup
+        assert (await call(make_request(method='missing'))).error['code'] == JarpcTooManyRequests.code
+        assert (await call(make_request(caller='bob'))).result == 'salad'
+        assert (await call(make_request(caller=None))).result == 'salad'
+        assert limiter.stats['rejected'] == 3
+
+        clock.now += 1
+        assert (await call(make_request())).result == 'salad'
+
+    async def test_client(self, clock):
+        limiter = RateLimiter(key=lambda request: 'kitchen', method_limits={'export_report': (0.5, 1)})
+        client = AsyncJarpcClient(AsyncLoopbackTransport(AsyncJarpcManager(make_dispatcher(), rate_limiter=limiter)))
+        assert await client.export_report() == 'report'
+        with pytest.raises(JarpcTooManyRequests) as e:
+            await client.export_report()
+        assert e.value.retry_after == 2.0
+        assert await client.cook(name='soup') == 'soup'
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from ..jarpc import (AsyncJarpcClient, AsyncRetryTransport, JarpcClient, JarpcExternalServiceUnavailable,
+                     JarpcServerError, JarpcTimeout, JarpcValidationError, RetryBudget, RetryTransport)
+from ..jarpc.retry import LatencyWindow
+
+
+def make_response(request, error_class=None, result='ok'):
+    if error_class is None:
+        return json.dumps({'result': result, 'request_id': request.id, 'id': '1'})
+    return json.dumps({'error': error_class().as_dict(), 'request_id': request.id, 'id': '1'})
+
+
+class ScriptedTransport:
+    """Transport answering attempts by script: (delay, error class or exception or None). """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def next_step(self, request):
+        with self.lock:
+            self.requests.append(request)
+            attempt = len(self.requests)
+            return self.script[min(attempt, len(self.script)) - 1], attempt
+
+    @staticmethod
+    def make_result(step, attempt, request):
+        _, error = step
+        if isinstance(error, Exception):
+            raise error
+        return make_response(request, error, result=attempt)
+
+    def __call__(self, request_string, request, timeout=None):
+        step, attempt = self.next_step(request)
+        if timeout is not None and step[0] > timeout:
+            time.sleep(timeout)
+            raise JarpcTimeout
+        time.sleep(step[0])
+        return self.make_result(step, attempt, request)
+
+
+class AsyncScriptedTransport(ScriptedTransport):
+    async def __call__(self, request_string, request, timeout=None):
+        step, attempt = self.next_step(request)
+        await asyncio.sleep(step[0])
+        return self.make_result(step, attempt, request)
+
+
+def make_client(is_async, *script, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    if is_async:
+        transport = AsyncScriptedTransport(*script)
+        return AsyncJarpcClient(AsyncRetryTransport(transport, **kwargs)), transport
+    transport = ScriptedTransport(*script)
+    return JarpcClient(RetryTransport(transport, **kwargs)), transport
+
+
+async def call(client, **kwargs):
+    result = client(**kwargs)
+    if isinstance(client, AsyncJarpcClient):
+        result = await result
+    return result
+
+
+@pytest.mark.asyncio
+class TestRetryTransport:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    @pytest.mark.parametrize('error', [JarpcServerError, JarpcExternalServiceUnavailable, ConnectionResetError()])
+    async def test_retry(self, is_async, error):
+        client, transport = make_client(is_async, (0, error), (0, error), (0, None), idempotent_methods={'get'})
+        assert await call(client, method='get', params={}) == 3
+        assert len({request.id for request in transport.requests}) == 1
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_max_attempts(self, is_async):
+        client, transport = make_client(is_async, (0, JarpcServerError), idempotent_methods={'get'}, max_attempts=2)
+        with pytest.raises(JarpcServerError):
+            await call(client, method='get', params={})
+        assert len(transport.requests) == 2
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_not_idempotent(self, is_async):
+        client, transport = make_client(is_async, (0, JarpcServerError), (0, None), idempotent_methods={'get'})
+        with pytest.raises(JarpcServerError):
+            await call(client, method='post', params={})
+        assert await call(client, method='post', params={}, idempotent=True) == 2
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_notification(self, is_async):
+        client, transport = make_client(is_async, (0, JarpcServerError), idempotent_methods={'get'})
+        await call(client, method='get', params={}, rsvp=False)
+        assert len(transport.requests) == 1
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_not_retryable(self, is_async):
+        client, transport = make_client(is_async, (0, JarpcValidationError), (0, None), idempotent_methods={'get'})
+        with pytest.raises(JarpcValidationError):
+            await call(client, method='get', params={})
+        assert len(transport.requests) == 1
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_budget(self, is_async):
+        budget = RetryBudget(ratio=0.5, min_retries_per_second=0)
+        client, transport = make_client(is_async, (0, JarpcServerError), idempotent_methods={'get'}, budget=budget)
+        for _ in range(4):
+            with pytest.raises(JarpcServerError):
+                await call(client, method='get', params={})
+        # 4 calls allow 2 retries
+        assert len(transport.requests) == 6
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_deadline(self, is_async):
+        client, transport = make_client(is_async, (0, JarpcServerError), idempotent_methods={'get'}, backoff=10.0,
+                                        max_backoff=10.0, max_attempts=100)
+        started = time.monotonic()
+        with pytest.raises(JarpcServerError):
+            await call(client, method='get', params={}, ttl=0.3)
+        assert time.monotonic() - started < 0.3
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_timeout(self, is_async):
+        client, transport = make_client(is_async, (1.0, None), idempotent_methods={'get'})
+        started = time.monotonic()
+        with pytest.raises(JarpcTimeout):
+            await call(client, method='get', params={}, ttl=0.2)
+        assert time.monotonic() - started < 0.8
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_hedge(self, is_async):
+        client, transport = make_client(is_async, (1.0, None), (0, None), idempotent_methods={'get'},
+                                        hedge_delay=0.05)
+        started = time.monotonic()
+        assert await call(client, method='get', params={}) == 2
+        assert time.monotonic() - started < 0.8
+        assert transport.requests[0] is transport.requests[1]
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_hedge_not_needed(self, is_async):
+        client, transport = make_client(is_async, (0, None), idempotent_methods={'get'}, hedge_delay=0.5)
+        assert await call(client, method='get', params={}) == 1
+        assert len(transport.requests) == 1
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_hedge_percentile(self, is_async):
+        client, transport = make_client(is_async, (0, None), idempotent_methods={'get'}, hedge_percentile=0.95,
+                                        min_hedge_samples=5)
+        assert client._transport._get_hedge_delay() is None
+        for _ in range(5):
+            await call(client, method='get', params={})
+        assert client._transport._get_hedge_delay() is not None
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.1, min_retries_per_second=0.1, ttl=10)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_latency_window():
+    window = LatencyWindow(size=100)
+    assert window.percentile(0.95) is None
+    for i in range(200):
+        window.add(i)
+    assert len(window) == 100
+    assert window.percentile(0.5) == 150
+    assert window.percentile(1.0) == 199
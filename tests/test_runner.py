@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from ..jarpc import AsyncJarpcManager, JarpcClient, JarpcDispatcher, JarpcServerError
+from ..jarpc.runner import PreforkRunner
+from ..jarpc.stream import StreamTransport
+
+dispatcher = JarpcDispatcher()
+dispatcher.add_rpc_method(os.getpid, 'getpid')
+
+
+def run_master(runner, stats_queue):
+    # child of master which is not a worker
+    other = os.fork()
+    if other == 0:
+        os._exit(3)
+    runner.run()
+    stats_queue.put(runner.stats())
+    _, status = os.waitpid(other, 0)
+    stats_queue.put(status)
+
+
+def get_pids(port, connections=20):
+    pids = set()
+    for _ in range(connections):
+        transport = StreamTransport(host='127.0.0.1', port=port, connect_timeout=1.0)
+        pids.add(JarpcClient(transport=transport)(method='getpid', params={}, timeout=5.0))
+        transport.close()
+    return pids
+
+
+def wait_for_pids(port, expected, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pids = get_pids(port)
+        except JarpcServerError:
+            pids = set()
+        if expected(pids) or time.monotonic() > deadline:
+            return pids
+        time.sleep(0.1)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_prefork_runner():
+    context = multiprocessing.get_context('fork')
+    runner = PreforkRunner(lambda: AsyncJarpcManager(dispatcher), workers=2, stats_interval=0.1, drain_timeout=5.0)
+    runner.bind()
+    stats_queue = context.Queue()
+    master = context.Process(target=run_master, args=(runner, stats_queue))
+    master.start()
+    try:
+        pids = wait_for_pids(runner.port, lambda pids: len(pids) == 2)
+        # connections are balanced between worker processes
+        assert len(pids) == 2
+        assert master.pid not in pids
+
+        os.kill(master.pid, signal.SIGHUP)
+        new_pids = wait_for_pids(runner.port, lambda new_pids: new_pids and not new_pids & pids)
+        assert new_pids and not new_pids & pids
+
+        os.kill(master.pid, signal.SIGTERM)
+        stats = stats_queue.get(timeout=10.0)
+        # runner doesn't reap other children
+        assert os.WEXITSTATUS(stats_queue.get(timeout=10.0)) == 3
+        master.join(timeout=10.0)
+        assert master.exitcode == 0
+        assert stats['workers'] == 0
+        assert stats['handled'] >= 40
+    finally:
+        if master.is_alive():
+            master.kill()
+        runner._placeholder.close()
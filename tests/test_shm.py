@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import shared_memory
+
+import pytest
+
+from ..jarpc import (AsyncJarpcClient, AsyncJarpcManager, JarpcAttachedResult, JarpcClient, JarpcDispatcher,
+                     JarpcServerError, pack_frame)
+from ..jarpc.shm import AsyncShmStreamTransport, SharedMemoryPayloads, ShmStreamServer, ShmStreamTransport
+from .test_stream import ThreadedServer
+
+
+def make_dispatcher():
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda value: value[::-1], 'reverse')
+
+    @dispatcher.rpc_method
+    def reverse_attachment(jarpc_request):
+        attachment = jarpc_request.attachments[0]
+        # request frame is not copied out of shared memory
+        assert isinstance(attachment, memoryview)
+        return JarpcAttachedResult(result=None, attachments=[bytes(attachment)[::-1]])
+
+    return dispatcher
+
+
+def segment_exists(name):
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    segment.close()
+    return True
+
+
+def get_segment_names(payloads):
+    return list(payloads._busy) + [segment.name for segments in payloads._free.values() for segment in segments]
+
+
+class TestSharedMemoryPayloads:
+
+    def test_small_payload(self):
+        payloads = SharedMemoryPayloads(threshold=100)
+        assert payloads.encode([b'abc']) == [b'abc']
+        assert payloads.decode(b'abc') == b'abc'
+
+    def test_large_payload(self):
+        sender, receiver = SharedMemoryPayloads(threshold=4), SharedMemoryPayloads(threshold=4)
+        encoded = b''.join(sender.encode([b'abc', bytearray(b'def')]))
+        assert len(encoded) < 64
+        assert receiver.decode(encoded) == b'abcdef'
+        # segment is released once payload is copied, and reused by the next payload
+        encoded = b''.join(sender.encode([b'ghijkl']))
+        assert receiver.decode(encoded) == b'ghijkl'
+        assert sender.stats['created'] == 1 and sender.stats['reused'] == 1
+        sender.close()
+        receiver.close()
+
+    def test_borrow(self):
+        sender, receiver = SharedMemoryPayloads(threshold=4), SharedMemoryPayloads(threshold=4)
+        frame = pack_frame(b'{}', [b'abcdef'])
+        encoded = b''.join(sender.encode([frame]))
+        view = receiver.decode(encoded, borrow=True)
+        assert isinstance(view, memoryview) and view == frame
+        # segment of borrowed payload is not reused
+        sender.encode([frame])
+        assert sender.stats['created'] == 2
+        receiver.release(encoded)
+        sender.sweep()
+        assert sender.stats['busy'] == 1 and sender.stats['free'] == 1
+        view.release()
+        sender.close()
+        receiver.close()
+
+    def test_pool_size(self):
+        sender, receiver = SharedMemoryPayloads(threshold=4, pool_size=1), SharedMemoryPayloads(threshold=4)
+        encoded = [b''.join(sender.encode([b'abcdef'])) for _ in range(2)]
+        names = get_segment_names(sender)
+        for payload in encoded:
+            receiver.release(payload)
+        sender.sweep()
+        assert sender.stats['free'] == 1
+        assert [segment_exists(name) for name in names].count(True) == 1
+        sender.close()
+        receiver.close()
+
+    def test_claim_timeout(self):
+        payloads = SharedMemoryPayloads(threshold=4, claim_timeout=0)
+        payloads.encode([b'abcdef'])
+        name, = get_segment_names(payloads)
+        payloads.sweep()
+        # receiver may still read unreleased segment, so it is unlinked rather than reused
+        assert not segment_exists(name)
+        assert not get_segment_names(payloads)
+
+    def test_close(self):
+        payloads = SharedMemoryPayloads(threshold=4)
+        payloads.encode([b'abcdef'])
+        payloads.encode([b'abcdef'])
+        names = get_segment_names(payloads)
+        assert len(names) == 2
+        payloads.close()
+        assert not any(segment_exists(name) for name in names)
+
+
+class UnclaimedShmStreamTransport(AsyncShmStreamTransport):
+    def _encode_payload(self, correlation_id, payload_parts):
+        payload_parts = super()._encode_payload(correlation_id, payload_parts)
+        # segment is unlinked before server attaches to it
+        self.shm_payloads.close()
+        return payload_parts
+
+
+@pytest.mark.asyncio
+class TestShmStream:
+
+    @pytest.mark.parametrize('size', [10, 100000])
+    async def test_async_call(self, tmp_path, size):
+        path = str(tmp_path / 'jarpc.sock')
+        server = ShmStreamServer(AsyncJarpcManager(make_dispatcher()), threshold=1024)
+        await server.start_unix(path)
+        transport = AsyncShmStreamTransport(path=path, threshold=1024)
+        client = AsyncJarpcClient(transport=transport)
+
+        value = 'ab' * size
+        for _ in range(3):
+            assert await client.reverse(value=value) == value[::-1]
+        if size > 1024:
+            # segments are reused by both sides
+            assert transport.shm_payloads.stats['created'] == 1
+            assert server.shm_payloads.stats['created'] == 1
+
+        await transport.close()
+        await server.close()
+        assert not get_segment_names(server.shm_payloads)
+
+    async def test_attachments(self, tmp_path):
+        path = str(tmp_path / 'jarpc.sock')
+        server = ShmStreamServer(AsyncJarpcManager(make_dispatcher()), threshold=1024)
+        await server.start_unix(path)
+        transport = AsyncShmStreamTransport(path=path, threshold=1024)
+        client = AsyncJarpcClient(transport=transport)
+
+        attachment = bytes(range(256)) * 1000
+        for _ in range(3):
+            response = await client(method='reverse_attachment', params={}, attachments=[attachment])
+            assert bytes(response.attachments[0]) == attachment[::-1]
+        assert transport.shm_payloads.stats['created'] == 1
+
+        await transport.close()
+        await server.close()
+
+    async def test_payload_unavailable(self, tmp_path):
+        path = str(tmp_path / 'jarpc.sock')
+        server = ShmStreamServer(AsyncJarpcManager(make_dispatcher()), threshold=1024)
+        await server.start_unix(path)
+        transport = UnclaimedShmStreamTransport(path=path, threshold=1024)
+        client = AsyncJarpcClient(transport=transport)
+
+        with pytest.raises(JarpcServerError):
+            await client.reverse(value='ab' * 1000)
+
+        await transport.close()
+        await server.close()
+
+
+def test_sync_call(tmp_path):
+    path = str(tmp_path / 'jarpc.sock')
+    server = ShmStreamServer(AsyncJarpcManager(make_dispatcher()), threshold=1024)
+    with ThreadedServer(server, path):
+        transport = ShmStreamTransport(path=path, threshold=1024)
+        client = JarpcClient(transport=transport)
+        value = 'ab' * 100000
+        for _ in range(3):
+            assert client.reverse(value=value) == value[::-1]
+        assert transport.shm_payloads.stats['created'] == 1
+        transport.close()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from ..jarpc import (AdaptiveCompressor, AsyncJarpcClient, AsyncJarpcManager, JarpcAttachedResult, JarpcClient,
+                     JarpcDispatcher, JarpcManager, JarpcParseError, JarpcServerError, JarpcTimeout)
+from ..jarpc.stream import AsyncStreamTransport, JarpcStreamServer, StreamTransport, message_parts
+
+
+def make_dispatcher(log):
+    dispatcher = JarpcDispatcher()
+
+    @dispatcher.rpc_method
+    async def sleep(delay, value):
+        await asyncio.sleep(delay)
+        log.append(value)
+        return value
+
+    @dispatcher.rpc_method
+    def reverse(jarpc_request):
+        return JarpcAttachedResult(result=len(jarpc_request.attachments),
+                                   attachments=[bytes(part)[::-1] for part in jarpc_request.attachments])
+
+    return dispatcher
+
+
+async def failing_handle(request):
+    raise RuntimeError('manager failed')
+
+
+class StreamSetup:
+    """Server and transport connected over TCP or Unix socket. """
+
+    def __init__(self, kind, tmp_path):
+        self.kind = kind
+        self.path = str(tmp_path / 'jarpc.sock')
+        self.log = []
+        self.server = JarpcStreamServer(AsyncJarpcManager(make_dispatcher(self.log)))
+        self.transport = None
+
+    async def __aenter__(self):
+        if self.kind == 'tcp':
+            listener = await self.server.start(host='127.0.0.1', port=0)
+            self.transport = AsyncStreamTransport(host='127.0.0.1', port=listener.sockets[0].getsockname()[1])
+        else:
+            await self.server.start_unix(self.path)
+            self.transport = AsyncStreamTransport(path=self.path)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.transport.close()
+        await self.server.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('kind', ['tcp', 'unix'])
+class TestStream:
+
+    async def test_call(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+            assert await client.sleep(delay=0, value='result') == 'result'
+
+    async def test_pipelining(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            results = await asyncio.gather(*(client.sleep(delay=delay, value=delay) for delay in (0.3, 0.2, 0.1, 0)))
+            assert results == [0.3, 0.2, 0.1, 0]
+            # handled concurrently over single connection, responses are sent out of order
+            assert setup.log == [0, 0.1, 0.2, 0.3]
+
+    async def test_notification(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            assert await client(method='sleep', params={'delay': 0, 'value': 'notified'}, rsvp=False) is None
+            assert await client.sleep(delay=0.1, value='called') == 'called'
+            assert setup.log == ['notified', 'called']
+
+    async def test_attachments(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            result = await client(method='reverse', params={}, attachments=[b'abc', b'de'])
+            assert result.result == 2
+            assert [bytes(part) for part in result.attachments] == [b'cba', b'ed']
+
+    async def test_timeout(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            with pytest.raises(JarpcTimeout):
+                await client(method='sleep', params={'delay': 1, 'value': None}, ttl=0.1)
+            with pytest.raises(JarpcTimeout):
+                await client(method='sleep', params={'delay': 1, 'value': None}, timeout=0.1)
+
+    async def test_compression(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            setup.server.manager.compressor = AdaptiveCompressor(threshold=100)
+            compressor = AdaptiveCompressor(threshold=100)
+            client = AsyncJarpcClient(transport=setup.transport, compressor=compressor)
+
+            value = 'salad ' * 1000
+            for _ in range(2):
+                assert await client.sleep(delay=0, value=value) == value
+            assert compressor.stats['compressed'] == 1
+            assert setup.server.manager.compressor.stats['compressed'] == 2
+
+    async def test_remote_cancellation(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport, cancel_remote=True)
+            manager = setup.server.manager
+
+            with pytest.raises(JarpcTimeout):
+                await client(method='sleep', params={'delay': 0.3, 'value': 'abandoned'}, timeout=0.1)
+            await asyncio.sleep(0.05)
+            assert manager.in_flight == {}
+            await asyncio.sleep(0.3)
+            assert setup.log == []
+
+    async def test_connection_lost(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+            await client.sleep(delay=0, value=None)
+
+            for writer in setup.server._connections:
+                writer.close()
+            with pytest.raises(JarpcServerError):
+                await client.sleep(delay=0.5, value=None)
+            # transport reconnects
+            assert await client.sleep(delay=0, value='again') == 'again'
+
+    async def test_close_drains(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            call = asyncio.ensure_future(client.sleep(delay=0.2, value='drained'))
+            await asyncio.sleep(0.05)
+            started = time.monotonic()
+            await setup.server.close()
+            assert time.monotonic() - started >= 0.1
+            assert await call == 'drained'
+
+    async def test_close_answers_read_messages(self, kind, tmp_path):
+        setup = StreamSetup(kind, tmp_path)
+        setup.server.max_concurrency = 1
+        async with setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            # the second message is read only when the first call is done, after closing started
+            calls = [asyncio.ensure_future(client.sleep(delay=0.1, value=i)) for i in range(2)]
+            await asyncio.sleep(0.05)
+            await setup.server.close()
+            assert await asyncio.gather(*calls) == [0, 1]
+
+    async def test_invalid_utf8(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            writer = await setup.transport._get_writer()
+            future = asyncio.get_event_loop().create_future()
+            setup.transport._pending['raw'] = deque([future])
+            writer.writelines(message_parts('raw', [b'{"method": "\xff"}']))
+            response = json.loads(await asyncio.wait_for(future, 1.0))
+            assert response['error']['code'] == JarpcParseError.code
+
+    async def test_manager_failure(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            setup.server.manager.handle = failing_handle
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            # caller gets error response instead of waiting until timeout
+            with pytest.raises(JarpcServerError, match='manager failed'):
+                await client(method='sleep', params={'delay': 0, 'value': None}, ttl=10)
+
+    async def test_long_correlation_id(self, kind, tmp_path):
+        async with StreamSetup(kind, tmp_path) as setup:
+            client = AsyncJarpcClient(transport=setup.transport)
+
+            with pytest.raises(JarpcServerError, match='Correlation id is too long'):
+                await client(method='sleep', params={'delay': 0, 'value': None}, id='x' * 0x10000)
+            assert not setup.transport._pending
+            assert await client.sleep(delay=0, value='result') == 'result'
+
+
+class ThreadedServer:
+    """Stream server running its own event loop in background thread. """
+
+    def __init__(self, server, path):
+        self.server = server
+        self.path = path
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start_unix(self.path), self.loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class TestSyncStream:
+
+    @pytest.mark.parametrize('is_async_manager', [False, True])
+    def test_call(self, tmp_path, is_async_manager):
+        log = []
+        dispatcher = make_dispatcher(log)
+        dispatcher.add_rpc_method(lambda value: value, 'echo')
+        manager = AsyncJarpcManager(dispatcher) if is_async_manager else JarpcManager(dispatcher)
+        path = str(tmp_path / 'jarpc.sock')
+
+        with ThreadedServer(JarpcStreamServer(manager), path):
+            transport = StreamTransport(path=path)
+            client = JarpcClient(transport=transport)
+            assert client.echo(value='result') == 'result'
+            assert client(method='echo', params={'value': 'notified'}, rsvp=False) is None
+            result = client(method='reverse', params={}, attachments=[b'abc'])
+            assert bytes(result.attachments[0]) == b'cba'
+            transport.close()
+
+    def test_timeout(self, tmp_path):
+        path = str(tmp_path / 'jarpc.sock')
+        with ThreadedServer(JarpcStreamServer(AsyncJarpcManager(make_dispatcher([]))), path):
+            transport = StreamTransport(path=path)
+            client = JarpcClient(transport=transport)
+            with pytest.raises(JarpcTimeout):
+                client(method='sleep', params={'delay': 0.5, 'value': 'late'}, timeout=0.1)
+            with pytest.raises(JarpcTimeout):
+                client(method='sleep', params={'delay': 0, 'value': 'expired'}, ts=time.time() - 2, ttl=1)
+            # connection is reopened after timeout
+            assert client.sleep(delay=0, value='result') == 'result'
+            transport.close()
+
+    def test_connection_refused(self, tmp_path):
+        client = JarpcClient(transport=StreamTransport(path=str(tmp_path / 'missing.sock')))
+        with pytest.raises(JarpcServerError):
+            client.sleep(delay=0, value=None)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from ..jarpc import (AsyncJarpcClient, AsyncJarpcManager, AsyncLoopbackTransport, InMemoryExporter, JarpcClient,
+                     JarpcDispatcher, JarpcInvalidRequest, JarpcManager, JarpcRequest, JarpcServerError,
+                     JsonLinesExporter, LoopbackTransport, TraceContext, Tracer, get_trace_context)
+from ..jarpc.tracing import UNSAMPLED
+
+
+def make_client(is_async, dispatcher, client_tracer=None, manager_tracer=None):
+    if is_async:
+        manager = AsyncJarpcManager(dispatcher, tracer=manager_tracer)
+        return AsyncJarpcClient(AsyncLoopbackTransport(manager), tracer=client_tracer)
+    manager = JarpcManager(dispatcher, tracer=manager_tracer)
+    return JarpcClient(LoopbackTransport(manager), tracer=client_tracer)
+
+
+async def call(client, *args, **kwargs):
+    result = client(*args, **kwargs)
+    if isinstance(client, AsyncJarpcClient):
+        result = await result
+    return result
+
+
+def make_chain(is_async, tracer):
+    """Client calling "order" which calls "cook" of another manager. """
+    kitchen_dispatcher = JarpcDispatcher()
+    kitchen_dispatcher.add_rpc_method(lambda: get_trace_context().header, 'cook')
+    kitchen = make_client(is_async, kitchen_dispatcher, tracer, tracer)
+
+    dispatcher = JarpcDispatcher()
+    if is_async:
+        async def order():
+            return await kitchen(method='cook', params={})
+    else:
+        def order():
+            return kitchen(method='cook', params={})
+    dispatcher.add_rpc_method(order)
+    return make_client(is_async, dispatcher, tracer, tracer)
+
+
+@pytest.mark.asyncio
+class TestTracing:
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_propagation(self, is_async):
+        exporter = InMemoryExporter()
+        client = make_chain(is_async, Tracer(exporter))
+        await call(client, method='order', params={})
+
+        spans = exporter.get_spans()
+        assert [(span.kind, span.name) for span in spans] == [
+            ('server', 'cook'), ('client', 'cook'), ('server', 'order'), ('client', 'order'),
+        ]
+        assert len({span.trace_id for span in spans}) == 1
+        assert spans[3].parent_id is None
+        for child, parent in zip(spans, spans[1:]):
+            assert child.parent_id == parent.span_id
+        assert all(span.duration > 0 for span in spans)
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_sampling_at_root(self, is_async):
+        exporter = InMemoryExporter()
+        client = make_chain(is_async, Tracer(exporter))
+        # servers sampling every trace they start don't sample traces started unsampled
+        client._tracer = Tracer(exporter, sample_rate=0)
+        header = await call(client, method='order', params={})
+        assert header == UNSAMPLED.header
+        assert not exporter.get_spans()
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_propagation_without_tracers(self, is_async):
+        exporter = InMemoryExporter()
+        tracer = Tracer(exporter)
+        client = make_chain(is_async, None)
+        with tracer.span('job', user='chef') as span:
+            header = await call(client, method='order', params={})
+        assert header == TraceContext(span.trace_id, span.span_id, True).header
+        assert exporter.get_spans() == [span]
+        assert span.attributes == {'user': 'chef'}
+        assert get_trace_context() is None
+
+    @pytest.mark.parametrize('is_async', [False, True])
+    async def test_error(self, is_async):
+        def fail():
+            raise JarpcServerError('failed')
+        dispatcher = JarpcDispatcher()
+        dispatcher.add_rpc_method(fail)
+        exporter = InMemoryExporter()
+        tracer = Tracer(exporter)
+        client = make_client(is_async, dispatcher, tracer, tracer)
+        with pytest.raises(JarpcServerError):
+            await call(client, method='fail', params={})
+        assert [span.error for span in exporter.get_spans()] == ['-32000 Server error', '-32000 Server error']
+
+
+def test_json_lines_exporter(tmp_path):
+    path = str(tmp_path / 'spans.jsonl')
+    exporter = JsonLinesExporter(path, service='kitchen')
+    tracer = Tracer(exporter)
+    with tracer.span('outer'):
+        with tracer.span('inner'):
+            pass
+    exporter.close()
+    with open(path) as f:
+        spans = [json.loads(line) for line in f]
+    assert [span['name'] for span in spans] == ['inner', 'outer']
+    assert spans[0]['parent_id'] == spans[1]['span_id']
+    assert all(span['service'] == 'kitchen' for span in spans)
+
+
+def test_request_field():
+    header = TraceContext('a' * 32, 'b' * 16, True).header
+    request = JarpcRequest(method='cook', params={}, trace=header)
+    assert JarpcRequest.from_json(request.serialize()).trace == header
+    assert 'trace' not in JarpcRequest(method='cook', params={}).data
+    with pytest.raises(JarpcInvalidRequest):
+        JarpcRequest.from_data({**request.data, 'trace': 1})
+    assert TraceContext.from_header('bad') is None
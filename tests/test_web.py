@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from ..jarpc import (AdaptiveCompressor, AsyncJarpcManager, JarpcAttachedResult, JarpcDispatcher, JarpcManager,
+                     JarpcRequest, compress_payload, decompress_payload, pack_request, unpack_response)
+from ..jarpc.web import JarpcAsgiApp, JarpcWsgiApp
+
+
+def make_dispatcher():
+    dispatcher = JarpcDispatcher()
+    dispatcher.add_rpc_method(lambda value: value, 'echo')
+
+    @dispatcher.rpc_method
+    def reverse(jarpc_request):
+        return JarpcAttachedResult(result=None, attachments=[bytes(jarpc_request.attachments[0])[::-1]])
+
+    return dispatcher
+
+
+def make_body(rsvp=True, value='value'):
+    return JarpcRequest(method='echo', params={'value': value}, rsvp=rsvp).serialize().encode()
+
+
+def call_wsgi(app, body, method='POST', content_length=True):
+    environ = {'REQUEST_METHOD': method, 'wsgi.input': io.BytesIO(body)}
+    if content_length:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    setup_testing_defaults(environ)
+    started = {}
+
+    def start_response(status, headers):
+        started.update(status=status, headers=dict(headers))
+
+    body = b''.join(app(environ, start_response))
+    return started['status'], started['headers'], body
+
+
+async def call_asgi(app, body, method='POST', chunk_size=None):
+    chunk_size = chunk_size or len(body) or 1
+    messages = [{'type': 'http.request', 'body': body[i:i + chunk_size], 'more_body': i + chunk_size < len(body)}
+                for i in range(0, max(len(body), 1), chunk_size)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'headers': [(b'content-length', str(len(body)).encode())]}
+    await app(scope, receive, send)
+    assert sent[0]['type'] == 'http.response.start'
+    assert not sent[-1].get('more_body', False)
+    assert all(isinstance(message['body'], bytes) for message in sent[1:])
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(message['body'] for message in sent[1:])
+
+
+class TestWsgi:
+
+    @pytest.mark.parametrize('content_length', [True, False])
+    def test_call(self, content_length):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()))
+        status, headers, body = call_wsgi(app, make_body(), content_length=content_length)
+        assert status == '200 OK'
+        assert headers['Content-Type'] == 'application/json; charset=utf-8'
+        assert json.loads(body)['result'] == 'value'
+
+    def test_chunks(self):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()), chunk_size=10)
+        status, headers, body = call_wsgi(app, make_body(value='x' * 100))
+        assert int(headers['Content-Length']) == len(body)
+        assert json.loads(body)['result'] == 'x' * 100
+
+    def test_notification(self):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()))
+        status, headers, body = call_wsgi(app, make_body(rsvp=False))
+        assert status == '204 No Content'
+        assert body == b''
+
+    def test_frame(self):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()))
+        frame = pack_request(JarpcRequest(method='reverse', params={}, attachments=[b'abc']))
+        status, headers, body = call_wsgi(app, frame)
+        assert headers['Content-Type'] == 'application/octet-stream'
+        assert bytes(unpack_response(body).attachments[0]) == b'cba'
+
+    def test_compression(self):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher(), compressor=AdaptiveCompressor(threshold=100)))
+        request = JarpcRequest(method='echo', params={'value': 'x' * 1000}, compression=['zlib'])
+        status, headers, body = call_wsgi(app, compress_payload(request.serialize().encode(), 'zlib'))
+        assert headers['Content-Type'] == 'application/octet-stream'
+        assert json.loads(decompress_payload(body))['result'] == 'x' * 1000
+
+    def test_method_not_allowed(self):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()))
+        status, headers, body = call_wsgi(app, b'', method='GET')
+        assert status == '405 Method Not Allowed'
+
+    @pytest.mark.parametrize('content_length', [True, False])
+    def test_too_large(self, content_length):
+        app = JarpcWsgiApp(JarpcManager(make_dispatcher()), max_body_size=10)
+        status, headers, body = call_wsgi(app, make_body(), content_length=content_length)
+        assert status == '413 Payload Too Large'
+
+
+@pytest.mark.asyncio
+class TestAsgi:
+
+    @pytest.mark.parametrize('chunk_size', [None, 7])
+    async def test_call(self, chunk_size):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()))
+        status, headers, body = await call_asgi(app, make_body(), chunk_size=chunk_size)
+        assert status == 200
+        assert headers[b'content-type'] == b'application/json; charset=utf-8'
+        assert json.loads(body)['result'] == 'value'
+
+    async def test_large_response(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()), chunk_size=10)
+        status, headers, body = await call_asgi(app, make_body(value='x' * 100))
+        assert int(headers[b'content-length']) == len(body)
+        assert json.loads(body)['result'] == 'x' * 100
+
+    async def test_notification(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()))
+        status, headers, body = await call_asgi(app, make_body(rsvp=False))
+        assert status == 204
+        assert body == b''
+
+    async def test_frame(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()))
+        frame = pack_request(JarpcRequest(method='reverse', params={}, attachments=[b'abc']))
+        status, headers, body = await call_asgi(app, frame)
+        assert headers[b'content-type'] == b'application/octet-stream'
+        assert bytes(unpack_response(body).attachments[0]) == b'cba'
+
+    async def test_compression(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher(), compressor=AdaptiveCompressor(threshold=100)))
+        request = JarpcRequest(method='echo', params={'value': 'x' * 1000}, compression=['zlib'])
+        status, headers, body = await call_asgi(app, compress_payload(request.serialize().encode(), 'zlib'))
+        assert headers[b'content-type'] == b'application/octet-stream'
+        assert json.loads(decompress_payload(body))['result'] == 'x' * 1000
+
+    async def test_method_not_allowed(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()))
+        status, headers, body = await call_asgi(app, b'', method='GET')
+        assert status == 405
+
+    async def test_too_large(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()), max_body_size=10)
+        status, headers, body = await call_asgi(app, make_body())
+        assert status == 413
+
+    async def test_disconnect(self):
+        manager = AsyncJarpcManager(make_dispatcher())
+        handled = []
+        manager.handle = lambda body: handled.append(body)
+        messages = [{'type': 'http.request', 'body': make_body()[:10], 'more_body': True}, {'type': 'http.disconnect'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await JarpcAsgiApp(manager)({'type': 'http', 'method': 'POST', 'headers': []}, receive, send)
+        assert not handled and not sent
+
+    async def test_lifespan(self):
+        app = JarpcAsgiApp(AsyncJarpcManager(make_dispatcher()))
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await app({'type': 'lifespan'}, receive, send)
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']